@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-🚀 GTI Cache Manager - In-Memory Caching System
+🚀 GTI Cache Manager - In-Memory Caching System (L1) + Redis dùng chung (L2, tùy chọn)
 Optimize performance cho stock analysis và market scanning
 """
 
+import asyncio
+import threading
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 from config import GTIConfig
 import json
+import functools
 import hashlib
+import orjson
+
+try:
+    import redis  # Tùy chọn: cache dùng chung giữa các worker khi đặt REDIS_URL
+except ImportError:
+    redis = None
 
 class GTICacheManager:
     """
@@ -19,12 +28,34 @@ class GTICacheManager:
     
     def __init__(self):
         self.cache: Dict[str, Dict] = {}
+        # Thread task scan và event loop cùng ghi cache → mọi thao tác trên self.cache/total_bytes đi qua lock
+        # (RLock: _store_local gọi lại _remove/_evict_over_budget khi đang giữ lock)
+        self.lock = threading.RLock()
         self.enabled = GTIConfig.ENABLE_CACHE
         self.default_expiry = GTIConfig.CACHE_EXPIRY_MINUTES * 60  # Convert to seconds
         self.single_stock_cache = GTIConfig.CACHE_SINGLE_STOCK_RESULTS
+        self.max_bytes = GTIConfig.CACHE_MAX_BYTES
+        self.total_bytes = 0  # Tổng kích thước các payload bytes (JSON đã encode) đang giữ
+        self.redis = None
+        self.l1_hits = 0    # Hit trong memory của process
+        self.l2_hits = 0    # Hit từ Redis (worker khác đã tính)
+        self.misses = 0
+        self._stats_snapshot = None  # (monotonic_ts, stats) - get_stats giữ kết quả ngắn hạn
+        
+        if GTIConfig.REDIS_URL:
+            if redis is None:
+                print("⚠️ REDIS_URL đã đặt nhưng chưa cài redis (pip install redis) - dùng cache trong process")
+            else:
+                # Timeout ngắn: Redis treo thì coi như miss, không giữ thread/request chờ mãi
+                self.redis = redis.Redis.from_url(
+                    GTIConfig.REDIS_URL,
+                    socket_timeout=GTIConfig.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=GTIConfig.REDIS_SOCKET_TIMEOUT
+                )
         
         print(f"🚀 GTI Cache Manager initialized")
         print(f"   Cache enabled: {self.enabled}")
+        print(f"   Backend: {'memory + redis' if self.redis else 'memory'}")
         print(f"   Default expiry: {GTIConfig.CACHE_EXPIRY_MINUTES} minutes")
         print(f"   Single stock cache: {self.single_stock_cache}")
     
@@ -48,22 +79,63 @@ class GTICacheManager:
             return None
         
         cache_key = self._generate_cache_key(operation, **kwargs)
+        hit, data = self._get_local(cache_key, operation)
+        return data if hit else self._get_remote(cache_key, operation, kwargs)
+    
+    async def aget(self, operation: str, **kwargs) -> Optional[Any]:
+        """
+        🔍 get() cho handler async: L1 tra ngay trên event loop, chỉ round-trip Redis chạy trong thread
+        """
+        if not self.enabled:
+            return None
         
-        if cache_key in self.cache:
-            cache_entry = self.cache[cache_key]
-            
-            # Kiểm tra expiry
-            if time.time() < cache_entry['expires_at']:
-                cache_entry['hits'] += 1
-                cache_entry['last_accessed'] = time.time()
-                
-                print(f"✅ Cache HIT for {operation} (hits: {cache_entry['hits']})")
-                return cache_entry['data']
-            else:
-                # Expired, remove from cache
-                del self.cache[cache_key]
-                print(f"⏰ Cache EXPIRED for {operation}")
+        cache_key = self._generate_cache_key(operation, **kwargs)
+        hit, data = self._get_local(cache_key, operation)
+        if hit:
+            return data
+        if self.redis is None:
+            return self._get_remote(cache_key, operation, kwargs)
+        return await asyncio.to_thread(self._get_remote, cache_key, operation, kwargs)
+    
+    def _get_local(self, cache_key: str, operation: str) -> tuple:
+        """🔍 Tra L1 → (hit, data)"""
+        with self.lock:
+            cache_entry = self.cache.get(cache_key)
+            expired = False
+            if cache_entry is not None:
+                # Kiểm tra expiry
+                if time.time() < cache_entry['expires_at']:
+                    cache_entry['hits'] += 1
+                    cache_entry['last_accessed'] = time.time()
+                    self.l1_hits += 1
+                    hits = cache_entry['hits']
+                else:
+                    # Expired, remove from cache
+                    self._remove(cache_key)
+                    cache_entry, expired = None, True
+        
+        if cache_entry is not None:
+            print(f"✅ Cache HIT for {operation} (hits: {hits})")
+            return True, cache_entry['data']
+        if expired:
+            print(f"⏰ Cache EXPIRED for {operation}")
+        return False, None
+    
+    def _get_remote(self, cache_key: str, operation: str, kwargs: Dict) -> Optional[Any]:
+        """🔍 L1 miss → hỏi Redis, hit thì nạp lại vào memory cho các request sau (blocking I/O)"""
+        if self.redis is not None:
+            try:
+                raw, ttl = self.redis.pipeline().get(cache_key).ttl(cache_key).execute()
+                if raw is not None:
+                    data = self._decode(raw)
+                    self._store_local(cache_key, operation, data, ttl if ttl > 0 else self.default_expiry, kwargs)
+                    self.l2_hits += 1
+                    print(f"✅ Cache HIT for {operation} (redis)")
+                    return data
+            except redis.RedisError as e:
+                print(f"⚠️ Redis GET lỗi: {e}")
         
+        self.misses += 1
         return None
     
     def set(self, operation: str, data: Any, expiry_seconds: int = None, **kwargs):
@@ -78,24 +150,86 @@ class GTICacheManager:
         
         cache_key = self._generate_cache_key(operation, **kwargs)
         
-        self.cache[cache_key] = {
-            'data': data,
-            'created_at': time.time(),
-            'expires_at': time.time() + expiry_seconds,
-            'last_accessed': time.time(),
-            'hits': 0,
-            'operation': operation,
-            'params': kwargs
-        }
+        if self.redis is not None:
+            try:
+                self.redis.setex(cache_key, expiry_seconds, self._encode(data))
+            except redis.RedisError as e:
+                print(f"⚠️ Redis SET lỗi, chỉ lưu trong process: {e}")
         
+        self._store_local(cache_key, operation, data, expiry_seconds, kwargs)
         print(f"💾 Cache SET for {operation} (expire in {expiry_seconds}s)")
+    
+    async def aset(self, operation: str, data: Any, expiry_seconds: int = None, **kwargs):
+        """💾 set() cho handler async: có Redis thì ghi trong thread, không chặn event loop"""
+        if self.redis is None:
+            self.set(operation, data, expiry_seconds, **kwargs)
+        else:
+            await asyncio.to_thread(functools.partial(self.set, operation, data, expiry_seconds, **kwargs))
+    
+    def _store_local(self, cache_key: str, operation: str, data: Any, expiry_seconds: int, params: Dict):
+        """💾 Ghi entry vào L1 (memory) - có Redis thì giữ tối đa CACHE_L1_MAX_SECONDS để bớt lệch giữa worker"""
+        if self.redis is not None:
+            expiry_seconds = min(expiry_seconds, GTIConfig.CACHE_L1_MAX_SECONDS)
         
-        # Cleanup old entries nếu cache quá lớn
-        self._cleanup_if_needed()
+        size = len(data) if isinstance(data, (bytes, bytearray)) else 0
+        with self.lock:
+            self._remove(cache_key)
+            self.total_bytes += size
+            self.cache[cache_key] = {
+                'data': data,
+                'size': size,
+                'created_at': time.time(),
+                'expires_at': time.time() + expiry_seconds,
+                'last_accessed': time.time(),
+                'hits': 0,
+                'operation': operation,
+                'params': params
+            }
+            
+            # Cleanup old entries nếu cache quá lớn
+            self._cleanup_if_needed()
+            self._evict_over_budget()
+    
+    @staticmethod
+    def _encode(data: Any) -> bytes:
+        """📦 Payload Redis: b'B' + bytes có sẵn, hoặc b'J' + orjson của object"""
+        if isinstance(data, (bytes, bytearray)):
+            return b'B' + bytes(data)
+        return b'J' + orjson.dumps(
+            data, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+    
+    @staticmethod
+    def _decode(raw: bytes) -> Any:
+        return raw[1:] if raw[:1] == b'B' else orjson.loads(raw[1:])
+    
+    def _remove(self, cache_key: str):
+        """🗑️ Xóa một entry và trừ kích thước payload khỏi tổng (gọi khi đang giữ self.lock)"""
+        entry = self.cache.pop(cache_key, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+    
+    def _evict_over_budget(self):
+        """
+        🧹 Giữ tổng payload bytes dưới CACHE_MAX_BYTES - bỏ entry lâu chưa dùng nhất (LRU)
+        (gọi khi đang giữ self.lock)
+        """
+        while self.total_bytes > self.max_bytes:
+            lru_key = min(
+                (key for key, entry in self.cache.items() if entry['size']),
+                key=lambda key: self.cache[key]['last_accessed'],
+                default=None
+            )
+            if lru_key is None:
+                # Không còn entry có kích thước mà tổng vẫn vượt → tổng bị lệch, đặt lại cho khớp
+                self.total_bytes = 0
+                break
+            print(f"🧹 Cache over {self.max_bytes} bytes: evicting {self.cache[lru_key]['operation']}")
+            self._remove(lru_key)
     
     def _cleanup_if_needed(self):
         """
-        🧹 Dọn dẹp cache nếu quá lớn (> 1000 entries)
+        🧹 Dọn dẹp cache nếu quá lớn (> 1000 entries) - gọi khi đang giữ self.lock
         """
         if len(self.cache) > 1000:
             print("🧹 Cache cleanup: removing expired and least used entries...")
@@ -109,7 +243,7 @@ class GTICacheManager:
             ]
             
             for key in expired_keys:
-                del self.cache[key]
+                self._remove(key)
             
             # If still too many, remove least used
             if len(self.cache) > 800:
@@ -120,7 +254,7 @@ class GTICacheManager:
                 
                 # Remove bottom 200 entries
                 for key, _ in sorted_by_hits[:200]:
-                    del self.cache[key]
+                    self._remove(key)
             
             print(f"   Cache size after cleanup: {len(self.cache)}")
     
@@ -131,16 +265,41 @@ class GTICacheManager:
         if not self.enabled:
             return
         
+        self._stats_snapshot = None
         if operation is None:
             # Clear all cache
-            self.cache.clear()
+            with self.lock:
+                self.cache.clear()
+                self.total_bytes = 0
+            self._delete_redis("gti_*")
             print("🗑️ All cache cleared")
+        elif not kwargs:
+            # Xóa mọi entry của operation (mọi bộ tham số)
+            with self.lock:
+                for cache_key in [key for key, entry in self.cache.items() if entry['operation'] == operation]:
+                    self._remove(cache_key)
+            self._delete_redis(f"gti_{operation}_" + "?" * 8)
+            print(f"🗑️ Cache invalidated for {operation}")
         else:
             cache_key = self._generate_cache_key(operation, **kwargs)
-            if cache_key in self.cache:
-                del self.cache[cache_key]
+            self._delete_redis(cache_key)
+            with self.lock:
+                removed = cache_key in self.cache
+                self._remove(cache_key)
+            if removed:
                 print(f"🗑️ Cache invalidated for {operation}")
     
+    def _delete_redis(self, pattern: str):
+        """🗑️ SCAN MATCH pattern → DEL trên Redis (nếu có)"""
+        if self.redis is None:
+            return
+        try:
+            keys = list(self.redis.scan_iter(match=pattern))
+            if keys:
+                self.redis.delete(*keys)
+        except redis.RedisError as e:
+            print(f"⚠️ Redis DEL lỗi: {e}")
+    
     def get_stats(self) -> Dict:
         """
         📊 Thống kê cache performance
@@ -148,32 +307,47 @@ class GTICacheManager:
         if not self.enabled:
             return {"cache_enabled": False}
         
+        # Dashboard poll /cache/stats, /system/performance liên tục → dùng lại snapshot vài giây
+        snapshot = self._stats_snapshot
+        if snapshot is not None and time.monotonic() - snapshot[0] < GTIConfig.CACHE_STATS_TTL_SECONDS:
+            return snapshot[1]
+        
         current_time = time.time()
-        total_entries = len(self.cache)
+        with self.lock:
+            entries = list(self.cache.values())
+        total_entries = len(entries)
         expired_entries = sum(
-            1 for entry in self.cache.values()
+            1 for entry in entries
             if current_time > entry['expires_at']
         )
         
-        total_hits = sum(entry['hits'] for entry in self.cache.values())
+        total_hits = sum(entry['hits'] for entry in entries)
         
         operations = {}
-        for entry in self.cache.values():
+        for entry in entries:
             op = entry['operation']
             if op not in operations:
                 operations[op] = {'count': 0, 'hits': 0}
             operations[op]['count'] += 1
             operations[op]['hits'] += entry['hits']
         
-        return {
+        stats = {
             "cache_enabled": True,
+            "backend": "memory + redis" if self.redis is not None else "memory",
             "total_entries": total_entries,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
             "expired_entries": expired_entries,
             "valid_entries": total_entries - expired_entries,
             "total_hits": total_hits,
             "operations": operations,
-            "memory_usage_estimate": f"{total_entries * 0.5:.1f} KB"
+            "memory_usage_estimate": f"{total_entries * 0.5:.1f} KB",
+            "encoded_payload_bytes": self.total_bytes,
+            "max_payload_bytes": self.max_bytes
         }
+        self._stats_snapshot = (time.monotonic(), stats)
+        return stats
 
 # Global cache instance
 gti_cache = GTICacheManager()
@@ -214,10 +388,11 @@ def cache_market_scan(category: str, min_gti_score: int = 2, min_combined_score:
         'min_combined_score': min_combined_score
     }
     
-    # Try to get from cache first
-    cached_result = gti_cache.get('market_scan', **cache_key_params)
-    if cached_result:
-        return cached_result
+    # Try to get from cache first (lưu dạng JSON bytes - gọn hơn nhiều so với dict lồng nhau)
+    # /market-scan cache sẵn bytes response → chỉ decode ở đây khi response chưa có (VD limit khác)
+    cached_blob = gti_cache.get('market_scan', **cache_key_params)
+    if cached_blob:
+        return orjson.loads(cached_blob)
     
     # If not in cache, compute and store
     from lay_data_stock import market_scan_by_category
@@ -226,7 +401,36 @@ def cache_market_scan(category: str, min_gti_score: int = 2, min_combined_score:
     
     if result and 'scan_results' in result:
         # Cache market scans for longer (5 minutes default)
-        gti_cache.set('market_scan', result, **cache_key_params)
+        blob = orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        gti_cache.set('market_scan', blob, **cache_key_params)
+    
+    return result
+
+def cache_comprehensive_analysis(stock_symbol: str, market_context: dict = None):
+    """
+    🚀 Cache wrapper cho comprehensive GTI analysis (key theo mã + ngày giao dịch)
+    """
+    cache_key_params = {
+        'stock_symbol': stock_symbol.upper(),
+        'trading_day': datetime.now().strftime("%Y-%m-%d")
+    }
+    
+    # Try to get from cache first
+    cached_result = gti_cache.get('comprehensive_analysis', **cache_key_params)
+    if cached_result:
+        return cached_result
+    
+    # If not in cache, compute and store
+    from lay_data_stock import comprehensive_gti_analysis
+    
+    result = comprehensive_gti_analysis(stock_symbol.upper(), market_context=market_context)
+    
+    if result and result.get('status') == 'success':
+        gti_cache.set(
+            'comprehensive_analysis', result,
+            expiry_seconds=GTIConfig.ANALYSIS_CACHE_EXPIRY_SECONDS,
+            **cache_key_params
+        )
     
     return result
 
@@ -247,4 +451,4 @@ if __name__ == "__main__":
     stats = gti_cache.get_stats()
     print(f"Cache stats: {stats}")
     
-    print("✅ Cache manager test completed!") 
\ No newline at end of file
+    print("✅ Cache manager test completed!") 
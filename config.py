@@ -16,11 +16,15 @@ class GTIConfig:
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
     # Support both PORT (Render) and API_PORT (local development)
     API_PORT = int(os.getenv("PORT", os.getenv("API_PORT", 8000)))
+    # Số process uvicorn (WEB_CONCURRENCY). Mặc định 1: task_manager (và gti_cache nếu không đặt REDIS_URL) nằm trong
+    # bộ nhớ từng process, nhiều worker thì task_id chỉ tra được ở worker đã tạo ra nó
+    UVICORN_WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
     
     # 📊 Stock Data Configuration
     DEFAULT_START_DATE = "2024-01-01"
     DEFAULT_END_DATE = datetime.now().strftime("%Y-%m-%d")
     VNSTOCK_SOURCE = "VCI"
+    SYMBOL_PATTERN = r"^[A-Za-z0-9]{3,10}$"  # Mã cổ phiếu hợp lệ (chữ/số, 3-10 ký tự) - router và file cache giá
     DATA_HISTORY_DAYS = 365
     
     # 🔧 GTI System Parameters
@@ -68,7 +72,27 @@ class GTIConfig:
     # 🚀 Performance Configuration
     ENABLE_CACHE = True
     CACHE_EXPIRY_MINUTES = 5
+    CACHE_MAX_BYTES = 50 * 1024 * 1024  # Trần tổng dung lượng các payload JSON đã encode trong cache (LRU)
+    REDIS_URL = os.getenv("REDIS_URL")  # Đặt để dùng chung gti_cache và trạng thái task giữa nhiều worker (cần pip install redis)
+    REDIS_SOCKET_TIMEOUT = 1.0          # Giây - timeout kết nối/đọc Redis (quá hạn → coi như cache miss)
+    CACHE_STATS_TTL_SECONDS = 2         # Snapshot gti_cache.get_stats() dùng lại trong 2 giây
+    CACHE_L1_MAX_SECONDS = 60           # Khi có Redis: entry trong memory mỗi worker giữ tối đa 60s rồi hỏi lại Redis
+    TASK_TTL_SECONDS = 3600             # Trạng thái/kết quả task scan bất đồng bộ giữ 1 giờ
+    TASK_MAX_WORKERS = int(os.getenv("GTI_TASK_WORKERS", 3))  # Số scan nền chạy đồng thời mỗi process
+    TASK_BULK_WORKERS = int(os.getenv("GTI_TASK_BULK_WORKERS", 1))  # Pool riêng cho custom_scan danh sách lớn
+    TASK_BULK_MIN_STOCKS = 20           # custom_scan từ 20 mã trở lên chạy ở pool bulk
+    TASK_STREAM_INTERVAL_SECONDS = 1    # /market-scan/stream: chu kỳ kiểm tra thay đổi trạng thái task
+    TASK_PROGRESS_PERSIST_SECONDS = 2   # Tiến trình task ghi lên Redis tối đa mỗi 2 giây
+    TASK_ACTIVE_LEASE_SECONDS = 60      # Lease gộp task trùng (gti_task_active), gia hạn khi task còn chạy
+    GZIP_MINIMUM_SIZE = 1024            # Chỉ nén response JSON từ 1KB trở lên
+    GZIP_COMPRESS_LEVEL = 5             # Mức nén gzip (1-9) - cân bằng CPU và dung lượng
+    ANALYSIS_CACHE_EXPIRY_SECONDS = 900  # Cache phân tích từng mã 15 phút (trong ngày giao dịch)
+    SCAN_RESPONSE_CACHE_SECONDS = 300    # Cache response các endpoint /market-scan/* cùng tham số 5 phút
+    QUICK_CHECK_CACHE_SECONDS = 300      # Memo /market-scan/quick-check(-batch) theo (mã, ngày giao dịch)
     MAX_CONCURRENT_REQUESTS = 10
+    BATCH_ANALYSIS_MAX_SYMBOLS = 50       # Tối đa 50 mã trong một request batch (/full-analysis-batch, /phan-tich/batch)
+    BATCH_ANALYSIS_CONCURRENCY = 8       # Số phân tích chạy đồng thời (giới hạn session vnstock)
+    VNSTOCK_IO_WORKERS = 20              # Thread pool riêng cho các lần tải dữ liệu vnstock từ endpoint async
     
     # 🔍 Market Scanning Configuration - RATE LIMIT PROTECTED
     MARKET_SCAN_BATCH_SIZE = 8          # Giảm từ 30 xuống 8 để tránh rate limiting
@@ -89,15 +113,25 @@ class GTIConfig:
     ENABLE_PROGRESSIVE_TIMEOUT = True   # Tăng timeout dần cho scans lớn
     TOP_PICKS_QUICK_MODE = True         # Mode nhanh cho top picks
     CACHE_SINGLE_STOCK_RESULTS = True   # Cache kết quả từng mã để giảm API calls
+    ENABLE_PRICE_DISK_CACHE = True      # Lưu OHLCV từng mã xuống đĩa, chỉ tải phần dữ liệu mới
+    PRICE_CACHE_DIR = "cache"           # Thư mục lưu file giá (cache/{MÃ}.json + {MÃ}.meta.json)
+    ENABLE_ADAPTIVE_WORKERS = True      # Tự điều chỉnh max_workers theo tỷ lệ I/O/CPU đo được
+    ADAPTIVE_WORKERS_MIN_SAMPLES = 5    # Số lần scan tối thiểu trước khi dùng tỷ lệ đo được
+    MAX_ADAPTIVE_WORKERS = 32           # Trần số worker (rate limiter vẫn kiểm soát tốc độ gọi API)
+    ENABLE_SCAN_PROCESS_POOL = True     # Tính GTI/pattern khi scan trên process pool, thread pool chỉ lo tải dữ liệu
+    SCAN_CPU_WORKERS = None             # Số process tính toán (None = os.cpu_count())
     
     # 📱 API Endpoints
     ENDPOINTS = {
         "root": "/",
         "basic_analysis": "/phan-tich/{ma_co_phieu}",
         "full_analysis": "/full-analysis/{ma_co_phieu}",
+        "full_analysis_batch": "/full-analysis-batch",  # 🆕 POST danh sách mã
+        "phan_tich_batch": "/phan-tich/batch",          # 🆕 POST danh sách mã (GTI cơ bản)
         "market_scan": "/market-scan",              # 🆕 ENDPOINT MỚI
         "market_scan_vn30": "/market-scan/vn30",    # 🆕 SCAN VN30
         "market_scan_custom": "/market-scan/custom", # 🆕 SCAN CUSTOM LIST
+        "quick_check_batch": "/market-scan/quick-check-batch",  # 🆕 POST danh sách mã (quick check)
         "gti_info": "/gti-info",
         "patterns_info": "/patterns-info",
         "docs": "/docs",
@@ -11,17 +11,77 @@ try:
     import ta
     import pandas as pd
     import numpy as np
-    from datetime import datetime, timedelta
+    from datetime import date, datetime, timedelta
     print("Đã import thành công thư viện ta, pandas, numpy và datetime")
 except ImportError:
     print("Chưa cài đặt thư viện ta, pandas hoặc numpy. Vui lòng chạy: pip install ta pandas numpy")
     import sys
     sys.exit(1)
 
+import asyncio
 import concurrent.futures
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
 import time
+from typing import Optional
 from config import GTIConfig
-from rate_limiter import rate_limited_call, rate_limiter
+from rate_limiter import is_rate_limit_error, rate_limited_call, rate_limited_call_async
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=2)
+def _date_range(today_iso: str) -> tuple:
+    """📅 (start_date, end_date) cho cửa sổ 1 năm - chỉ tính lại khi sang ngày mới"""
+    today = date.fromisoformat(today_iso)
+    return (today - timedelta(days=365)).isoformat(), today_iso
+
+def one_year_window(now: datetime = None) -> tuple:
+    """
+    📅 Khoảng thời gian lấy dữ liệu (1 năm tính đến hôm nay hoặc đến `now` đã lấy sẵn).
+    Cùng một chuỗi ngày trong cả ngày → key cache (fetch_bars, gti_cache) ổn định giữa các request.
+    """
+    today = now.date() if now is not None else date.today()
+    return _date_range(today.isoformat())
+
+# 📊 Các cột giá mà pipeline GTI/pattern sử dụng ('time' là cột ngày của vnstock)
+PRICE_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+def _snapshot_latest_row(df: pd.DataFrame) -> dict:
+    """
+    📌 Snapshot phiên gần nhất thành dict Python một lần duy nhất.
+    Tra cứu dict nhanh hơn nhiều so với `Series.__getitem__` cho từng cột.
+    """
+    return df.iloc[-1].to_dict()
+
+def _vnstock_history(ma_co_phieu: str, start_date: str, end_date: str):
+    """Gọi trực tiếp vnstock (blocking, chưa qua rate limiter)"""
+    # Chỉ đo request vnstock thực sự (không gồm chờ token, cache hit) → tỷ lệ I/O/CPU cho adaptive workers
+    started = time.perf_counter()
+    try:
+        stock = Vnstock().stock(symbol=ma_co_phieu, source='VCI')
+        return stock.quote.history(start=start_date, end=end_date, interval='1D')
+    finally:
+        _record_scan_timing("fetch", time.perf_counter() - started)
+
+def _price_frame(df, ma_co_phieu: str):
+    if df is not None and not df.empty:
+        print("Lấy dữ liệu thành công!")
+        # Chỉ giữ các cột pipeline dùng → các bước pandas phía sau copy ít dữ liệu hơn
+        return df[[col for col in PRICE_COLUMNS if col in df.columns]]
+    print(f"Không có dữ liệu cho mã {ma_co_phieu} trong khoảng thời gian yêu cầu.")
+    return None
+
+def _log_fetch_error(e: Exception):
+    if is_rate_limit_error(e):
+        print(f"🛡️ Rate limit đã được xử lý bởi rate limiter: {e}")
+    else:
+        print(f"Lỗi khi lấy dữ liệu: {e}")
+    print("Có thể thử lại sau hoặc kiểm tra lại mã cổ phiếu")
 
 def lay_du_lieu_co_phieu_vnstock(ma_co_phieu: str, start_date: str = "2023-01-01", end_date: str = "2024-12-31"):
     """
@@ -39,45 +99,230 @@ def lay_du_lieu_co_phieu_vnstock(ma_co_phieu: str, start_date: str = "2023-01-01
     print(f"Bắt đầu lấy dữ liệu cho mã: {ma_co_phieu} từ vnstock")
     print(f"Thời gian: từ {start_date} đến {end_date}")
     
-    def _vnstock_api_call():
-        """Internal function để gọi vnstock API"""
-        stock = Vnstock().stock(symbol=ma_co_phieu, source='VCI')
-        return stock.quote.history(start=start_date, end=end_date, interval='1D')
-    
     try:
         # 🛡️ Sử dụng rate-limited call để bảo vệ API
-        df = rate_limited_call(_vnstock_api_call)
-        
-        if df is not None and not df.empty:
-            print("Lấy dữ liệu thành công!")
-            return df
-        else:
-            print(f"Không có dữ liệu cho mã {ma_co_phieu} trong khoảng thời gian yêu cầu.")
-            return None
-            
+        return _price_frame(rate_limited_call(_vnstock_history, ma_co_phieu, start_date, end_date), ma_co_phieu)
     except Exception as e:
-        error_str = str(e).lower()
-        if "rate" in error_str or "limit" in error_str or "quota" in error_str:
-            print(f"🛡️ Rate limit đã được xử lý bởi rate limiter: {e}")
-        else:
-            print(f"Lỗi khi lấy dữ liệu: {e}")
-        print("Có thể thử lại sau hoặc kiểm tra lại mã cổ phiếu")
+        _log_fetch_error(e)
+        return None
+
+async def lay_du_lieu_vnstock_async(ma_co_phieu: str, start_date: str, end_date: str):
+    """
+    ⚡ Như lay_du_lieu_co_phieu_vnstock nhưng chờ token/backoff trên event loop;
+    thread I/O chỉ bị chiếm trong lúc request vnstock thực sự chạy.
+    """
+    print(f"Bắt đầu lấy dữ liệu cho mã: {ma_co_phieu} từ vnstock")
+    try:
+        df = await rate_limited_call_async(
+            _vnstock_history, ma_co_phieu, start_date, end_date, executor=_get_io_executor()
+        )
+        return _price_frame(df, ma_co_phieu)
+    except Exception as e:
+        _log_fetch_error(e)
+        return None
+
+def _bar_dates(df: pd.DataFrame) -> pd.Series:
+    """📅 Ngày giao dịch của từng phiên (cột 'time' của vnstock hoặc index)"""
+    if 'time' in df.columns:
+        return pd.to_datetime(df['time'])
+    return pd.Series(pd.to_datetime(df.index), index=df.index)
+
+_SYMBOL_RE = re.compile(GTIConfig.SYMBOL_PATTERN)
+
+def _price_cache_path(ma_co_phieu: str) -> Optional[str]:
+    """📁 cache/{MÃ}.json - None nếu mã sai định dạng hoặc đường dẫn thoát ra ngoài PRICE_CACHE_DIR"""
+    if not _SYMBOL_RE.match(ma_co_phieu):
+        return None
+    cache_dir = os.path.realpath(GTIConfig.PRICE_CACHE_DIR)
+    path = os.path.realpath(os.path.join(cache_dir, f"{ma_co_phieu.upper()}.json"))
+    return path if os.path.dirname(path) == cache_dir else None
+
+def _price_meta_path(path: str) -> str:
+    # File phụ cache/{MÃ}.meta.json: cache_start (ngày đầu đã tải đủ) + refreshed_at (lần hỏi vnstock cuối)
+    return f"{os.path.splitext(path)[0]}.meta.json"
+
+def _replace_file(path: str, text: str):
+    # Ghi file tạm rồi rename để tránh file dở dang
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _write_price_cache(path: str, df: pd.DataFrame, cache_start: str):
+    """💾 Ghi file cache giá dạng JSON (orient="table" giữ dtype) - đọc lại không chạy code như pickle"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _replace_file(path, df.to_json(orient="table", date_format="iso", index='time' not in df.columns))
+        # Meta ghi sau dữ liệu: meta chỉ mô tả file giá đã ghi xong
+        _replace_file(_price_meta_path(path), json.dumps({"cache_start": cache_start, "refreshed_at": time.time()}))
+    except Exception as e:
+        print(f"⚠️ Không ghi được cache giá {path}: {e}")
+
+def _read_price_cache(path: str):
+    """📂 (DataFrame, meta) từ cache/{MÃ}.json - (None, {}) nếu chưa có hoặc file lỗi"""
+    try:
+        with open(_price_meta_path(path), encoding="utf-8") as f:
+            meta = json.load(f)
+        return pd.read_json(path, orient="table"), meta
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️ File cache giá lỗi {path}: {e}")
+    return None, {}
+
+def load_or_refresh(ma_co_phieu: str, start_date: str, end_date: str):
+    """
+    💾 Lấy dữ liệu giá có cache trên đĩa.
+    Lần đầu tải đủ từ vnstock; các lần sau chỉ tải các phiên mới sau ngày cuối đã lưu.
+    Trả về cùng dạng DataFrame như lay_du_lieu_co_phieu_vnstock (hoặc None).
+    """
+    if not GTIConfig.ENABLE_PRICE_DISK_CACHE:
+        return lay_du_lieu_co_phieu_vnstock(ma_co_phieu, start_date, end_date)
+    
+    path = _price_cache_path(ma_co_phieu)
+    if path is None:
+        print(f"⚠️ Mã cổ phiếu không hợp lệ: {ma_co_phieu!r}")
+        return None
+    
+    cached, meta = _read_price_cache(path)
+    
+    # Cache không có hoặc không phủ được start_date → tải lại toàn bộ
+    if cached is None or cached.empty or meta.get('cache_start', '9999-12-31') > start_date:
+        df = lay_du_lieu_co_phieu_vnstock(ma_co_phieu, start_date, end_date)
+        if df is not None:
+            _write_price_cache(path, df, start_date)
+        return df
+    
+    # Chỉ tải phần delta từ phiên cuối đã lưu (tải lại phiên cuối vì có thể chưa chốt)
+    last_date = _bar_dates(cached).max().strftime("%Y-%m-%d")
+    # Phiên hôm nay vừa được làm mới (chưa quá ANALYSIS_CACHE_EXPIRY_SECONDS) → không gọi vnstock
+    fresh = (
+        last_date == date.today().strftime("%Y-%m-%d") and
+        time.time() - meta.get('refreshed_at', 0) < GTIConfig.ANALYSIS_CACHE_EXPIRY_SECONDS
+    )
+    if last_date <= end_date and not fresh:
+        delta = lay_du_lieu_co_phieu_vnstock(ma_co_phieu, last_date, end_date)
+        if delta is not None and not delta.empty:
+            merged = pd.concat([cached, delta], ignore_index='time' in cached.columns)
+            merged_dates = _bar_dates(merged)
+            # Bỏ phiên trùng và các phiên cũ hơn cửa sổ đang dùng → file không phình mãi
+            keep = (~merged_dates.duplicated(keep='last') & (merged_dates >= pd.Timestamp(start_date))).to_numpy()
+            cached = merged[keep]
+            _write_price_cache(path, cached, start_date)
+    
+    dates = _bar_dates(cached)
+    in_range = (
+        (dates >= pd.Timestamp(start_date)) &
+        (dates < pd.Timestamp(end_date) + timedelta(days=1))
+    ).to_numpy()
+    df = cached[in_range]
+    return df if not df.empty else None
+
+@functools.lru_cache(maxsize=256)
+def _fetch_bars_cached(ma_co_phieu: str, start_date: str, end_date: str, time_bucket: int):
+    df = load_or_refresh(ma_co_phieu, start_date, end_date)
+    if df is None or df.empty:
+        raise LookupError(ma_co_phieu)  # lru_cache không lưu exception → lần sau thử tải lại
+    return df
+
+def fetch_bars(ma_co_phieu: str, start_date: str, end_date: str):
+    """
+    📦 Dữ liệu giá dùng chung giữa /full-analysis, /full-analysis-legacy và các endpoint một mã.
+    Memo theo (mã, khoảng ngày, khung ANALYSIS_CACHE_EXPIRY_SECONDS) để hai pipeline
+    gọi liên tiếp không tải/dựng lại cùng một DataFrame. Không sửa trực tiếp DataFrame trả về.
+    """
+    time_bucket = int(time.time() // GTIConfig.ANALYSIS_CACHE_EXPIRY_SECONDS)
+    try:
+        return _fetch_bars_cached(ma_co_phieu.upper(), start_date, end_date, time_bucket)
+    except LookupError:
         return None
 
+# 🌐 Thread pool riêng cho I/O vnstock - không tranh chỗ với các tác vụ CPU
+# chạy qua asyncio.to_thread (pool mặc định chỉ có cpu_count + 4 thread)
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+def _get_io_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        with _io_executor_lock:
+            if _io_executor is None:
+                _io_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=GTIConfig.VNSTOCK_IO_WORKERS,
+                    thread_name_prefix="vnstock-io"
+                )
+    return _io_executor
+
+def shutdown_io_executor():
+    """🛑 Đóng thread pool I/O (gọi khi app shutdown)"""
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is not None:
+            _io_executor.shutdown(wait=False, cancel_futures=True)
+            _io_executor = None
+
+# 🧮 Process pool cho phần tính toán GTI/pattern của market scan - pandas giữ GIL
+# nên thread pool chỉ chồng được I/O, còn CPU phải chạy song song ở process riêng
+_cpu_executor = None
+_cpu_executor_lock = threading.Lock()
+
+def _get_cpu_executor() -> concurrent.futures.ProcessPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _cpu_executor_lock:
+            if _cpu_executor is None:
+                # Pool được tạo từ thread scan khi server đã có nhiều thread → không fork trực tiếp
+                # (process con có thể thừa hưởng lock đang bị giữ và treo). forkserver: process con fork
+                # từ một server sạch, đơn luồng; nền tảng không có forkserver dùng spawn.
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    mp_context = multiprocessing.get_context("forkserver")
+                    mp_context.set_forkserver_preload([__name__])
+                else:
+                    mp_context = multiprocessing.get_context("spawn")
+                _cpu_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=GTIConfig.SCAN_CPU_WORKERS or os.cpu_count(),
+                    mp_context=mp_context
+                )
+    return _cpu_executor
+
+def shutdown_cpu_executor():
+    """🛑 Đóng process pool tính toán (gọi khi app shutdown)"""
+    global _cpu_executor
+    with _cpu_executor_lock:
+        if _cpu_executor is not None:
+            _cpu_executor.shutdown(wait=False, cancel_futures=True)
+            _cpu_executor = None
+
+async def lay_du_lieu_async(ma_co_phieu: str, start_date: str, end_date: str, use_cache: bool = True):
+    """
+    ⚡ Bản async để endpoint lấy dữ liệu giá mà không block event loop.
+    use_cache=False gọi thẳng vnstock (dùng cho endpoint test dữ liệu).
+    """
+    if not use_cache:
+        return await lay_du_lieu_vnstock_async(ma_co_phieu, start_date, end_date)
+    return await run_in_io_executor(fetch_bars, ma_co_phieu, start_date, end_date)
+
+async def run_in_io_executor(func, *args):
+    """🌐 Chạy hàm blocking có gọi vnstock trên thread pool I/O riêng (không chiếm threadpool của FastAPI)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_io_executor(), func, *args)
+
 def tinh_toan_chi_bao_ky_thuat(df: pd.DataFrame):
     """
     Hàm này nhận vào một DataFrame và tính toán các chỉ báo kỹ thuật theo hệ thống GTI.
     """
     print("\nBắt đầu tính toán các chỉ báo kỹ thuật theo hệ thống GTI...")
     
-    # Tạo bản sao để tránh thay đổi dữ liệu gốc
+    # Bản sao duy nhất của pipeline: df đầu vào có thể là frame memo của fetch_bars (dùng chung).
+    # detect_free_patterns / detect_large_chart_patterns ghi tiếp trực tiếp vào bản sao này.
     df = df.copy()
+    # 📅 Bất biến cho các bước sau: index là DatetimeIndex ngày giao dịch (vnstock trả RangeIndex + cột 'time')
+    df.index = pd.DatetimeIndex(_bar_dates(df))
     
     # 1. Các đường EMA theo hệ thống GTI
-    df['EMA10'] = ta.trend.EMAIndicator(df['close'], window=10).ema_indicator()
-    df['EMA20'] = ta.trend.EMAIndicator(df['close'], window=20).ema_indicator()
-    df['EMA50'] = ta.trend.EMAIndicator(df['close'], window=50).ema_indicator()
-    df['EMA200'] = ta.trend.EMAIndicator(df['close'], window=200).ema_indicator()
+    # ewm trực tiếp (giống hệt ta.trend.EMAIndicator: adjust=False, NaN cho window-1 phiên đầu)
+    for span in (10, 20, 50, 200):
+        df[f'EMA{span}'] = df['close'].ewm(span=span, min_periods=span, adjust=False).mean()
     
     # 2. Tính toán khối lượng trung bình 20 phiên
     df['volume_avg_20'] = df['volume'].rolling(window=20).mean()
@@ -95,7 +340,8 @@ def tinh_toan_chi_bao_ky_thuat(df: pd.DataFrame):
     # 5. GTI Recent Breakout: Volume > 1.5x trung bình và giá tăng mạnh
     # Kiểm tra trong 5 phiên gần nhất có breakout không
     df['volume_breakout'] = df['volume'] > (df['volume_avg_20'] * 1.5)
-    df['price_increase'] = (df['close'] - df['close'].shift(1)) / df['close'].shift(1) > 0.03  # Tăng > 3%
+    prev_close = df['close'].shift(1)
+    df['price_increase'] = (df['close'] - prev_close) / prev_close > 0.03  # Tăng > 3%
     df['daily_breakout'] = df['volume_breakout'] & df['price_increase']
     df['gti_recent_breakout'] = df['daily_breakout'].rolling(window=5).max().fillna(False).astype(bool)
     
@@ -125,10 +371,9 @@ def tinh_toan_chi_bao_ky_thuat(df: pd.DataFrame):
         df['gti_is_pullback'].astype(int)
     )
     
-    # 10. GTI Signal: Tín hiệu mua/bán theo GTI
-    df['gti_signal'] = 'HOLD'
-    df.loc[df['gti_score'] >= 3, 'gti_signal'] = 'BUY'
-    df.loc[df['gti_score'] <= 1, 'gti_signal'] = 'AVOID'
+    # 10. GTI Signal: Tín hiệu mua/bán theo GTI (một lượt np.select thay vì gán cột rồi ghi đè 2 lần)
+    gti_score = df['gti_score'].to_numpy()
+    df['gti_signal'] = np.select([gti_score >= 3, gti_score <= 1], ['BUY', 'AVOID'], default='HOLD')
     
     print("Tính toán các chỉ báo GTI hoàn tất!")
     return df
@@ -137,96 +382,109 @@ def detect_free_patterns(df: pd.DataFrame):
     """
     Hàm miễn phí để detect các patterns phổ biến - không cần thư viện trả phí
     Hoàn toàn tự code dựa trên logic OHLC
+    ⚠️ Thêm cột trực tiếp vào df - truyền frame từ tinh_toan_chi_bao_ky_thuat
     """
     print("\nBắt đầu phát hiện patterns miễn phí...")
     
-    # Tạo bản sao
-    df = df.copy()
-    
-    # Tính toán các giá trị cơ bản
-    df['body_size'] = abs(df['close'] - df['open'])
-    df['total_range'] = df['high'] - df['low']
-    df['upper_shadow'] = df['high'] - df[['open', 'close']].max(axis=1)
-    df['lower_shadow'] = df[['open', 'close']].min(axis=1) - df['low']
-    df['is_bullish'] = df['close'] > df['open']
-    df['is_bearish'] = df['close'] < df['open']
-    
-    # 1. DOJI PATTERN (nến doji - open ≈ close)
-    df['pattern_doji'] = (df['body_size'] / df['total_range']) < 0.1
-    
-    # 2. HAMMER PATTERN (nến búa - shadow dưới dài)
-    df['pattern_hammer'] = (
-        (df['lower_shadow'] > 2 * df['body_size']) & 
-        (df['upper_shadow'] < df['body_size']) &
-        (df['total_range'] > 0)  # Tránh chia cho 0
-    )
-    
-    # 3. HANGING MAN (nến treo cổ - giống hammer nhưng ở đỉnh)
-    df['pattern_hanging_man'] = (
-        df['pattern_hammer'] & 
-        (df['close'] < df['close'].shift(1))  # Giá giảm so với phiên trước
+    # ⚡ Lấy OHLCV thành các mảng NumPy liên tục một lần (SoA), tính toán trên mảng
+    # rồi gắn cột mới trực tiếp vào df (frame của pipeline, không copy lại)
+    open_, high, low, close, volume = (
+        df[col].to_numpy(dtype=float) for col in ('open', 'high', 'low', 'close', 'volume')
     )
     
-    # 4. BULLISH ENGULFING (nến bao phủ tăng)
-    prev_bearish = df['is_bearish'].shift(1)
-    curr_bullish = df['is_bullish']
-    engulfs = (df['open'] <= df['close'].shift(1)) & (df['close'] >= df['open'].shift(1))
-    df['pattern_bullish_engulfing'] = prev_bearish & curr_bullish & engulfs
-    
-    # 5. BEARISH ENGULFING (nến bao phủ giảm)
-    prev_bullish = df['is_bullish'].shift(1)
-    curr_bearish = df['is_bearish']
-    engulfs_bear = (df['open'] >= df['close'].shift(1)) & (df['close'] <= df['open'].shift(1))
-    df['pattern_bearish_engulfing'] = prev_bullish & curr_bearish & engulfs_bear
-    
-    # 6. MORNING STAR (sao mai - 3 nến)
-    # Nến 1: bearish, Nến 2: doji/small body, Nến 3: bullish
-    cond1 = df['is_bearish'].shift(2)  # Nến 1 giảm
-    cond2 = (df['body_size'].shift(1) / df['total_range'].shift(1)) < 0.3  # Nến 2 thân nhỏ
-    cond3 = df['is_bullish']  # Nến 3 tăng
-    cond4 = df['close'] > df['close'].shift(2)  # Nến 3 cao hơn nến 1
-    df['pattern_morning_star'] = cond1 & cond2 & cond3 & cond4
-    
-    # 7. EVENING STAR (sao hôm - 3 nến)
-    cond1_eve = df['is_bullish'].shift(2)  # Nến 1 tăng
-    cond2_eve = (df['body_size'].shift(1) / df['total_range'].shift(1)) < 0.3  # Nến 2 thân nhỏ
-    cond3_eve = df['is_bearish']  # Nến 3 giảm
-    cond4_eve = df['close'] < df['close'].shift(2)  # Nến 3 thấp hơn nến 1
-    df['pattern_evening_star'] = cond1_eve & cond2_eve & cond3_eve & cond4_eve
-    
-    # 8. SUPPORT/RESISTANCE LEVELS (đơn giản)
-    window = 20
-    df['resistance_level'] = df['high'].rolling(window=window).max().shift(1)
-    df['support_level'] = df['low'].rolling(window=window).min().shift(1)
-    
-    # 9. BREAKOUT PATTERNS
-    df['pattern_resistance_breakout'] = (
-        (df['close'] > df['resistance_level']) & 
-        (df['volume'] > df['volume'].rolling(window=20).mean() * 1.2)  # Volume cao
-    )
-    
-    df['pattern_support_breakdown'] = (
-        (df['close'] < df['support_level']) & 
-        (df['volume'] > df['volume'].rolling(window=20).mean() * 1.2)  # Volume cao
-    )
+    def prev(values, periods=1):
+        """Giá trị của `periods` phiên trước (tương đương Series.shift)"""
+        out = np.empty_like(values)
+        out[:periods] = False if values.dtype == bool else np.nan
+        out[periods:] = values[:len(values) - periods]
+        return out
+    
+    cols = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Tính toán các giá trị cơ bản
+        body_size = np.abs(close - open_)
+        total_range = high - low
+        upper_shadow = high - np.maximum(open_, close)
+        lower_shadow = np.minimum(open_, close) - low
+        is_bullish = close > open_
+        is_bearish = close < open_
+        body_ratio = body_size / total_range
+        cols.update(
+            body_size=body_size, total_range=total_range,
+            upper_shadow=upper_shadow, lower_shadow=lower_shadow,
+            is_bullish=is_bullish, is_bearish=is_bearish
+        )
+        
+        # 1. DOJI PATTERN (nến doji - open ≈ close)
+        cols['pattern_doji'] = body_ratio < 0.1
+        
+        # 2. HAMMER PATTERN (nến búa - shadow dưới dài)
+        pattern_hammer = (
+            (lower_shadow > 2 * body_size) &
+            (upper_shadow < body_size) &
+            (total_range > 0)  # Tránh chia cho 0
+        )
+        cols['pattern_hammer'] = pattern_hammer
+        
+        # 3. HANGING MAN (nến treo cổ - giống hammer nhưng ở đỉnh)
+        prev_close = prev(close)
+        cols['pattern_hanging_man'] = pattern_hammer & (close < prev_close)  # Giá giảm so với phiên trước
+        
+        # 4. BULLISH ENGULFING (nến bao phủ tăng)
+        prev_open = prev(open_)
+        engulfs = (open_ <= prev_close) & (close >= prev_open)
+        cols['pattern_bullish_engulfing'] = prev(is_bearish) & is_bullish & engulfs
+        
+        # 5. BEARISH ENGULFING (nến bao phủ giảm)
+        engulfs_bear = (open_ >= prev_close) & (close <= prev_open)
+        cols['pattern_bearish_engulfing'] = prev(is_bullish) & is_bearish & engulfs_bear
+        
+        # 6. MORNING STAR (sao mai - 3 nến)
+        # Nến 1: bearish, Nến 2: doji/small body, Nến 3: bullish
+        small_middle_body = prev(body_ratio) < 0.3  # Nến 2 thân nhỏ
+        close_2_ago = prev(close, 2)
+        cols['pattern_morning_star'] = prev(is_bearish, 2) & small_middle_body & is_bullish & (close > close_2_ago)
+        
+        # 7. EVENING STAR (sao hôm - 3 nến)
+        cols['pattern_evening_star'] = prev(is_bullish, 2) & small_middle_body & is_bearish & (close < close_2_ago)
+        
+        # 8. SUPPORT/RESISTANCE LEVELS (đơn giản)
+        window = 20
+        resistance_level = df['high'].rolling(window=window).max().shift(1).to_numpy()
+        support_level = df['low'].rolling(window=window).min().shift(1).to_numpy()
+        cols['resistance_level'] = resistance_level
+        cols['support_level'] = support_level
+        
+        # 9. BREAKOUT PATTERNS
+        volume_avg_20 = df['volume'].rolling(window=20).mean().to_numpy()
+        high_volume = volume > volume_avg_20 * 1.2  # Volume cao
+        cols['pattern_resistance_breakout'] = (close > resistance_level) & high_volume
+        cols['pattern_support_breakdown'] = (close < support_level) & high_volume
+        
+        # 10. VOLUME SPIKE PATTERN
+        cols['volume_avg_20'] = volume_avg_20
+        cols['pattern_volume_spike'] = volume > (volume_avg_20 * 2)
+        
+        # 11. GAP PATTERNS
+        gap_up = low > prev(high)
+        gap_down = high < prev(low)
+        cols['gap_up'] = gap_up
+        cols['gap_down'] = gap_down
+        cols['pattern_gap_up'] = gap_up & is_bullish
+        cols['pattern_gap_down'] = gap_down & is_bearish
+        
+        # 12. SIMPLE TREND PATTERNS
+        close_4_ago = prev(close, 4)
+        trend_5d = np.where(np.isnan(close_4_ago), np.nan, (close > close_4_ago).astype(float))
+        cols['trend_5d'] = trend_5d
+        cols['pattern_strong_uptrend'] = (
+            (trend_5d == 1) &
+            (close > df['close'].rolling(10).mean().to_numpy()) &
+            (volume > volume_avg_20)
+        )
     
-    # 10. VOLUME SPIKE PATTERN
-    df['volume_avg_20'] = df['volume'].rolling(window=20).mean()
-    df['pattern_volume_spike'] = df['volume'] > (df['volume_avg_20'] * 2)
-    
-    # 11. GAP PATTERNS
-    df['gap_up'] = df['low'] > df['high'].shift(1)
-    df['gap_down'] = df['high'] < df['low'].shift(1)
-    df['pattern_gap_up'] = df['gap_up'] & df['is_bullish']
-    df['pattern_gap_down'] = df['gap_down'] & df['is_bearish']
-    
-    # 12. SIMPLE TREND PATTERNS
-    df['trend_5d'] = df['close'].rolling(5).apply(lambda x: 1 if x.iloc[-1] > x.iloc[0] else 0)
-    df['pattern_strong_uptrend'] = (
-        (df['trend_5d'] == 1) & 
-        (df['close'] > df['close'].rolling(10).mean()) &
-        (df['volume'] > df['volume_avg_20'])
-    )
+    for name, values in cols.items():
+        df[name] = values
     
     print("Phát hiện patterns miễn phí hoàn tất!")
     return df
@@ -314,168 +572,132 @@ def detect_large_chart_patterns(df: pd.DataFrame, lookback_window: int = 60):
     - Bull Flag / Bear Flag  
     - Base n' Break
     - Ascending/Descending Triangle
+    ⚠️ Thêm cột trực tiếp vào df - truyền frame từ detect_free_patterns
     """
     print("\n🔍 Bắt đầu phát hiện mẫu hình lớn...")
     
-    df = df.copy()
-    
     # Tính toán rolling max/min cho pattern detection
     df['rolling_high_20'] = df['high'].rolling(window=20).max()
     df['rolling_low_20'] = df['low'].rolling(window=20).min()
     df['rolling_high_60'] = df['high'].rolling(window=60).max()
     df['rolling_low_60'] = df['low'].rolling(window=60).min()
     
+    # ⚡ Các detector dưới đây được vector hóa: mỗi điều kiện "cửa sổ kết thúc tại i"
+    # được tính bằng rolling/shift một lần cho cả chuỗi thay vì cắt df.iloc từng phiên.
+    # Kết quả giống hệt vòng lặp cũ (cùng cửa sổ, cùng ngưỡng, cùng khoảng i hợp lệ).
+    n = len(df)
+    high, low, close, volume = df['high'], df['low'], df['close'], df['volume']
+    
+    def _valid_range(start, stop):
+        """Mask các vị trí i nằm trong range(start, stop) như vòng lặp gốc"""
+        mask = np.zeros(n, dtype=bool)
+        if stop > start:
+            mask[start:stop] = True
+        return mask
+    
     # 1. CUP & HANDLE PATTERN
-    def detect_cup_and_handle(df_local, window=50):
-        """Phát hiện mẫu hình Cup & Handle"""
-        patterns = []
-        
-        for i in range(window, len(df_local) - 10):
-            # Lấy dữ liệu trong window
-            data_window = df_local.iloc[i-window:i+10]
-            
-            # Tìm 2 đỉnh cao nhất (left rim, right rim)
-            high_peaks = data_window['high'].nlargest(3)
-            
-            if len(high_peaks) >= 2:
-                # Cup: có đáy sâu giữa 2 đỉnh
-                left_peak = high_peaks.iloc[0]
-                right_peak = high_peaks.iloc[1]
-                
-                # Cup depth should be 12-33% of left peak
-                cup_depth_ratio = (left_peak - data_window['low'].min()) / left_peak
-                
-                if 0.12 <= cup_depth_ratio <= 0.33:
-                    # Handle: pullback < 50% of cup depth
-                    handle_start = i
-                    recent_data = df_local.iloc[handle_start:handle_start+10]
-                    
-                    if len(recent_data) > 5:
-                        handle_depth = (recent_data['high'].max() - recent_data['low'].min()) / recent_data['high'].max()
-                        
-                        if handle_depth < (cup_depth_ratio * 0.5):
-                            patterns.append(i)
-        
-        return patterns
-    
-    cup_handle_patterns = detect_cup_and_handle(df)
-    df['pattern_cup_handle'] = False
-    if cup_handle_patterns:
-        for idx in cup_handle_patterns:
-            if idx < len(df):
-                df.iloc[idx, df.columns.get_loc('pattern_cup_handle')] = True
+    def detect_cup_and_handle(window=50):
+        """Phát hiện mẫu hình Cup & Handle (cửa sổ [i-window, i+10), handle [i, i+10))"""
+        # Cửa sổ kết thúc tại i+9 → rolling rồi shift(-9)
+        cup_high = high.rolling(window + 10).max().shift(-9)
+        cup_low = low.rolling(window + 10).min().shift(-9)
+        cup_depth_ratio = (cup_high - cup_low) / cup_high
+        
+        handle_high = high.rolling(10).max().shift(-9)
+        handle_low = low.rolling(10).min().shift(-9)
+        handle_depth = (handle_high - handle_low) / handle_high
+        
+        found = (
+            (cup_depth_ratio >= 0.12) & (cup_depth_ratio <= 0.33) &
+            (handle_depth < cup_depth_ratio * 0.5)
+        )
+        return found.to_numpy() & _valid_range(window, n - 10)
+    
+    df['pattern_cup_handle'] = detect_cup_and_handle()
     
     # 2. BULL FLAG PATTERN
-    def detect_bull_flag(df_local, window=30):
-        """Phát hiện mẫu hình Bull Flag"""
-        patterns = []
-        
-        for i in range(window, len(df_local) - 5):
-            # Flagpole: Strong upward move
-            flagpole_data = df_local.iloc[i-window:i-10]
-            recent_data = df_local.iloc[i-10:i]
-            
-            # Check for strong upward move (flagpole)
-            flagpole_gain = (flagpole_data['close'].iloc[-1] - flagpole_data['close'].iloc[0]) / flagpole_data['close'].iloc[0]
-            
-            if flagpole_gain > 0.15:  # At least 15% gain
-                # Flag: slight downward or sideways consolidation
-                flag_slope = (recent_data['close'].iloc[-1] - recent_data['close'].iloc[0]) / len(recent_data)
-                flag_range = (recent_data['high'].max() - recent_data['low'].min()) / recent_data['close'].mean()
-                
-                # Flag should be small consolidation
-                if -0.08 <= flag_slope <= 0.03 and flag_range < 0.15:
-                    # Volume should decrease during flag
-                    volume_trend = recent_data['volume'].iloc[-3:].mean() < flagpole_data['volume'].iloc[-3:].mean()
-                    if volume_trend:
-                        patterns.append(i)
-        
-        return patterns
-    
-    bull_flag_patterns = detect_bull_flag(df)
-    df['pattern_bull_flag'] = False
-    if bull_flag_patterns:
-        for idx in bull_flag_patterns:
-            if idx < len(df):
-                df.iloc[idx, df.columns.get_loc('pattern_bull_flag')] = True
+    def detect_bull_flag(window=30):
+        """Phát hiện mẫu hình Bull Flag (flagpole [i-window, i-10), flag [i-10, i))"""
+        # Flagpole: Strong upward move (at least 15% gain)
+        flagpole_gain = (close.shift(11) - close.shift(window)) / close.shift(window)
+        
+        # Flag: slight downward or sideways consolidation
+        flag_slope = (close.shift(1) - close.shift(10)) / 10
+        flag_range = (
+            (high.rolling(10).max().shift(1) - low.rolling(10).min().shift(1)) /
+            close.rolling(10).mean().shift(1)
+        )
+        
+        # Volume should decrease during flag (3 phiên cuối flag vs 3 phiên cuối flagpole)
+        volume_avg_3 = volume.rolling(3).mean()
+        volume_trend = volume_avg_3.shift(1) < volume_avg_3.shift(11)
+        
+        found = (
+            (flagpole_gain > 0.15) &
+            (flag_slope >= -0.08) & (flag_slope <= 0.03) & (flag_range < 0.15) &
+            volume_trend
+        )
+        return found.to_numpy() & _valid_range(window, n - 5)
+    
+    df['pattern_bull_flag'] = detect_bull_flag()
     
     # 3. BASE N' BREAK PATTERN
-    def detect_base_n_break(df_local, window=40):
-        """Phát hiện mẫu hình Base n' Break"""
-        patterns = []
-        
-        for i in range(window, len(df_local) - 3):
-            base_data = df_local.iloc[i-window:i]
-            
-            # Base: tight sideways consolidation
-            base_range = (base_data['high'].max() - base_data['low'].min()) / base_data['close'].mean()
-            
-            # Base should be tight (< 20% range)
-            if base_range < 0.20:
-                # Check for decreasing volatility in base
-                early_base = base_data.iloc[:len(base_data)//2]
-                late_base = base_data.iloc[len(base_data)//2:]
-                
-                early_volatility = (early_base['high'] - early_base['low']).mean() / early_base['close'].mean()
-                late_volatility = (late_base['high'] - late_base['low']).mean() / late_base['close'].mean()
-                
-                # Volatility contraction
-                if late_volatility < early_volatility:
-                    # Breakout: price breaks above base resistance with volume
-                    resistance_level = base_data['high'].max()
-                    current_price = df_local.iloc[i]['close']
-                    current_volume = df_local.iloc[i]['volume']
-                    avg_volume = base_data['volume'].mean()
-                    
-                    if current_price > resistance_level and current_volume > (avg_volume * 1.5):
-                        patterns.append(i)
-        
-        return patterns
-    
-    base_break_patterns = detect_base_n_break(df)
-    df['pattern_base_n_break'] = False
-    if base_break_patterns:
-        for idx in base_break_patterns:
-            if idx < len(df):
-                df.iloc[idx, df.columns.get_loc('pattern_base_n_break')] = True
+    def detect_base_n_break(window=40):
+        """Phát hiện mẫu hình Base n' Break (base [i-window, i), breakout tại i)"""
+        half = window // 2
+        
+        # Base: tight sideways consolidation (< 20% range)
+        resistance_level = high.rolling(window).max().shift(1)
+        base_range = (resistance_level - low.rolling(window).min().shift(1)) / close.rolling(window).mean().shift(1)
+        
+        # Volatility contraction: nửa sau base biến động ít hơn nửa đầu
+        candle_range_avg = (high - low).rolling(half).mean()
+        close_avg = close.rolling(half).mean()
+        late_volatility = candle_range_avg.shift(1) / close_avg.shift(1)
+        early_volatility = candle_range_avg.shift(half + 1) / close_avg.shift(half + 1)
+        
+        # Breakout: price breaks above base resistance with volume
+        avg_volume = volume.rolling(window).mean().shift(1)
+        
+        found = (
+            (base_range < 0.20) &
+            (late_volatility < early_volatility) &
+            (close > resistance_level) & (volume > avg_volume * 1.5)
+        )
+        return found.to_numpy() & _valid_range(window, n - 3)
+    
+    df['pattern_base_n_break'] = detect_base_n_break()
     
     # 4. ASCENDING TRIANGLE
-    def detect_ascending_triangle(df_local, window=30):
-        """Phát hiện mẫu hình Ascending Triangle"""
-        patterns = []
-        
-        for i in range(window, len(df_local) - 5):
-            triangle_data = df_local.iloc[i-window:i]
-            
-            # Resistance: horizontal line (multiple touches at same level)
-            resistance_level = triangle_data['high'].max()
-            resistance_touches = len(triangle_data[triangle_data['high'] >= resistance_level * 0.99])
-            
-            # Support: rising trend line
-            lows = triangle_data['low']
-            time_index = range(len(lows))
-            
-            # Simple rising support check
-            first_quarter_low = lows.iloc[:len(lows)//4].min()
-            last_quarter_low = lows.iloc[-len(lows)//4:].min()
-            
-            if resistance_touches >= 2 and last_quarter_low > first_quarter_low:
-                # Breakout above resistance
-                current_price = df_local.iloc[i]['close']
-                current_volume = df_local.iloc[i]['volume']
-                avg_volume = triangle_data['volume'].mean()
-                
-                if current_price > resistance_level and current_volume > (avg_volume * 1.3):
-                    patterns.append(i)
-        
-        return patterns
+    def detect_ascending_triangle(window=30):
+        """Phát hiện mẫu hình Ascending Triangle (tam giác [i-window, i), breakout tại i)"""
+        found = np.zeros(n, dtype=bool)
+        if n <= window:
+            return found
+        
+        # Resistance: horizontal line (multiple touches at same level)
+        high_windows = np.lib.stride_tricks.sliding_window_view(high.to_numpy(dtype=float), window)[:-1]
+        resistance = high_windows.max(axis=1)
+        resistance_touches = (high_windows >= resistance[:, None] * 0.99).sum(axis=1)
+        
+        # Support: rising trend line (quý đầu vs quý cuối của cửa sổ)
+        first_quarter = window // 4            # lows.iloc[:len(lows)//4]
+        last_quarter = -((-window) // 4)       # lows.iloc[-len(lows)//4:]
+        first_quarter_low = low.rolling(first_quarter).min().shift(window - first_quarter + 1).to_numpy()[window:]
+        last_quarter_low = low.rolling(last_quarter).min().shift(1).to_numpy()[window:]
+        
+        # Breakout above resistance
+        current_price = close.to_numpy(dtype=float)[window:]
+        current_volume = volume.to_numpy(dtype=float)[window:]
+        avg_volume = volume.rolling(window).mean().shift(1).to_numpy()[window:]
+        
+        found[window:] = (
+            (resistance_touches >= 2) & (last_quarter_low > first_quarter_low) &
+            (current_price > resistance) & (current_volume > avg_volume * 1.3)
+        )
+        return found & _valid_range(window, n - 5)
     
-    ascending_triangle_patterns = detect_ascending_triangle(df)
-    df['pattern_ascending_triangle'] = False
-    if ascending_triangle_patterns:
-        for idx in ascending_triangle_patterns:
-            if idx < len(df):
-                df.iloc[idx, df.columns.get_loc('pattern_ascending_triangle')] = True
+    df['pattern_ascending_triangle'] = detect_ascending_triangle()
     
     print("✅ Hoàn thành phát hiện mẫu hình lớn!")
     return df
@@ -488,8 +710,7 @@ def get_market_context():
     
     try:
         # Lấy dữ liệu VNINDEX
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        start_date, end_date = one_year_window()
         
         vnindex_df = lay_du_lieu_co_phieu_vnstock("VNINDEX", start_date, end_date)
         
@@ -552,52 +773,61 @@ def get_market_context():
             "message": f"Lỗi phân tích thị trường: {str(e)}"
         }
 
+# Mapping mã cổ phiếu với ngành và mã đại diện
+SECTOR_MAPPING = {
+    # Banking
+    "ACB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "BID": {"sector": "Ngân hàng", "representative": "VCB"}, 
+    "CTG": {"sector": "Ngân hàng", "representative": "VCB"},
+    "HDB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "MBB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "STB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "TCB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "TPB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "VCB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "VPB": {"sector": "Ngân hàng", "representative": "VCB"},
+    "VIB": {"sector": "Ngân hàng", "representative": "VCB"},
+
+    # Real Estate
+    "VHM": {"sector": "Bất động sản", "representative": "VIC"},
+    "VIC": {"sector": "Bất động sản", "representative": "VIC"},
+    "VRE": {"sector": "Bất động sản", "representative": "VIC"},
+
+    # Technology
+    "FPT": {"sector": "Công nghệ", "representative": "FPT"},
+
+    # Steel
+    "HPG": {"sector": "Thép", "representative": "HPG"},
+
+    # Retail
+    "MWG": {"sector": "Bán lẻ", "representative": "MWG"},
+
+    # Oil & Gas
+    "GAS": {"sector": "Dầu khí", "representative": "GAS"},
+    "PLX": {"sector": "Dầu khí", "representative": "GAS"},
+
+    # Food & Beverage
+    "VNM": {"sector": "Thực phẩm", "representative": "VNM"},
+    "MSN": {"sector": "Thực phẩm", "representative": "VNM"},
+    "SAB": {"sector": "Thực phẩm", "representative": "VNM"},
+}
+
+# 🏷️ Mã → tên ngành (tra cứu tĩnh, không cần gọi vnstock)
+SECTOR_MAP = {symbol: info["sector"] for symbol, info in SECTOR_MAPPING.items()}
+
+def get_sector_name(stock_symbol: str):
+    """
+    🏷️ Tên ngành của mã cổ phiếu (None nếu chưa có trong mapping)
+    """
+    return SECTOR_MAP.get(stock_symbol.upper())
+
 def get_sector_analysis(stock_symbol: str):
     """
     🏭 Phân tích chỉ số ngành (đơn giản hoá - sử dụng các mã đại diện)
     """
     print(f"\n🏭 Đang phân tích ngành cho {stock_symbol}...")
     
-    # Mapping mã cổ phiếu với ngành và mã đại diện
-    sector_mapping = {
-        # Banking
-        "ACB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "BID": {"sector": "Ngân hàng", "representative": "VCB"}, 
-        "CTG": {"sector": "Ngân hàng", "representative": "VCB"},
-        "HDB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "MBB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "STB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "TCB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "TPB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "VCB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "VPB": {"sector": "Ngân hàng", "representative": "VCB"},
-        "VIB": {"sector": "Ngân hàng", "representative": "VCB"},
-        
-        # Real Estate
-        "VHM": {"sector": "Bất động sản", "representative": "VIC"},
-        "VIC": {"sector": "Bất động sản", "representative": "VIC"},
-        "VRE": {"sector": "Bất động sản", "representative": "VIC"},
-        
-        # Technology
-        "FPT": {"sector": "Công nghệ", "representative": "FPT"},
-        
-        # Steel
-        "HPG": {"sector": "Thép", "representative": "HPG"},
-        
-        # Retail
-        "MWG": {"sector": "Bán lẻ", "representative": "MWG"},
-        
-        # Oil & Gas
-        "GAS": {"sector": "Dầu khí", "representative": "GAS"},
-        "PLX": {"sector": "Dầu khí", "representative": "GAS"},
-        
-        # Food & Beverage
-        "VNM": {"sector": "Thực phẩm", "representative": "VNM"},
-        "MSN": {"sector": "Thực phẩm", "representative": "VNM"},
-        "SAB": {"sector": "Thực phẩm", "representative": "VNM"},
-    }
-    
-    sector_info = sector_mapping.get(stock_symbol.upper())
+    sector_info = SECTOR_MAPPING.get(stock_symbol.upper())
     
     if not sector_info:
         return {
@@ -607,8 +837,7 @@ def get_sector_analysis(stock_symbol: str):
     
     try:
         # Lấy dữ liệu mã đại diện ngành
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        start_date, end_date = one_year_window()
         
         sector_df = lay_du_lieu_co_phieu_vnstock(sector_info["representative"], start_date, end_date)
         
@@ -678,27 +907,81 @@ def prepare_news_search_context(stock_symbol: str, sector_name: str = None):
         "suggested_searches": list(search_contexts.values())
     }
 
-def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_date: str = None):
+# 🎯 Khuyến nghị GTI Pro v2.0 theo ngưỡng điểm tổng hợp (hằng số dùng chung)
+_REC_THRESHOLDS = (6, 4, 2, 0)
+_RECOMMENDATIONS = (
+    {
+        "level": "CỰC KỲ TÍCH CỰC", 
+        "action": "STRONG BUY",
+        "emoji": "🟢",
+        "position_size": "8-12% NAV",
+        "message": "Cơ hội đầu tư xuất sắc với điểm số cao"
+    },
+    {
+        "level": "RẤT TÍCH CỰC", 
+        "action": "CÂN NHẮC MUA",
+        "emoji": "🟢", 
+        "position_size": "5-8% NAV",
+        "message": "Cơ hội tốt, cân nhắc mua vào"
+    },
+    {
+        "level": "TÍCH CỰC", 
+        "action": "THEO DÕI",
+        "emoji": "🟡",
+        "position_size": "3-5% NAV", 
+        "message": "Theo dõi và chờ tín hiệu rõ hơn"
+    },
+    {
+        "level": "TRUNG TÍNH", 
+        "action": "CHỜ TÍN HIỆU",
+        "emoji": "🟠",
+        "position_size": "0-3% NAV",
+        "message": "Chưa có tín hiệu rõ ràng, chờ đợi"
+    },
+    {
+        "level": "TIÊU CỰC", 
+        "action": "TRÁNH XA",
+        "emoji": "🔴",
+        "position_size": "0% NAV", 
+        "message": "Tránh xa hoặc chờ cải thiện"
+    }
+)
+
+def _get_comprehensive_recommendation(combined_score: float) -> dict:
+    """
+    🎯 Chọn khuyến nghị theo bucket điểm (không mutate - dùng chung hằng số)
+    """
+    bucket_idx = next(
+        (i for i, threshold in enumerate(_REC_THRESHOLDS) if combined_score >= threshold),
+        len(_REC_THRESHOLDS)
+    )
+    return _RECOMMENDATIONS[bucket_idx]
+
+def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_date: str = None,
+                               market_context: dict = None):
     """
     🚀 Phân tích GTI Pro v2.0 TOÀN DIỆN:
     1. GTI Core (4 tiêu chí) + Enhanced Patterns (16 patterns)
     2. Market Context (VNINDEX) + Sector Analysis
     3. News Search Context cho ChatGPT
     4. Combined Scoring & Recommendations
+    
+    market_context: kết quả get_market_context() dùng chung cho cả batch;
+    nếu None sẽ tự lấy dữ liệu VNINDEX.
     """
     print(f"\n🚀 BẮT ĐẦU PHÂN TÍCH GTI PRO v2.0 TOÀN DIỆN CHO {stock_symbol}")
     print("="*80)
     
     # Tính toán thời gian mặc định
-    if not end_date:
-        end_date = datetime.now().strftime("%Y-%m-%d")
-    if not start_date:
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+    if not start_date or not end_date:
+        default_start, default_end = one_year_window()
+        start_date = start_date or default_start
+        end_date = end_date or default_end
     
     try:
         # BƯỚC 1: Lấy dữ liệu cơ bản
         print("📊 BƯỚC 1: Lấy dữ liệu cơ bản...")
-        df = lay_du_lieu_co_phieu_vnstock(stock_symbol, start_date, end_date)
+        df = fetch_bars(stock_symbol, start_date, end_date)
         
         if df is None or df.empty:
             return {
@@ -724,7 +1007,8 @@ def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_da
         
         # BƯỚC 6: Market Context Analysis
         print("🌊 BƯỚC 6: Phân tích Market Context...")
-        market_context = get_market_context()
+        if market_context is None:
+            market_context = get_market_context()
         
         # BƯỚC 7: Sector Analysis
         print("🏭 BƯỚC 7: Phân tích Sector...")
@@ -737,7 +1021,7 @@ def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_da
         
         # BƯỚC 9: Combined Scoring v2.0
         print("⚡ BƯỚC 9: Tính toán Enhanced Scoring...")
-        latest = df_patterns.iloc[-1]
+        latest = _snapshot_latest_row(df_patterns)
         
         # GTI Score (0-4) - ép kiểu về int Python
         gti_score = int(latest['gti_score']) if pd.notna(latest['gti_score']) else 0
@@ -750,7 +1034,7 @@ def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_da
         large_patterns = ['cup_handle', 'bull_flag', 'base_n_break', 'ascending_triangle']
         large_bullish_score = 0
         for pattern in large_patterns:
-            if f'pattern_{pattern}' in df_patterns.columns and latest[f'pattern_{pattern}']:
+            if latest.get(f'pattern_{pattern}'):
                 large_bullish_score += 2  # Large patterns worth 2 points each
         
         # Base Score: GTI + Basic + Large
@@ -777,51 +1061,12 @@ def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_da
         combined_score = base_score + market_adjustment + sector_adjustment
         
         # Enhanced Recommendations
-        if combined_score >= 6:
-            recommendation = {
-                "level": "CỰC KỲ TÍCH CỰC", 
-                "action": "STRONG BUY",
-                "emoji": "🟢",
-                "position_size": "8-12% NAV",
-                "message": "Cơ hội đầu tư xuất sắc với điểm số cao"
-            }
-        elif combined_score >= 4:
-            recommendation = {
-                "level": "RẤT TÍCH CỰC", 
-                "action": "CÂN NHẮC MUA",
-                "emoji": "🟢", 
-                "position_size": "5-8% NAV",
-                "message": "Cơ hội tốt, cân nhắc mua vào"
-            }
-        elif combined_score >= 2:
-            recommendation = {
-                "level": "TÍCH CỰC", 
-                "action": "THEO DÕI",
-                "emoji": "🟡",
-                "position_size": "3-5% NAV", 
-                "message": "Theo dõi và chờ tín hiệu rõ hơn"
-            }
-        elif combined_score >= 0:
-            recommendation = {
-                "level": "TRUNG TÍNH", 
-                "action": "CHỜ TÍN HIỆU",
-                "emoji": "🟠",
-                "position_size": "0-3% NAV",
-                "message": "Chưa có tín hiệu rõ ràng, chờ đợi"
-            }
-        else:
-            recommendation = {
-                "level": "TIÊU CỰC", 
-                "action": "TRÁNH XA",
-                "emoji": "🔴",
-                "position_size": "0% NAV", 
-                "message": "Tránh xa hoặc chờ cải thiện"
-            }
+        recommendation = _get_comprehensive_recommendation(combined_score)
         
         # BƯỚC 10: Tạo kết quả comprehensive
         result = {
             "status": "success",
-            "analysis_date": latest.name.strftime("%Y-%m-%d") if hasattr(latest.name, 'strftime') else str(latest.name),
+            "analysis_date": df_patterns.index[-1].strftime("%Y-%m-%d"),
             "stock_symbol": stock_symbol.upper(),
             "closing_price": round(float(latest['close']), 2),
             
@@ -889,84 +1134,185 @@ def comprehensive_gti_analysis(stock_symbol: str, start_date: str = None, end_da
             "message": f"Lỗi phân tích {stock_symbol}: {str(e)}"
         }
 
-def scan_single_stock(stock_symbol: str, min_gti_score: int = 2, min_combined_score: int = 3):
+# ⏱️ Thống kê thời gian I/O vs CPU (dùng cho adaptive max_workers):
+# fetch = một request vnstock thực sự, compute = phần tính toán của một mã (đo trong chính worker)
+_scan_timing = {"fetch_seconds": 0.0, "fetch_samples": 0, "compute_seconds": 0.0, "compute_samples": 0}
+_scan_timing_lock = threading.Lock()
+
+def _record_scan_timing(kind: str, seconds: float):
+    """Ghi nhận một mẫu thời gian kind = "fetch" (I/O) hoặc "compute" (CPU)"""
+    with _scan_timing_lock:
+        _scan_timing[f"{kind}_seconds"] += seconds
+        _scan_timing[f"{kind}_samples"] += 1
+
+def get_adaptive_max_workers() -> int:
+    """
+    ⚙️ Số worker tối ưu = cpu_count × (1 + wait/compute), dựa trên thời gian đo thực tế.
+    Fallback về MARKET_SCAN_BATCH_SIZE khi chưa đủ mẫu hoặc tắt adaptive.
+    """
+    base_workers = GTIConfig.MARKET_SCAN_BATCH_SIZE
+    if not GTIConfig.ENABLE_ADAPTIVE_WORKERS:
+        return base_workers
+    
+    with _scan_timing_lock:
+        timing = dict(_scan_timing)
+    
+    if (timing["compute_samples"] < GTIConfig.ADAPTIVE_WORKERS_MIN_SAMPLES or timing["fetch_samples"] == 0
+            or timing["compute_seconds"] <= 0):
+        return base_workers
+    
+    # Thời gian trung bình một request vnstock / thời gian tính toán trung bình một mã
+    wait_compute_ratio = (
+        (timing["fetch_seconds"] / timing["fetch_samples"]) /
+        (timing["compute_seconds"] / timing["compute_samples"])
+    )
+    adaptive_workers = int((os.cpu_count() or 1) * (1 + wait_compute_ratio))
+    return min(max(base_workers, adaptive_workers), GTIConfig.MAX_ADAPTIVE_WORKERS)
+
+def scan_single_stock(stock_symbol: str, min_gti_score: int = 2, min_combined_score: int = 3,
+                      start_date: str = None, end_date: str = None, scan_timestamp: str = None):
     """
     🔍 Quét một mã cổ phiếu đơn lẻ và trả về kết quả nếu đạt tiêu chí
+    
+    start_date/end_date/scan_timestamp được truyền từ batch scan để dùng chung
+    cho cả batch; nếu None thì tự tính cho lần gọi đơn lẻ.
     """
     try:
-        # Tính toán thời gian
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        # Tính toán thời gian (chỉ khi không được truyền từ batch)
+        if end_date is None or start_date is None:
+            start_date, end_date = one_year_window()
         
-        # Lấy dữ liệu
-        df = lay_du_lieu_co_phieu_vnstock(stock_symbol, start_date, end_date)
+        # Lấy dữ liệu - fetch_bars: mã xuất hiện ở nhiều stage/danh mục (VN30, popular, ngành) trong cùng
+        # khung cache chỉ tải một lần, dùng chung với các endpoint phân tích một mã
+        df = fetch_bars(stock_symbol, start_date, end_date)
         
         if df is None or df.empty:
             return None
         
-        # Tính toán GTI
-        df_analyzed = tinh_toan_chi_bao_ky_thuat(df)
-        
-        # Phát hiện patterns
-        df_patterns = detect_free_patterns(df_analyzed)
-        df_patterns = detect_large_chart_patterns(df_patterns)
-        
-        # Phân tích kết quả patterns
-        pattern_results = phan_tich_pattern_results(df_patterns, stock_symbol)
-        
-        # Lấy dữ liệu gần nhất
-        latest = df_patterns.iloc[-1]
-        
-        # Tính điểm
-        gti_score = int(latest['gti_score']) if pd.notna(latest['gti_score']) else 0
-        bullish_score = int(pattern_results.get('bullish_score', 0))
-        bearish_score = int(pattern_results.get('bearish_score', 0))
-        combined_score = gti_score + bullish_score - bearish_score
-        
-        # Lọc theo tiêu chí
-        if gti_score >= min_gti_score and combined_score >= min_combined_score:
-            # Lấy đánh giá
-            evaluation = GTIConfig.get_score_evaluation(combined_score)
-            
-            return {
-                "stock_symbol": stock_symbol,
-                "current_price": round(float(latest['close']), 2),
-                "volume": int(latest['volume']) if pd.notna(latest['volume']) else 0,
-                "gti_score": gti_score,
-                "pattern_score": {
-                    "bullish": bullish_score,
-                    "bearish": bearish_score,
-                    "net": bullish_score - bearish_score
-                },
-                "combined_score": combined_score,
-                "evaluation": evaluation,
-                "key_metrics": {
-                    "gti_trend_check": bool(latest['gti_trend_check']) if pd.notna(latest['gti_trend_check']) else False,
-                    "gti_recent_breakout": bool(latest['gti_recent_breakout']) if pd.notna(latest['gti_recent_breakout']) else False,
-                    "gti_dist_to_high_percent": round(float(latest['gti_dist_to_high_percent']), 2) if pd.notna(latest['gti_dist_to_high_percent']) else None,
-                    "gti_is_pullback": bool(latest['gti_is_pullback']) if pd.notna(latest['gti_is_pullback']) else False
-                },
-                "technical_levels": {
-                    "support": round(float(latest['support_level']), 2) if pd.notna(latest['support_level']) else None,
-                    "resistance": round(float(latest['resistance_level']), 2) if pd.notna(latest['resistance_level']) else None,
-                    "ema10": round(float(latest['EMA10']), 2) if pd.notna(latest['EMA10']) else None,
-                    "ema20": round(float(latest['EMA20']), 2) if pd.notna(latest['EMA20']) else None
-                },
-                "current_patterns": pattern_results.get('current_patterns', []),
-                "scan_timestamp": datetime.now().isoformat()
-            }
-        
-        return None  # Không đạt tiêu chí
-        
+        return _run_scan_compute(
+            df, stock_symbol, min_gti_score, min_combined_score, scan_timestamp
+        )
+    
     except Exception as e:
         print(f"❌ Lỗi khi quét {stock_symbol}: {str(e)}")
         return None
 
+def _run_scan_compute(df: pd.DataFrame, stock_symbol: str, min_gti_score: int,
+                      min_combined_score: int, scan_timestamp: str = None):
+    """
+    🧮 Chạy _analyze_scan_candidate trên process pool (thread scan chỉ còn chờ I/O);
+    fallback tính ngay trong thread nếu tắt process pool hoặc pool bị hỏng
+    """
+    args = (stock_symbol, min_gti_score, min_combined_score, scan_timestamp)
+    if GTIConfig.ENABLE_SCAN_PROCESS_POOL:
+        # Gửi sang process dạng mảng NumPy thô (pickle gần như memcpy) thay vì cả DataFrame
+        dates = _bar_dates(df).to_numpy(dtype='datetime64[ns]')
+        ohlcv = df[list(_OHLCV_COLUMNS)].to_numpy(dtype=float)
+        try:
+            # Thời gian tính đo trong process con → không gồm thời gian xếp hàng chờ pool
+            result, compute_seconds = _get_cpu_executor().submit(_analyze_scan_arrays, dates, ohlcv, *args).result()
+            _record_scan_timing("compute", compute_seconds)
+            return result
+        except concurrent.futures.BrokenExecutor:
+            print("⚠️ Process pool scan bị hỏng, tính toán trực tiếp trong thread")
+            shutdown_cpu_executor()
+    compute_start = time.perf_counter()
+    try:
+        return _analyze_scan_candidate(df, *args)
+    finally:
+        _record_scan_timing("compute", time.perf_counter() - compute_start)
+
+_OHLCV_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+def _analyze_scan_arrays(dates: np.ndarray, ohlcv: np.ndarray, stock_symbol: str, min_gti_score: int,
+                         min_combined_score: int, scan_timestamp: str = None):
+    """
+    🧮 (chạy trong process pool) Dựng lại DataFrame giá từ mảng thô rồi chạy _analyze_scan_candidate.
+    Trả về (kết quả, số giây tính toán) để process chính ghi nhận thời gian CPU thực.
+    """
+    started = time.perf_counter()
+    df = pd.DataFrame(ohlcv, columns=list(_OHLCV_COLUMNS))
+    df.insert(0, 'time', dates)
+    result = _analyze_scan_candidate(df, stock_symbol, min_gti_score, min_combined_score, scan_timestamp)
+    return result, time.perf_counter() - started
+
+def _analyze_scan_candidate(df: pd.DataFrame, stock_symbol: str, min_gti_score: int,
+                            min_combined_score: int, scan_timestamp: str = None):
+    """
+    🔧 Phần tính toán (CPU) của scan_single_stock: GTI + patterns + lọc tiêu chí
+    """
+    # Tính toán GTI
+    df_analyzed = tinh_toan_chi_bao_ky_thuat(df)
+    
+    # Lọc sớm theo GTI score - bỏ qua pattern detection nếu không đạt
+    latest_gti = df_analyzed['gti_score'].iloc[-1]
+    gti_score = int(latest_gti) if pd.notna(latest_gti) else 0
+    if gti_score < min_gti_score:
+        return None
+    
+    # Phát hiện patterns
+    df_patterns = detect_free_patterns(df_analyzed)
+    df_patterns = detect_large_chart_patterns(df_patterns)
+    
+    # Phân tích kết quả patterns
+    pattern_results = phan_tich_pattern_results(df_patterns, stock_symbol)
+    
+    # Tính điểm
+    bullish_score = int(pattern_results.get('bullish_score', 0))
+    bearish_score = int(pattern_results.get('bearish_score', 0))
+    combined_score = gti_score + bullish_score - bearish_score
+    
+    # Lọc theo tiêu chí trước khi đọc thêm bất kỳ giá trị nào từ DataFrame
+    if combined_score < min_combined_score:
+        return None  # Không đạt tiêu chí
+    
+    # Lấy dữ liệu gần nhất
+    latest = _snapshot_latest_row(df_patterns)
+    
+    # Lấy đánh giá
+    evaluation = GTIConfig.get_score_evaluation(combined_score)
+    
+    return {
+        "stock_symbol": stock_symbol,
+        "current_price": round(float(latest['close']), 2),
+        "volume": int(latest['volume']) if pd.notna(latest['volume']) else 0,
+        "gti_score": gti_score,
+        "pattern_score": {
+            "bullish": bullish_score,
+            "bearish": bearish_score,
+            "net": bullish_score - bearish_score
+        },
+        "combined_score": combined_score,
+        "evaluation": evaluation,
+        "key_metrics": {
+            "gti_trend_check": bool(latest['gti_trend_check']) if pd.notna(latest['gti_trend_check']) else False,
+            "gti_recent_breakout": bool(latest['gti_recent_breakout']) if pd.notna(latest['gti_recent_breakout']) else False,
+            "gti_dist_to_high_percent": round(float(latest['gti_dist_to_high_percent']), 2) if pd.notna(latest['gti_dist_to_high_percent']) else None,
+            "gti_is_pullback": bool(latest['gti_is_pullback']) if pd.notna(latest['gti_is_pullback']) else False
+        },
+        "technical_levels": {
+            "support": round(float(latest['support_level']), 2) if pd.notna(latest['support_level']) else None,
+            "resistance": round(float(latest['resistance_level']), 2) if pd.notna(latest['resistance_level']) else None,
+            "ema10": round(float(latest['EMA10']), 2) if pd.notna(latest['EMA10']) else None,
+            "ema20": round(float(latest['EMA20']), 2) if pd.notna(latest['EMA20']) else None
+        },
+        "current_patterns": pattern_results.get('current_patterns', []),
+        "scan_timestamp": scan_timestamp or datetime.now().isoformat()
+    }
+
+# 🔤 Dấu phẩy phân cách danh sách mã (kèm khoảng trắng hai bên) - biên dịch một lần
+_STOCK_SEP_RE = re.compile(r"\s*,\s*")
+
+def parse_stock_list(stocks: str) -> list:
+    """🔤 Chuỗi mã cách nhau bởi dấu phẩy → list mã viết hoa, bỏ mã rỗng và mã trùng (giữ thứ tự)"""
+    return list(dict.fromkeys(t for t in _STOCK_SEP_RE.split(stocks.strip().upper()) if t))
+
 def market_scan_parallel(stock_list: list, 
                         min_gti_score: int = 2, 
                         min_combined_score: int = 3,
                         max_workers: int = None,
-                        timeout: int = None):
+                        timeout: int = None,
+                        on_progress=None):
     """
     🚀 Quét thị trường song song với ThreadPoolExecutor - OPTIMIZED v2.0
     
@@ -976,6 +1322,7 @@ def market_scan_parallel(stock_list: list,
         min_combined_score: Điểm tổng hợp tối thiểu
         max_workers: Số thread tối đa (auto-detect nếu None)
         timeout: Timeout tổng cộng (giây, auto-calculate nếu None)
+        on_progress: Callback(processed, qualified, total) sau mỗi mã xong (VD: cập nhật tiến trình task)
     
     Returns:
         Dict chứa kết quả scan và thống kê
@@ -983,7 +1330,7 @@ def market_scan_parallel(stock_list: list,
     
     # Auto-configure performance parameters
     if max_workers is None:
-        max_workers = GTIConfig.MARKET_SCAN_BATCH_SIZE
+        max_workers = get_adaptive_max_workers()
     
     if timeout is None:
         # Progressive timeout: 10s base + 5s per stock, min 60s, max 600s
@@ -1001,6 +1348,21 @@ def market_scan_parallel(stock_list: list,
     errors = []
     processed_count = 0
     
+    # Dùng chung một khoảng thời gian và timestamp cho toàn bộ batch
+    scan_now = datetime.now()
+    scan_timestamp = scan_now.isoformat()
+    start_date, end_date = one_year_window(scan_now)
+    
+    # Đếm tiến trình xuyên suốt các chunk (as_completed chạy trên thread gọi → không cần khóa)
+    on_stock_done = None
+    if on_progress is not None:
+        progress = {"processed": 0, "qualified": 0}
+        
+        def on_stock_done(result):
+            progress["processed"] += 1
+            progress["qualified"] += result is not None
+            on_progress(progress["processed"], progress["qualified"], len(stock_list))
+    
     # Chunked processing for large lists
     if len(stock_list) > GTIConfig.CHUNK_SIZE_FOR_LARGE_SCANS:
         print(f"📦 Chia nhỏ {len(stock_list)} mã thành chunks của {GTIConfig.CHUNK_SIZE_FOR_LARGE_SCANS}")
@@ -1014,7 +1376,8 @@ def market_scan_parallel(stock_list: list,
             
             chunk_results = _process_stock_chunk(
                 chunk, min_gti_score, min_combined_score, 
-                max_workers, chunk_timeout
+                max_workers, chunk_timeout,
+                start_date, end_date, scan_timestamp, on_stock_done
             )
             
             results.extend(chunk_results['results'])
@@ -1030,7 +1393,8 @@ def market_scan_parallel(stock_list: list,
         # Normal processing for smaller lists
         chunk_results = _process_stock_chunk(
             stock_list, min_gti_score, min_combined_score,
-            max_workers, timeout
+            max_workers, timeout,
+            start_date, end_date, scan_timestamp, on_stock_done
         )
         results = chunk_results['results']
         errors = chunk_results['errors']
@@ -1071,11 +1435,13 @@ def market_scan_parallel(stock_list: list,
             }
         },
         "errors": errors,
-        "scan_timestamp": datetime.now().isoformat()
+        "scan_timestamp": scan_timestamp
     }
 
 def _process_stock_chunk(stock_list: list, min_gti_score: int, min_combined_score: int,
-                        max_workers: int, timeout: int):
+                        max_workers: int, timeout: int,
+                        start_date: str = None, end_date: str = None, scan_timestamp: str = None,
+                        on_stock_done=None):
     """
     🔧 Xử lý một chunk stocks với timeout handling tốt hơn
     """
@@ -1087,7 +1453,10 @@ def _process_stock_chunk(stock_list: list, min_gti_score: int, min_combined_scor
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Tạo futures cho tất cả mã trong chunk
             future_to_stock = {
-                executor.submit(scan_single_stock, stock, min_gti_score, min_combined_score): stock 
+                executor.submit(
+                    scan_single_stock, stock, min_gti_score, min_combined_score,
+                    start_date, end_date, scan_timestamp
+                ): stock 
                 for stock in stock_list
             }
             
@@ -1096,17 +1465,21 @@ def _process_stock_chunk(stock_list: list, min_gti_score: int, min_combined_scor
                 stock = future_to_stock[future]
                 processed += 1
                 
+                result = None
                 try:
                     result = future.result(timeout=GTIConfig.SINGLE_STOCK_TIMEOUT)
                     if result is not None:
                         results.append(result)
-                        print(f"✅ {stock}: Tổng điểm {result['combined_score']}")
+                        logger.debug("✅ %s: Tổng điểm %s", stock, result['combined_score'])
                     else:
-                        print(f"⏭️  {stock}: Không đạt tiêu chí")
+                        logger.debug("⏭️  %s: Không đạt tiêu chí", stock)
                 except Exception as e:
                     error_msg = f"{stock}: {str(e)}"
                     errors.append(error_msg)
-                    print(f"❌ {error_msg}")
+                    logger.debug("❌ %s", error_msg)
+                
+                if on_stock_done is not None:
+                    on_stock_done(result)
     
     except concurrent.futures.TimeoutError:
         print(f"⏰ Chunk timeout sau {timeout} giây! Đã xử lý {processed}/{len(stock_list)}")
@@ -1119,7 +1492,8 @@ def _process_stock_chunk(stock_list: list, min_gti_score: int, min_combined_scor
 
 def market_scan_by_category(category: str = "vn30", 
                            min_gti_score: int = 2, 
-                           min_combined_score: int = 3):
+                           min_combined_score: int = 3,
+                           on_progress=None):
     """
     🎯 Quét thị trường theo danh mục cụ thể
     
@@ -1127,6 +1501,7 @@ def market_scan_by_category(category: str = "vn30",
         category: Loại danh sách (vn30, top100, popular, hoặc tên ngành)
         min_gti_score: Điểm GTI tối thiểu
         min_combined_score: Điểm tổng hợp tối thiểu
+        on_progress: Callback tiến trình, truyền thẳng cho market_scan_parallel
     
     Returns:
         Kết quả scan với thông tin danh mục
@@ -1150,7 +1525,8 @@ def market_scan_by_category(category: str = "vn30",
         min_gti_score=min_gti_score,
         min_combined_score=min_combined_score,
         max_workers=GTIConfig.MARKET_SCAN_BATCH_SIZE,
-        timeout=GTIConfig.MARKET_SCAN_TIMEOUT
+        timeout=GTIConfig.MARKET_SCAN_TIMEOUT,
+        on_progress=on_progress
     )
     
     # Thêm thông tin danh mục
@@ -1162,6 +1538,15 @@ def market_scan_by_category(category: str = "vn30",
     
     return scan_result
 
+# Các trường thống kê dạng số được cộng dồn khi gộp kết quả nhiều stage
+_SUMMABLE_SCAN_STATS = ("total_scanned", "processed_count", "error_count", "execution_time_seconds")
+
+# 🏷️ Mã → ngành đầu tiên chứa mã đó trong SECTOR_STOCKS (dựng một lần khi import)
+_SCAN_SECTOR_BY_SYMBOL = {}
+for _sector, _stocks in GTIConfig.SECTOR_STOCKS.items():
+    for _symbol in _stocks:
+        _SCAN_SECTOR_BY_SYMBOL.setdefault(_symbol, _sector)
+
 def market_scan_top_picks(limit: int = 20, quick_mode: bool = None):
     """
     🏆 Quét và trả về TOP mã cổ phiếu tốt nhất toàn thị trường - SECTOR-BASED v3.0
@@ -1209,9 +1594,10 @@ def market_scan_top_picks(limit: int = 20, quick_mode: bool = None):
         else:
             # Stage 2: Scan top 10 từ mỗi sector
             sector_stocks = GTIConfig.get_all_sectors_combined(limit_per_sector=10)
+            priority_set = set(priority_stocks)
             remaining_stocks = [
                 stock for stock in sector_stocks 
-                if stock not in priority_stocks
+                if stock not in priority_set
             ]
             
             needed = limit - len(high_quality_results)
@@ -1231,20 +1617,22 @@ def market_scan_top_picks(limit: int = 20, quick_mode: bool = None):
             top_picks = all_results[:limit]
             
             # Combine statistics
+            stage1_stats = stage1_result["statistics"]
+            stage2_stats = stage2_result["statistics"]
             combined_stats = {
-                "total_scanned": stage1_result["statistics"]["total_scanned"] + stage2_result["statistics"]["total_scanned"],
-                "processed_count": stage1_result["statistics"]["processed_count"] + stage2_result["statistics"]["processed_count"],
+                key: stage1_stats.get(key, 0) + stage2_stats.get(key, 0)
+                for key in _SUMMABLE_SCAN_STATS
+            }
+            combined_stats.update({
                 "success_count": len(all_results),
                 "qualified_count": len(all_results),
-                "error_count": stage1_result["statistics"]["error_count"] + stage2_result["statistics"]["error_count"],
-                "execution_time_seconds": stage1_result["statistics"]["execution_time_seconds"] + stage2_result["statistics"]["execution_time_seconds"],
                 "quick_mode_used": True,
                 "scan_method": "sector_based_limited",
                 "stages": {
-                    "stage1": stage1_result["statistics"],
-                    "stage2": stage2_result["statistics"]
+                    "stage1": stage1_stats,
+                    "stage2": stage2_stats
                 }
-            }
+            })
     else:
         # Normal mode: Scan nhiều hơn từ các sectors
         print("🔍 Sử dụng NORMAL MODE - quét nhiều hơn từ các sectors")
@@ -1271,24 +1659,24 @@ def market_scan_top_picks(limit: int = 20, quick_mode: bool = None):
         combined_stats["quick_mode_used"] = False
         combined_stats["scan_method"] = "sector_based_full"
     
-    # Phân loại theo mức độ
+    # Phân loại theo mức độ - một lượt gán bậc điểm thay vì lọc 4 lần
+    tier_groups = ([], [], [], [])
+    for stock, tier in zip(top_picks, _score_tiers(top_picks)):
+        tier_groups[tier].append(stock)
     categorized_picks = {
-        "very_strong": [stock for stock in top_picks if stock["combined_score"] >= 6],
-        "strong": [stock for stock in top_picks if 4 <= stock["combined_score"] < 6],
-        "moderate": [stock for stock in top_picks if 2 <= stock["combined_score"] < 4],
-        "weak_but_potential": [stock for stock in top_picks if stock["combined_score"] < 2]
+        "very_strong": tier_groups[3],
+        "strong": tier_groups[2],
+        "moderate": tier_groups[1],
+        "weak_but_potential": tier_groups[0]
     }
     
     # Thống kê theo ngành
     sector_distribution = {}
     for stock in top_picks:
         symbol = stock["stock_symbol"]
-        for sector, stocks in GTIConfig.SECTOR_STOCKS.items():
-            if symbol in stocks:
-                if sector not in sector_distribution:
-                    sector_distribution[sector] = []
-                sector_distribution[sector].append(symbol)
-                break
+        sector = _SCAN_SECTOR_BY_SYMBOL.get(symbol)
+        if sector is not None:
+            sector_distribution.setdefault(sector, []).append(symbol)
     
     return {
         "top_picks": top_picks,
@@ -1306,6 +1694,33 @@ def market_scan_top_picks(limit: int = 20, quick_mode: bool = None):
         "scan_timestamp": datetime.now().isoformat()
     }
 
+# 🎚️ Ngưỡng bậc combined_score - bậc 0: < 2, 1: 2-3, 2: 4-5, 3: ≥ 6
+_SCORE_TIER_BOUNDS = np.array([2, 4, 6])
+
+def _combined_scores(results: list) -> np.ndarray:
+    return np.fromiter((r["combined_score"] for r in results), dtype=np.int64, count=len(results))
+
+def _score_tiers(results: list) -> np.ndarray:
+    """🎚️ Bậc điểm (0-3) của từng kết quả scan, tính vector hóa"""
+    return np.digitize(_combined_scores(results), _SCORE_TIER_BOUNDS)
+
+def summarize_scan_scores(results: list) -> dict:
+    """
+    🔢 Điểm trung bình và phân bố combined_score của kết quả scan trong một lượt NumPy
+    (excellent ≥ 6, good 4-5, fair 2-3)
+    """
+    scores = _combined_scores(results)
+    if not scores.size:
+        return {"average_score": 0, "excellent": 0, "good": 0, "fair": 0}
+    
+    counts = np.bincount(np.digitize(scores, _SCORE_TIER_BOUNDS), minlength=4)
+    return {
+        "average_score": round(float(scores.mean()), 2),
+        "excellent": int(counts[3]),
+        "good": int(counts[2]),
+        "fair": int(counts[1])
+    }
+
 def get_market_scan_recommendation(top_picks: list) -> dict:
     """
     📋 Đưa ra khuyến nghị dựa trên kết quả market scan
@@ -1317,8 +1732,9 @@ def get_market_scan_recommendation(top_picks: list) -> dict:
             "action": "WAIT"
         }
     
-    very_strong = len([s for s in top_picks if s["combined_score"] >= 6])
-    strong = len([s for s in top_picks if 4 <= s["combined_score"] < 6])
+    distribution = summarize_scan_scores(top_picks)
+    very_strong = distribution["excellent"]
+    strong = distribution["good"]
     
     if very_strong >= 3:
         return {
@@ -1,31 +1,50 @@
 # main_api.py
 
+import asyncio
+import functools
+import gzip
+import hashlib
+import inspect
+import math
+import os
+import re
+import orjson
 import pandas as pd
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Path, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Annotated, List, Optional
 
 # Import các hàm từ file lay_data_stock.py
 from lay_data_stock import (
-    lay_du_lieu_co_phieu_vnstock, 
+    lay_du_lieu_async,
+    run_in_io_executor,
+    shutdown_io_executor,
+    shutdown_cpu_executor,
     tinh_toan_chi_bao_ky_thuat,
     detect_free_patterns,
     detect_large_chart_patterns,
     phan_tich_pattern_results,
     get_market_context,
     get_sector_analysis,
+    get_sector_name,
+    one_year_window,
     comprehensive_gti_analysis,
     prepare_news_search_context,
     market_scan_parallel,
     market_scan_by_category,
     market_scan_top_picks,
-    scan_single_stock
+    scan_single_stock,
+    parse_stock_list,
+    summarize_scan_scores
 )
 
 from config import GTIConfig
 
 # 🚀 Import Cache Manager
-from cache_manager import gti_cache, cache_stock_analysis, cache_market_scan
+from cache_manager import gti_cache, cache_stock_analysis, cache_market_scan, cache_comprehensive_analysis
 
 # 🔄 Import Task Manager for Async Processing
 from task_manager import task_manager
@@ -39,148 +58,411 @@ app = FastAPI(
         "name": "GTI Analysis System",
         "url": "https://github.com/nhtquangg/gti-stock-analysis-api",
     },
+    # ⚡ orjson cho mọi response động (payload phân tích nhiều float)
+    default_response_class=ORJSONResponse,
 )
 
-@app.get("/")
-def read_root():
+# 🗜️ Nén gzip các response JSON lớn (market scan, full analysis, info tĩnh) khi client hỗ trợ
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=GTIConfig.GZIP_MINIMUM_SIZE,
+    compresslevel=GTIConfig.GZIP_COMPRESS_LEVEL
+)
+
+@app.on_event("shutdown")
+def _shutdown_io_pool():
+    """🛑 Đóng thread pool I/O vnstock và process pool tính toán scan khi tắt server"""
+    shutdown_io_executor()
+    shutdown_cpu_executor()
+
+# 🔤 Mã cổ phiếu hợp lệ (chữ/số, 3-10 ký tự) - kiểm tra ở router trước khi gọi vnstock
+SYMBOL_PATTERN = GTIConfig.SYMBOL_PATTERN
+_SYMBOL_RE = re.compile(SYMBOL_PATTERN)
+
+# 🎚️ Khoảng hợp lệ của tham số scan - Pydantic từ chối (422) trước khi vào handler
+GtiScoreQuery = Annotated[int, Query(ge=0, le=4)]
+CombinedScoreQuery = Annotated[int, Query(ge=-5, le=18)]
+TopPicksLimitQuery = Annotated[int, Query(ge=1, le=50)]
+
+# 🏢 Tập giá trị hợp lệ dựng một lần khi import (kiểm tra O(1), không tạo list mỗi request)
+AVAILABLE_SECTORS = frozenset(GTIConfig.SECTOR_STOCKS)
+TASK_TYPES = ("top_picks", "sector_scan", "category_scan", "custom_scan")
+
+def validated_symbol(ma_co_phieu: str = Path(..., pattern=SYMBOL_PATTERN)) -> str:
+    """🔤 Dependency: mã cổ phiếu {ma_co_phieu} đã kiểm tra định dạng, viết hoa một lần"""
+    return ma_co_phieu.upper()
+
+def validated_stock(stock: str = Path(..., pattern=SYMBOL_PATTERN)) -> str:
+    """🔤 Dependency: như validated_symbol cho các route dùng {stock}"""
+    return stock.upper()
+
+def _latest_row_values(df: pd.DataFrame) -> dict:
+    """📌 Lấy phiên gần nhất dưới dạng dict một lần, NaN → None"""
     return {
-        "message": "🚀 Chào mừng đến với GTI Stock Analysis API!",
-        "he_thong": "GTI PRO v3.0 - Growth Trading Intelligence + Market Scanner",
-        "phien_ban": "3.3.0",
-        "tinh_nang": [
-            "🔥 GTI Core Analysis (4 tiêu chí cốt lõi)",
-            "🎯 Enhanced Pattern Detection (16 patterns: 12 basic + 4 large)",
-            "🌊 Market Context Analysis (VNINDEX + Sector)",
-            "📰 News Search Integration (cho ChatGPT)",
-            "⚡ Combined Scoring (-5 to +18 range)",
-            "🚀 Comprehensive Analysis API",
-            "🔍 Market Scanner - Quét toàn bộ thị trường",
-            "🏆 Top Picks - Tìm mã tốt nhất",
-            "🏢 Sector Analysis - Phân tích theo ngành",
-            "🎯 Custom List Scanning"
-        ],
-        "endpoints": {
-            "individual_analysis": {
-                "/phan-tich/{ma_co_phieu}": "Phân tích GTI cơ bản",
-                "/full-analysis/{ma_co_phieu}": "🚀 GTI PRO v3.0 - Phân tích toàn diện",
-                "/news-context/{ma_co_phieu}": "News search context cho ChatGPT"
-            },
-            "market_scanning": {
-                "/market-scan": "🔍 Quét thị trường theo danh mục (VN30, ngành, popular)",
-                "/market-scan/vn30": "🎯 Quick VN30 scan với tiêu chí cao",
-                "/market-scan/top-picks": "🏆 TOP picks từ tất cả sectors",
-                "/market-scan/sector/{sector}": "🏢 Quét theo ngành cụ thể (~40 mã)",
-                "/market-scan/custom": "🎯 Quét danh sách tùy chỉnh",
-                "/market-scan/quick-check/{stock}": "⚡ Kiểm tra nhanh một mã"
-            },
-            "async_market_scanning": {
-                "POST /market-scan/start": "🚀 Bắt đầu tác vụ quét bất đồng bộ (tránh timeout)",
-                "GET /market-scan/status/{task_id}": "🔍 Kiểm tra trạng thái tác vụ",
-                "GET /market-scan/result/{task_id}": "📊 Lấy kết quả khi hoàn thành",
-                "/tasks/stats": "📊 Thống kê task manager"
-            },
-            "system_info": {
-                "/gti-info": "Thông tin về hệ thống GTI",
-                "/patterns-info": "Thông tin về 16 patterns (12 basic + 4 large)"
-            }
+        k: (None if isinstance(v, float) and math.isnan(v) else v)
+        for k, v in df.iloc[-1].to_dict().items()
+    }
+
+# 🔢 Các cột số trả về trong response - làm tròn một lần (vectorized) trên phiên cuối
+NUMERIC_FIELDS = (
+    'close', 'high', 'low', 'volume', 'gti_dist_to_high_percent',
+    'support_level', 'resistance_level', 'EMA10', 'EMA20', 'EMA50', 'EMA200'
+)
+
+def _rounded_tail(df: pd.DataFrame) -> dict:
+    """🔢 Làm tròn 2 chữ số toàn bộ NUMERIC_FIELDS của phiên cuối, NaN → None"""
+    cols = [c for c in NUMERIC_FIELDS if c in df.columns]
+    tail = df[cols].iloc[[-1]].astype(float).round(2).to_dict('records')[0]
+    return {k: (None if math.isnan(v) else v) for k, v in tail.items()}
+
+# 🔁 Singleflight: các request đồng thời cùng key chờ chung một lần tính toán
+_INFLIGHT: dict = {}
+
+def _singleflight_done(key, task: asyncio.Task):
+    if _INFLIGHT.get(key) is task:
+        _INFLIGHT.pop(key)
+    if not task.cancelled():
+        task.exception()  # Đánh dấu đã xử lý nếu mọi request chờ đã ngắt kết nối
+
+async def _singleflight(key, func, *args):
+    """
+    🔁 Chạy func(*args) (coroutine: await, hàm thường: trong thread), gộp các lời gọi trùng key đang chạy.
+    Việc tính toán chạy trong task riêng, mỗi request chờ qua shield → client ngắt kết nối chỉ hủy
+    phần chờ của chính nó, không hủy kết quả các request khác đang chờ chung.
+    """
+    task = _INFLIGHT.get(key)
+    if task is None:
+        # Không có await giữa get và gán → không cần lock trên event loop
+        if inspect.iscoroutinefunction(func):
+            task = asyncio.create_task(func(*args))
+        else:
+            task = asyncio.create_task(asyncio.to_thread(func, *args))
+        _INFLIGHT[key] = task
+        task.add_done_callback(functools.partial(_singleflight_done, key))
+    return await asyncio.shield(task)
+
+def _batch_symbols(symbols: List[str], action: str) -> list:
+    """🔤 Body batch → list mã viết hoa, bỏ trùng; 400 nếu trống, quá nhiều mã hoặc có mã sai định dạng"""
+    stock_list = list(dict.fromkeys(s.strip().upper() for s in symbols if s.strip()))
+    if not stock_list:
+        raise HTTPException(status_code=400, detail="Danh sách mã cổ phiếu trống")
+    if len(stock_list) > GTIConfig.BATCH_ANALYSIS_MAX_SYMBOLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tối đa {GTIConfig.BATCH_ANALYSIS_MAX_SYMBOLS} mã cổ phiếu trong một lần {action}"
+        )
+    invalid = [s for s in stock_list if not _SYMBOL_RE.match(s)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Mã cổ phiếu không hợp lệ: {', '.join(invalid)}")
+    return stock_list
+
+async def _run_batch(symbols: List[str], run, on_error, is_success, action: str, prepare=None) -> dict:
+    """
+    📦 Khung chung cho các endpoint batch: kiểm tra mã (_batch_symbols), chạy run(symbol, prepared)
+    song song (giới hạn BATCH_ANALYSIS_CONCURRENCY), lỗi từng mã → on_error(symbol, exc)
+    
+    prepare: hàm đồng bộ chạy một lần (trong thread) sau khi kiểm tra mã, kết quả dùng chung cho mọi mã
+    """
+    stock_list = _batch_symbols(symbols, action)
+    prepared = await asyncio.to_thread(prepare) if prepare is not None else None
+    semaphore = asyncio.Semaphore(GTIConfig.BATCH_ANALYSIS_CONCURRENCY)
+    
+    async def _bounded(symbol: str):
+        async with semaphore:
+            return await run(symbol, prepared)
+    
+    outcomes = await asyncio.gather(*(_bounded(s) for s in stock_list), return_exceptions=True)
+    
+    results = {}
+    for symbol, outcome in zip(stock_list, outcomes):
+        if isinstance(outcome, BaseException):  # Kể cả CancelledError - không lọt vào results như kết quả
+            results[symbol] = on_error(symbol, outcome)
+        else:
+            results[symbol] = outcome
+    
+    return {
+        "status": "success",
+        "total_symbols": len(stock_list),
+        "success_count": sum(1 for r in results.values() if is_success(r)),
+        "results": results,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _batch_error(label: str):
+    """❌ on_error cho batch trả {"error": ...}: giữ detail của HTTPException, lỗi khác kèm nhãn thao tác"""
+    def on_error(symbol: str, exc: BaseException) -> dict:
+        if isinstance(exc, HTTPException):
+            return {"error": exc.detail}
+        return {"error": f"Lỗi {label} {symbol}: {str(exc)}"}
+    return on_error
+
+def _has_no_error(result) -> bool:
+    return "error" not in result
+
+# 🎯 Bảng đánh giá tổng hợp: (ngưỡng điểm tối thiểu, nhãn, màu) - duyệt từ cao xuống thấp
+_RATING = (
+    (GTIConfig.SCORE_VERY_POSITIVE, "🟢 RẤT TÍCH CỰC - CÂN NHẮC MUA", "green"),
+    (GTIConfig.SCORE_POSITIVE, "🟡 TÍCH CỰC - THEO DÕI", "yellow"),
+    (GTIConfig.SCORE_NEUTRAL, "🟠 TRUNG TÍNH - CHỜ TÍN HIỆU", "orange"),
+)
+_RATING_NEGATIVE = ("🔴 TIÊU CỰC - TRÁNH XA", "red")
+
+# 🔢 Tra bảng theo tổng điểm trong khoảng -5..+18 (ngoài khoảng kẹp về hai đầu - cùng nhãn)
+_SCORE_MIN, _SCORE_MAX = -5, 18
+_SCORE_LUT = tuple(
+    next(((label, color) for threshold, label, color in _RATING if score >= threshold), _RATING_NEGATIVE)
+    for score in range(_SCORE_MIN, _SCORE_MAX + 1)
+)
+
+def _get_rating(tong_diem: int) -> tuple:
+    """🎯 (danh_gia, mau_sac) theo tổng điểm"""
+    return _SCORE_LUT[max(0, min(len(_SCORE_LUT) - 1, tong_diem - _SCORE_MIN))]
+
+# 🌐 HTTP caching: info tĩnh đổi theo deploy, kết quả phân tích ổn định trong phiên
+_STATIC_CACHE_CONTROL = "public, max-age=86400"
+_ANALYSIS_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=3600"
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+def _json_with_etag(request: Request, body: bytes, etag: str, cache_control: str) -> Response:
+    """🌐 Trả JSON kèm Cache-Control/ETag, 304 nếu client đã có đúng phiên bản"""
+    headers = {"Cache-Control": cache_control, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _analysis_response(request: Request, result: dict) -> Response:
+    """🌐 Serialize kết quả phân tích (giống ORJSONResponse) và gắn ETag theo nội dung"""
+    body = orjson.dumps(
+        jsonable_encoder(result),
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+    return _json_with_etag(request, body, _etag(body), _ANALYSIS_CACHE_CONTROL)
+
+def _scan_json(expiry_seconds: int = None):
+    """
+    ⚡ Serialize dict kết quả scan một lần bằng orjson (numpy native), bỏ qua lượt
+    jsonable_encoder duyệt lại toàn bộ danh sách mã của FastAPI.
+    Có expiry_seconds: cache bytes response trong gti_cache theo bộ tham số (hit → trả bytes luôn);
+    chỉ cache kết quả thành công (không có key 'error'), HTTPException không bị cache.
+    """
+    def decorator(func):
+        operation = f"endpoint_{func.__name__}"
+        
+        def encode(result):
+            return orjson.dumps(
+                result,
+                default=jsonable_encoder,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            )
+        
+        def cacheable(result) -> bool:
+            return bool(expiry_seconds) and isinstance(result, dict) and 'error' not in result
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(**kwargs):
+                # Chạy trên event loop → cache qua aget/aset (round-trip Redis nằm trong thread)
+                body = await gti_cache.aget(operation, **kwargs) if expiry_seconds else None
+                if body is None:
+                    result = await func(**kwargs)
+                    body = encode(result)
+                    if cacheable(result):
+                        await gti_cache.aset(operation, body, expiry_seconds=expiry_seconds, **kwargs)
+                return Response(content=body, media_type="application/json")
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(**kwargs):
+            # Endpoint sync chạy trong threadpool của FastAPI → gọi cache trực tiếp
+            body = gti_cache.get(operation, **kwargs) if expiry_seconds else None
+            if body is None:
+                result = func(**kwargs)
+                body = encode(result)
+                if cacheable(result):
+                    gti_cache.set(operation, body, expiry_seconds=expiry_seconds, **kwargs)
+            return Response(content=body, media_type="application/json")
+        return wrapper
+    return decorator
+
+def _task_result_response(request: Request, body: bytes, gzipped: bool, etag: str) -> Response:
+    """
+    🗜️ Trả body đã nén sẵn (GZipMiddleware bỏ qua response có Content-Encoding) hoặc JSON thường,
+    kèm ETag theo nội dung - client poll lại với If-None-Match nhận 304 không kèm body
+    """
+    if not gzipped:
+        return _json_with_etag(request, body, etag, "no-cache")
+    
+    etag = etag[:-1] + '-gzip"'  # Mỗi encoding một ETag riêng
+    headers = {"Cache-Control": "no-cache", "ETag": etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# 📦 Payload tĩnh - serialize một lần bằng orjson khi import
+_ROOT_INFO = {
+    "message": "🚀 Chào mừng đến với GTI Stock Analysis API!",
+    "he_thong": "GTI PRO v3.0 - Growth Trading Intelligence + Market Scanner",
+    "phien_ban": "3.3.0",
+    "tinh_nang": [
+        "🔥 GTI Core Analysis (4 tiêu chí cốt lõi)",
+        "🎯 Enhanced Pattern Detection (16 patterns: 12 basic + 4 large)",
+        "🌊 Market Context Analysis (VNINDEX + Sector)",
+        "📰 News Search Integration (cho ChatGPT)",
+        "⚡ Combined Scoring (-5 to +18 range)",
+        "🚀 Comprehensive Analysis API",
+        "🔍 Market Scanner - Quét toàn bộ thị trường",
+        "🏆 Top Picks - Tìm mã tốt nhất",
+        "🏢 Sector Analysis - Phân tích theo ngành",
+        "🎯 Custom List Scanning"
+    ],
+    "endpoints": {
+        "individual_analysis": {
+            "/phan-tich/{ma_co_phieu}": "Phân tích GTI cơ bản",
+            "POST /phan-tich/batch": "📊 Phân tích GTI cơ bản nhiều mã trong một request",
+            "/full-analysis/{ma_co_phieu}": "🚀 GTI PRO v3.0 - Phân tích toàn diện",
+            "/news-context/{ma_co_phieu}": "News search context cho ChatGPT"
         },
-        "vi_du_su_dung": {
-            "phan_tich_don_le": "/full-analysis/FPT",
-            "quet_vn30_nhanh": "/market-scan/vn30",
-            "top_picks_dong_bo": "/market-scan/top-picks?limit=10",
-            "quet_ngan_hang": "/market-scan/sector/banking",
-            "quet_tuy_chinh_nho": "/market-scan/custom?stocks=FPT,VIC,HPG,VCB",
-            "kiem_tra_nhanh": "/market-scan/quick-check/FPT"
+        "market_scanning": {
+            "/market-scan": "🔍 Quét thị trường theo danh mục (VN30, ngành, popular)",
+            "/market-scan/vn30": "🎯 Quick VN30 scan với tiêu chí cao",
+            "/market-scan/top-picks": "🏆 TOP picks từ tất cả sectors",
+            "/market-scan/sector/{sector}": "🏢 Quét theo ngành cụ thể (~40 mã)",
+            "/market-scan/custom": "🎯 Quét danh sách tùy chỉnh",
+            "/market-scan/quick-check/{stock}": "⚡ Kiểm tra nhanh một mã",
+            "POST /market-scan/quick-check-batch": "⚡ Kiểm tra nhanh nhiều mã trong một request"
         },
-        "vi_du_async": {
-            "bat_dau_top_picks": "POST /market-scan/start?task_type=top_picks&limit=15",
-            "bat_dau_sector_scan": "POST /market-scan/start?task_type=sector_scan&sector=banking",
-            "kiem_tra_trang_thai": "GET /market-scan/status/{task_id}",
-            "lay_ket_qua": "GET /market-scan/result/{task_id}",
-            "note": "🚀 Dùng async cho scans lớn (>20 mã) để tránh timeout"
+        "async_market_scanning": {
+            "POST /market-scan/start": "🚀 Bắt đầu tác vụ quét bất đồng bộ (tránh timeout)",
+            "GET /market-scan/status/{task_id}": "🔍 Kiểm tra trạng thái tác vụ",
+            "GET /market-scan/stream/{task_id}": "📡 Nhận cập nhật trạng thái qua SSE (không cần poll)",
+            "GET /market-scan/result/{task_id}": "📊 Lấy kết quả khi hoàn thành",
+            "GET /market-scan/result/{task_id}/rows": "📜 Stream từng mã trong kết quả (NDJSON)",
+            "/tasks/stats": "📊 Thống kê task manager"
         },
-        "danh_muc_ho_tro": {
-            "stock_lists": ["vn30", "popular"],
-            "sectors": ["banking", "real_estate", "technology", "manufacturing", "consumer", "energy", "securities", "construction", "utilities", "transportation"],
-            "sector_sizes": {
-                "banking": "40 mã (từ big banks đến financial services)",
-                "real_estate": "40 mã (developers, construction, infrastructure)",
-                "technology": "40 mã (IT services, telecom, hardware, software)",
-                "manufacturing": "40 mã (steel, chemicals, electronics, machinery)",
-                "consumer": "40 mã (retail, F&B, personal care, tourism)",
-                "energy": "40 mã (oil & gas, power, renewable, mining)",
-                "securities": "40 mã (securities firms, asset management)",
-                "construction": "40 mã (construction, infrastructure, materials)",
-                "utilities": "40 mã (power, water, transport utilities)",
-                "transportation": "40 mã (airlines, shipping, logistics, ports)"
-            }
+        "system_info": {
+            "/gti-info": "Thông tin về hệ thống GTI",
+            "/patterns-info": "Thông tin về 16 patterns (12 basic + 4 large)"
+        }
+    },
+    "vi_du_su_dung": {
+        "phan_tich_don_le": "/full-analysis/FPT",
+        "quet_vn30_nhanh": "/market-scan/vn30",
+        "top_picks_dong_bo": "/market-scan/top-picks?limit=10",
+        "quet_ngan_hang": "/market-scan/sector/banking",
+        "quet_tuy_chinh_nho": "/market-scan/custom?stocks=FPT,VIC,HPG,VCB",
+        "kiem_tra_nhanh": "/market-scan/quick-check/FPT"
+    },
+    "vi_du_async": {
+        "bat_dau_top_picks": "POST /market-scan/start?task_type=top_picks&limit=15",
+        "bat_dau_sector_scan": "POST /market-scan/start?task_type=sector_scan&sector=banking",
+        "kiem_tra_trang_thai": "GET /market-scan/status/{task_id}",
+        "lay_ket_qua": "GET /market-scan/result/{task_id}",
+        "note": "🚀 Dùng async cho scans lớn (>20 mã) để tránh timeout"
+    },
+    "danh_muc_ho_tro": {
+        "stock_lists": ["vn30", "popular"],
+        "sectors": ["banking", "real_estate", "technology", "manufacturing", "consumer", "energy", "securities", "construction", "utilities", "transportation"],
+        "sector_sizes": {
+            "banking": "40 mã (từ big banks đến financial services)",
+            "real_estate": "40 mã (developers, construction, infrastructure)",
+            "technology": "40 mã (IT services, telecom, hardware, software)",
+            "manufacturing": "40 mã (steel, chemicals, electronics, machinery)",
+            "consumer": "40 mã (retail, F&B, personal care, tourism)",
+            "energy": "40 mã (oil & gas, power, renewable, mining)",
+            "securities": "40 mã (securities firms, asset management)",
+            "construction": "40 mã (construction, infrastructure, materials)",
+            "utilities": "40 mã (power, water, transport utilities)",
+            "transportation": "40 mã (airlines, shipping, logistics, ports)"
         }
     }
+}
+_ROOT_BYTES = orjson.dumps(_ROOT_INFO)
+_ROOT_ETAG = _etag(_ROOT_BYTES)
 
-@app.get("/phan-tich/{ma_co_phieu}")
-def phan_tich_co_phieu(ma_co_phieu: str):
-    """
-    Endpoint phân tích GTI cơ bản cho một mã cổ phiếu.
-    
-    Returns:
-        Phân tích GTI với điểm số 0-4 và tín hiệu BUY/HOLD/AVOID
-    """
+@app.get("/")
+async def read_root(request: Request):
+    return _json_with_etag(request, _ROOT_BYTES, _ROOT_ETAG, _STATIC_CACHE_CONTROL)
+
+async def _phan_tich_result(sym: str) -> dict:
+    """📊 Kết quả GTI cơ bản của một mã (dùng chung cho /phan-tich và /phan-tich/batch)"""
     # Tính toán thời gian lấy dữ liệu (1 năm từ hiện tại)
-    end_date = datetime.now().strftime("%Y-%m-%d")
-    start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
-    
-    # Lấy dữ liệu
-    df = lay_du_lieu_co_phieu_vnstock(
-        ma_co_phieu=ma_co_phieu.upper(),
-        start_date=start_date,
-        end_date=end_date
-    )
+    start_date, end_date = one_year_window()
+    
+    # Lấy dữ liệu (chạy trong thread để không block event loop)
+    df = await lay_du_lieu_async(sym, start_date, end_date)
     
     if df is None or df.empty:
-        raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã: {ma_co_phieu}")
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã: {sym}")
     
     # Tính toán chỉ báo GTI
-    df_analyzed = tinh_toan_chi_bao_ky_thuat(df)
+    df_analyzed = await asyncio.to_thread(tinh_toan_chi_bao_ky_thuat, df)
     
     # Lấy kết quả của ngày giao dịch gần nhất
-    latest = df_analyzed.iloc[-1]
+    row = _latest_row_values(df_analyzed)
+    num = _rounded_tail(df_analyzed)
     
     # Chuẩn bị kết quả trả về theo format GTI
     result = {
         # Thông tin cơ bản
-        "ma_co_phieu": ma_co_phieu.upper(),
-        "ngay_cap_nhat": latest.name.strftime("%Y-%m-%d") if hasattr(latest.name, 'strftime') else str(latest.name),
-        "gia_dong_cua": round(float(latest['close']), 2),
-        "gia_cao_nhat": round(float(latest['high']), 2),
-        "gia_thap_nhat": round(float(latest['low']), 2),
-        "khoi_luong": int(latest['volume']) if pd.notna(latest['volume']) else 0,
+        "ma_co_phieu": sym,
+        "ngay_cap_nhat": df_analyzed.index[-1].strftime("%Y-%m-%d"),
+        "gia_dong_cua": num.get('close'),
+        "gia_cao_nhat": num.get('high'),
+        "gia_thap_nhat": num.get('low'),
+        "khoi_luong": int(num['volume']) if num.get('volume') is not None else 0,
         
         # Các đường EMA theo GTI
-        "EMA10": round(float(latest['EMA10']), 2) if pd.notna(latest['EMA10']) else None,
-        "EMA20": round(float(latest['EMA20']), 2) if pd.notna(latest['EMA20']) else None,
-        "EMA50": round(float(latest['EMA50']), 2) if pd.notna(latest['EMA50']) else None,
-        "EMA200": round(float(latest['EMA200']), 2) if pd.notna(latest['EMA200']) else None,
+        "EMA10": num.get('EMA10'),
+        "EMA20": num.get('EMA20'),
+        "EMA50": num.get('EMA50'),
+        "EMA200": num.get('EMA200'),
         
         # Các chỉ số GTI chính
-        "gti_trend_check": bool(latest['gti_trend_check']) if pd.notna(latest['gti_trend_check']) else False,
-        "gti_recent_breakout": bool(latest['gti_recent_breakout']) if pd.notna(latest['gti_recent_breakout']) else False,
-        "gti_dist_to_high_percent": round(float(latest['gti_dist_to_high_percent']), 2) if pd.notna(latest['gti_dist_to_high_percent']) else None,
-        "gti_is_pullback": bool(latest['gti_is_pullback']) if pd.notna(latest['gti_is_pullback']) else False,
+        "gti_trend_check": bool(row['gti_trend_check']),
+        "gti_recent_breakout": bool(row['gti_recent_breakout']),
+        "gti_dist_to_high_percent": num.get('gti_dist_to_high_percent'),
+        "gti_is_pullback": bool(row['gti_is_pullback']),
         
         # Tổng kết GTI
-        "gti_score": int(latest['gti_score']) if pd.notna(latest['gti_score']) else 0,
-        "gti_signal": str(latest['gti_signal']) if pd.notna(latest['gti_signal']) else "HOLD",
+        "gti_score": int(row['gti_score']) if row['gti_score'] is not None else 0,
+        "gti_signal": str(row['gti_signal']) if row['gti_signal'] is not None else "HOLD",
         
         # Metadata
         "he_thong": "GTI - Growth Trading Intelligence",
         "phien_ban": "3.0.0",
         "ghi_chu": "Phân tích GTI cơ bản. Sử dụng /full-analysis/{ma_co_phieu} để có pattern detection."
     }
-
     return result
 
+@app.get("/phan-tich/{ma_co_phieu}")
+async def phan_tich_co_phieu(request: Request, sym: str = Depends(validated_symbol)):
+    """
+    Endpoint phân tích GTI cơ bản cho một mã cổ phiếu.
+    
+    Returns:
+        Phân tích GTI với điểm số 0-4 và tín hiệu BUY/HOLD/AVOID
+    """
+    result = await _singleflight(('phan_tich', sym), _phan_tich_result, sym)
+    return _analysis_response(request, result)
+
+@app.post("/phan-tich/batch")
+async def phan_tich_batch(symbols: List[str]):
+    """
+    📊 Phân tích GTI cơ bản nhiều mã trong một request
+    
+    Body: ["FPT", "VIC", "HPG", ...] (tối đa BATCH_ANALYSIS_MAX_SYMBOLS mã)
+    Các mã chạy song song (giới hạn bởi BATCH_ANALYSIS_CONCURRENCY), gộp chung với request đơn lẻ đang chạy.
+    """
+    async def _analyze(symbol: str, _):
+        return await _singleflight(('phan_tich', symbol), _phan_tich_result, symbol)
+    
+    return await _run_batch(symbols, _analyze, _batch_error("phân tích"), _has_no_error, action="phân tích")
+
 @app.get("/full-analysis/{ma_co_phieu}")
-def full_analysis_co_phieu(ma_co_phieu: str):
+async def full_analysis_co_phieu(request: Request, sym: str = Depends(validated_symbol)):
     """
     🚀 Endpoint phân tích GTI PRO v2.0 TOÀN DIỆN
     
@@ -190,107 +472,129 @@ def full_analysis_co_phieu(ma_co_phieu: str):
     - News Search Context cho ChatGPT
     - Combined Scoring (-5 to +18 range)
     """
+    
     try:
         # Sử dụng comprehensive analysis function mới
-        result = comprehensive_gti_analysis(ma_co_phieu.upper())
+        result = await _singleflight(
+            ('comprehensive_analysis', sym),
+            cache_comprehensive_analysis, sym
+        )
         
         if result['status'] == 'error':
             raise HTTPException(status_code=404, detail=result['message'])
         
-        return result
+        return _analysis_response(request, result)
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi phân tích comprehensive cho {ma_co_phieu}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi phân tích comprehensive cho {sym}: {str(e)}")
+
+@app.post("/full-analysis-batch")
+async def full_analysis_batch(symbols: List[str]):
+    """
+    🚀 Phân tích TOÀN DIỆN nhiều mã trong một request
+    
+    Body: ["FPT", "VIC", "HPG", ...] (tối đa BATCH_ANALYSIS_MAX_SYMBOLS mã)
+    Các mã chạy song song (giới hạn bởi BATCH_ANALYSIS_CONCURRENCY) và dùng chung một market context.
+    """
+    async def _analyze(symbol: str, market_context):
+        return await _singleflight(
+            ('comprehensive_analysis', symbol),
+            cache_comprehensive_analysis, symbol, market_context
+        )
+    
+    def _on_error(symbol: str, exc: BaseException) -> dict:
+        return {"status": "error", "message": f"Lỗi phân tích {symbol}: {str(exc)}"}
+    
+    # 🌊 Bối cảnh thị trường giống nhau cho mọi mã - chỉ lấy một lần (prepare)
+    return await _run_batch(
+        symbols, _analyze, _on_error,
+        is_success=lambda r: bool(r) and r.get('status') == 'success',
+        action="phân tích", prepare=get_market_context
+    )
 
 @app.get("/full-analysis-legacy/{ma_co_phieu}")
-def full_analysis_legacy(ma_co_phieu: str):
+async def full_analysis_legacy(request: Request, sym: str = Depends(validated_symbol)):
     """
     🔥 Endpoint phân tích ĐẦY ĐỦ GTI + Pattern Detection (Legacy version)
     
     Returns:
         Phân tích tổng hợp GTI + 12 patterns miễn phí + điểm tổng hợp
     """
+    
     try:
-        # Tính toán thời gian lấy dữ liệu (1 năm từ hiện tại)
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
-        
-        # Lấy dữ liệu
-        df = lay_du_lieu_co_phieu_vnstock(
-            ma_co_phieu=ma_co_phieu.upper(),
-            start_date=start_date,
-            end_date=end_date
+        # Tính toán thời gian lấy dữ liệu (1 năm từ hiện tại) - chỉ gọi datetime.now() một lần
+        now = datetime.now()
+        start_date, end_date = one_year_window(now)
+        
+        # 🚀 Trả về kết quả đã cache trong ngày giao dịch nếu có
+        legacy_cache_params = {'stock_symbol': sym, 'trading_day': end_date}
+        cached_result = await gti_cache.aget('legacy_analysis', **legacy_cache_params)
+        if cached_result:
+            return _analysis_response(request, cached_result)
+        
+        # 🌊 Bối cảnh thị trường và ngành không phụ thuộc dữ liệu của mã
+        # → khởi chạy ngay, song song với việc tải giá và tính toán bên dưới
+        context_tasks = asyncio.gather(
+            asyncio.to_thread(get_market_context),
+            asyncio.to_thread(get_sector_analysis, sym)
         )
         
-        if df is None or df.empty:
-            raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã: {ma_co_phieu}")
-        
-        # Tính toán chỉ báo GTI
-        df_analyzed = tinh_toan_chi_bao_ky_thuat(df)
-        
-        # Phát hiện patterns miễn phí
-        df_patterns = detect_free_patterns(df_analyzed)
-        
-        # 🔥 THÊM: Phát hiện large chart patterns
-        df_patterns = detect_large_chart_patterns(df_patterns)
-        
-        # Phân tích kết quả patterns
-        pattern_results = phan_tich_pattern_results(df_patterns, ma_co_phieu.upper())
-        
-        # 🌊 THÊM: Lấy bối cảnh thị trường và ngành
-        market_context = get_market_context()
-        sector_analysis = get_sector_analysis(ma_co_phieu.upper())
+        try:
+            # Lấy dữ liệu
+            df = await lay_du_lieu_async(sym, start_date, end_date)
+            
+            if df is None or df.empty:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã: {sym}")
+            
+            # Tính toán chỉ báo GTI
+            df_analyzed = await asyncio.to_thread(tinh_toan_chi_bao_ky_thuat, df)
+            
+            # Phát hiện patterns miễn phí
+            df_patterns = await asyncio.to_thread(detect_free_patterns, df_analyzed)
+            
+            # 🔥 THÊM: Phát hiện large chart patterns
+            df_patterns = await asyncio.to_thread(detect_large_chart_patterns, df_patterns)
+            
+            # Phân tích kết quả patterns
+            pattern_results = await asyncio.to_thread(phan_tich_pattern_results, df_patterns, sym)
+            
+            market_context, sector_analysis = await context_tasks
+        except BaseException:
+            context_tasks.cancel()
+            raise
         
         # Lấy kết quả của ngày giao dịch gần nhất
-        latest = df_patterns.iloc[-1]
-        
-        # Safe date formatting
-        try:
-            if hasattr(latest.name, 'strftime'):
-                ngay_cap_nhat = latest.name.strftime("%Y-%m-%d")
-            else:
-                ngay_cap_nhat = str(latest.name)
-        except:
-            ngay_cap_nhat = datetime.now().strftime("%Y-%m-%d")
+        row = _latest_row_values(df_patterns)
+        num = _rounded_tail(df_patterns)
+        ngay_cap_nhat = df_patterns.index[-1].strftime("%Y-%m-%d")
         
         # Tính điểm tổng hợp - đảm bảo tất cả là int Python
-        gti_score = int(latest['gti_score']) if pd.notna(latest['gti_score']) else 0
+        gti_score = int(row['gti_score']) if row['gti_score'] is not None else 0
         bullish_score = int(pattern_results.get('bullish_score', 0))
         bearish_score = int(pattern_results.get('bearish_score', 0))
         tong_diem = int(gti_score + bullish_score - bearish_score)
         
         # Đánh giá tổng hợp
-        if tong_diem >= 4:
-            danh_gia = "🟢 RẤT TÍCH CỰC - CÂN NHẮC MUA"
-            mau_sac = "green"
-        elif tong_diem >= 2:
-            danh_gia = "🟡 TÍCH CỰC - THEO DÕI"
-            mau_sac = "yellow"
-        elif tong_diem >= 0:
-            danh_gia = "🟠 TRUNG TÍNH - CHỜ TÍN HIỆU"
-            mau_sac = "orange"
-        else:
-            danh_gia = "🔴 TIÊU CỰC - TRÁNH XA"
-            mau_sac = "red"
+        danh_gia, mau_sac = _get_rating(tong_diem)
         
         # Chuẩn bị kết quả trả về
         result = {
             # Thông tin cơ bản
-            "ma_co_phieu": ma_co_phieu.upper(),
+            "ma_co_phieu": sym,
             "ngay_cap_nhat": ngay_cap_nhat,
-            "gia_dong_cua": round(float(latest['close']), 2),
-            "khoi_luong": int(latest['volume']) if pd.notna(latest['volume']) else 0,
+            "gia_dong_cua": num.get('close'),
+            "khoi_luong": int(num['volume']) if num.get('volume') is not None else 0,
             
             # GTI Analysis
             "gti_analysis": {
-                "gti_trend_check": bool(latest['gti_trend_check']) if pd.notna(latest['gti_trend_check']) else False,
-                "gti_recent_breakout": bool(latest['gti_recent_breakout']) if pd.notna(latest['gti_recent_breakout']) else False,
-                "gti_dist_to_high_percent": round(float(latest['gti_dist_to_high_percent']), 2) if pd.notna(latest['gti_dist_to_high_percent']) else None,
-                "gti_is_pullback": bool(latest['gti_is_pullback']) if pd.notna(latest['gti_is_pullback']) else False,
+                "gti_trend_check": bool(row['gti_trend_check']),
+                "gti_recent_breakout": bool(row['gti_recent_breakout']),
+                "gti_dist_to_high_percent": num.get('gti_dist_to_high_percent'),
+                "gti_is_pullback": bool(row['gti_is_pullback']),
                 "gti_score": gti_score,
-                "gti_signal": str(latest['gti_signal']) if pd.notna(latest['gti_signal']) else "HOLD"
+                "gti_signal": str(row['gti_signal']) if row['gti_signal'] is not None else "HOLD"
             },
             
             # Pattern Analysis
@@ -311,10 +615,10 @@ def full_analysis_legacy(ma_co_phieu: str):
             
             # Support/Resistance Levels
             "levels": {
-                "support_level": round(float(latest['support_level']), 2) if pd.notna(latest['support_level']) else None,
-                "resistance_level": round(float(latest['resistance_level']), 2) if pd.notna(latest['resistance_level']) else None,
-                "EMA10": round(float(latest['EMA10']), 2) if pd.notna(latest['EMA10']) else None,
-                "EMA20": round(float(latest['EMA20']), 2) if pd.notna(latest['EMA20']) else None
+                "support_level": num.get('support_level'),
+                "resistance_level": num.get('resistance_level'),
+                "EMA10": num.get('EMA10'),
+                "EMA20": num.get('EMA20')
             },
             
             # 🌊 Market Context & Sector Analysis
@@ -324,37 +628,43 @@ def full_analysis_legacy(ma_co_phieu: str):
             # Metadata
             "he_thong": "GTI + Pattern Detection + Market Context",
             "phien_ban": "3.1.0",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
+        
+        await gti_cache.aset(
+            'legacy_analysis', result,
+            expiry_seconds=GTIConfig.ANALYSIS_CACHE_EXPIRY_SECONDS,
+            **legacy_cache_params
+        )
 
-        return result
+        return _analysis_response(request, result)
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi xử lý dữ liệu cho {ma_co_phieu}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi xử lý dữ liệu cho {sym}: {str(e)}")
 
 @app.get("/news-context/{ma_co_phieu}")
-def get_news_context(ma_co_phieu: str):
+async def get_news_context(sym: str = Depends(validated_symbol)):
     """
     📰 Endpoint cho ChatGPT lấy news search context
     
     Returns:
         Context và hướng dẫn search tin tức cho ChatGPT
     """
+    
     try:
-        # Lấy thông tin ngành
-        sector_analysis = get_sector_analysis(ma_co_phieu.upper())
-        sector_name = sector_analysis.get('sector_name') if sector_analysis.get('status') == 'success' else None
+        # Lấy tên ngành (tra cứu tĩnh - không cần tải dữ liệu mã đại diện ngành)
+        sector_name = get_sector_name(sym)
         
         # Tạo news search context
-        news_context = prepare_news_search_context(ma_co_phieu.upper(), sector_name)
+        news_context = prepare_news_search_context(sym, sector_name)
         
         return {
-            "stock_symbol": ma_co_phieu.upper(),
+            "stock_symbol": sym,
             "sector_info": {
                 "sector_name": sector_name,
-                "status": sector_analysis.get('status', 'unknown')
+                "status": "success" if sector_name else "unknown_sector"
             },
             "news_search_context": news_context,
             "important_note": "📊 Tất cả dữ liệu về giá, volume, chỉ số kỹ thuật đã được cung cấp qua API - CHỈ search tin tức và sự kiện!"
@@ -362,110 +672,145 @@ def get_news_context(ma_co_phieu: str):
         
     except Exception as e:
         return {
-            "error": f"Lỗi tạo news context cho {ma_co_phieu}: {str(e)}",
-            "fallback_context": prepare_news_search_context(ma_co_phieu.upper(), None)
+            "error": f"Lỗi tạo news context cho {sym}: {str(e)}",
+            "fallback_context": prepare_news_search_context(sym, None)
         }
 
+_PATTERNS_INFO = {
+    "title": "🎯 16 Chart Patterns Detection",
+    "version": "Enhanced v2.0",
+    "basic_patterns": {
+        "candlestick_patterns": [
+            {"name": "Doji", "description": "Nến doji - biểu hiện sự do dự của thị trường", "points": 0},
+            {"name": "Hammer", "description": "Nến búa - tín hiệu đảo chiều tăng", "points": "+1"},
+            {"name": "Hanging Man", "description": "Nến treo cổ - tín hiệu đảo chiều giảm", "points": "-1"}
+        ],
+        "engulfing_patterns": [
+            {"name": "Bullish Engulfing", "description": "Nến bao phủ tăng - tín hiệu mạnh", "points": "+1"},
+            {"name": "Bearish Engulfing", "description": "Nến bao phủ giảm - tín hiệu yếu", "points": "-1"}
+        ],
+        "star_patterns": [
+            {"name": "Morning Star", "description": "Sao mai - 3 nến đảo chiều tăng", "points": "+1"},
+            {"name": "Evening Star", "description": "Sao hôm - 3 nến đảo chiều giảm", "points": "-1"}
+        ],
+        "breakout_patterns": [
+            {"name": "Resistance Breakout", "description": "Vượt kháng cự với volume cao", "points": "+1"},
+            {"name": "Support Breakdown", "description": "Thủng hỗ trợ với volume cao", "points": "-1"}
+        ],
+        "volume_patterns": [
+            {"name": "Volume Spike", "description": "Khối lượng bất thường > 2x trung bình", "points": 0}
+        ],
+        "gap_patterns": [
+            {"name": "Gap Up", "description": "Gap tăng với momentum", "points": "+1"},
+            {"name": "Gap Down", "description": "Gap giảm với momentum", "points": "-1"}
+        ],
+        "trend_patterns": [
+            {"name": "Strong Uptrend", "description": "Xu hướng tăng mạnh 5 ngày", "points": "+1"}
+        ]
+    },
+    "large_patterns": {
+        "description": "Large chart patterns (worth 2 points each)",
+        "patterns": [
+            {"name": "Cup & Handle", "description": "Cup & Handle - mẫu hình chứa sâu + tay cầm", "points": "+2"},
+            {"name": "Bull Flag", "description": "Bull Flag - cột cờ + consolidation", "points": "+2"},
+            {"name": "Base n' Break", "description": "Base n' Break - tích lũy + breakout", "points": "+2"},
+            {"name": "Ascending Triangle", "description": "Ascending Triangle - support tăng dần", "points": "+2"}
+        ]
+    },
+    "scoring_system": {
+        "basic_bullish": ["bullish_engulfing", "morning_star", "hammer", "resistance_breakout", "gap_up", "strong_uptrend"],
+        "basic_bearish": ["bearish_engulfing", "evening_star", "hanging_man", "support_breakdown", "gap_down"],
+        "neutral_patterns": ["doji", "volume_spike"],
+        "large_bullish": ["cup_handle", "bull_flag", "base_n_break", "ascending_triangle"],
+        "scoring_formula": "GTI (0-4) + Basic Bullish (+1 each) - Basic Bearish (-1 each) + Large Patterns (+2 each) + Market Context Adjustments"
+    },
+    "total_range": "Score range: -5 to +18 points"
+}
+_PATTERNS_BYTES = orjson.dumps(_PATTERNS_INFO)
+_PATTERNS_ETAG = _etag(_PATTERNS_BYTES)
+
 @app.get("/patterns-info")
-def patterns_info():
+async def patterns_info(request: Request):
     """
     Thông tin về 16 patterns được sử dụng (12 basic + 4 large)
     """
-    return {
-        "title": "🎯 16 Chart Patterns Detection",
-        "version": "Enhanced v2.0",
-        "basic_patterns": {
-            "candlestick_patterns": [
-                {"name": "Doji", "description": "Nến doji - biểu hiện sự do dự của thị trường", "points": 0},
-                {"name": "Hammer", "description": "Nến búa - tín hiệu đảo chiều tăng", "points": "+1"},
-                {"name": "Hanging Man", "description": "Nến treo cổ - tín hiệu đảo chiều giảm", "points": "-1"}
-            ],
-            "engulfing_patterns": [
-                {"name": "Bullish Engulfing", "description": "Nến bao phủ tăng - tín hiệu mạnh", "points": "+1"},
-                {"name": "Bearish Engulfing", "description": "Nến bao phủ giảm - tín hiệu yếu", "points": "-1"}
-            ],
-            "star_patterns": [
-                {"name": "Morning Star", "description": "Sao mai - 3 nến đảo chiều tăng", "points": "+1"},
-                {"name": "Evening Star", "description": "Sao hôm - 3 nến đảo chiều giảm", "points": "-1"}
-            ],
-            "breakout_patterns": [
-                {"name": "Resistance Breakout", "description": "Vượt kháng cự với volume cao", "points": "+1"},
-                {"name": "Support Breakdown", "description": "Thủng hỗ trợ với volume cao", "points": "-1"}
-            ],
-            "volume_patterns": [
-                {"name": "Volume Spike", "description": "Khối lượng bất thường > 2x trung bình", "points": 0}
-            ],
-            "gap_patterns": [
-                {"name": "Gap Up", "description": "Gap tăng với momentum", "points": "+1"},
-                {"name": "Gap Down", "description": "Gap giảm với momentum", "points": "-1"}
-            ],
-            "trend_patterns": [
-                {"name": "Strong Uptrend", "description": "Xu hướng tăng mạnh 5 ngày", "points": "+1"}
-            ]
-        },
-        "large_patterns": {
-            "description": "Large chart patterns (worth 2 points each)",
-            "patterns": [
-                {"name": "Cup & Handle", "description": "Cup & Handle - mẫu hình chứa sâu + tay cầm", "points": "+2"},
-                {"name": "Bull Flag", "description": "Bull Flag - cột cờ + consolidation", "points": "+2"},
-                {"name": "Base n' Break", "description": "Base n' Break - tích lũy + breakout", "points": "+2"},
-                {"name": "Ascending Triangle", "description": "Ascending Triangle - support tăng dần", "points": "+2"}
-            ]
-        },
-        "scoring_system": {
-            "basic_bullish": ["bullish_engulfing", "morning_star", "hammer", "resistance_breakout", "gap_up", "strong_uptrend"],
-            "basic_bearish": ["bearish_engulfing", "evening_star", "hanging_man", "support_breakdown", "gap_down"],
-            "neutral_patterns": ["doji", "volume_spike"],
-            "large_bullish": ["cup_handle", "bull_flag", "base_n_break", "ascending_triangle"],
-            "scoring_formula": "GTI (0-4) + Basic Bullish (+1 each) - Basic Bearish (-1 each) + Large Patterns (+2 each) + Market Context Adjustments"
-        },
-        "total_range": "Score range: -5 to +18 points"
-    }
+    return _json_with_etag(request, _PATTERNS_BYTES, _PATTERNS_ETAG, _STATIC_CACHE_CONTROL)
 
-@app.get("/custom-gpt-instructions")
-def get_custom_gpt_instructions():
-    """
-    Endpoint để Custom GPT đọc hướng dẫn từ file custom_gpt.md
-    """
+_CUSTOM_GPT_PATH = "custom_gpt.md"
+
+def _load_custom_gpt_md():
+    """📄 Đọc custom_gpt.md → (content, error)"""
     try:
-        with open("custom_gpt.md", "r", encoding="utf-8") as f:
-            content = f.read()
-        return {
-            "instructions": content,
-            "usage": "Đây là hướng dẫn chi tiết để tích hợp API với Custom GPT",
-            "api_base_url": "Sử dụng URL hiện tại của server này",
-            "main_endpoints": [
-                "/full-analysis/{ma_co_phieu}",
-                "/phan-tich/{ma_co_phieu}",
-                "/gti-info",
-                "/patterns-info"
-            ]
-        }
+        with open(_CUSTOM_GPT_PATH, "r", encoding="utf-8") as f:
+            return f.read(), None
     except FileNotFoundError:
-        return {"error": "File custom_gpt.md không tồn tại"}
+        return None, "File custom_gpt.md không tồn tại"
     except Exception as e:
-        return {"error": f"Lỗi đọc file: {str(e)}"}
+        return None, f"Lỗi đọc file: {str(e)}"
+
+# 📦 Response dựng sẵn, chỉ đọc/serialize lại khi mtime của file thay đổi
+_custom_gpt = {"mtime": None, "body": None, "etag": None}
+
+def _custom_gpt_payload() -> tuple:
+    """📄 (body, etag) của /custom-gpt-instructions - một lần os.stat mỗi request, không đọc file"""
+    try:
+        mtime = os.stat(_CUSTOM_GPT_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+    
+    if _custom_gpt["body"] is None or mtime != _custom_gpt["mtime"]:
+        content, error = _load_custom_gpt_md()
+        if content is None:
+            info = {"error": error}
+        else:
+            info = {
+                "instructions": content,
+                "usage": "Đây là hướng dẫn chi tiết để tích hợp API với Custom GPT",
+                "api_base_url": "Sử dụng URL hiện tại của server này",
+                "main_endpoints": [
+                    "/full-analysis/{ma_co_phieu}",
+                    "/phan-tich/{ma_co_phieu}",
+                    "/gti-info",
+                    "/patterns-info"
+                ]
+            }
+        body = orjson.dumps(info)
+        _custom_gpt.update(mtime=mtime, body=body, etag=_etag(body))
+    
+    return _custom_gpt["body"], _custom_gpt["etag"]
+
+_custom_gpt_payload()  # Nạp sẵn khi khởi động
+
+@app.get("/custom-gpt-instructions")
+async def get_custom_gpt_instructions(request: Request):
+    """
+    Endpoint để Custom GPT đọc hướng dẫn từ file custom_gpt.md (nạp sẵn, tự nạp lại khi file đổi)
+    """
+    body, etag = _custom_gpt_payload()
+    return _json_with_etag(request, body, etag, _STATIC_CACHE_CONTROL)
+
+_TEST_BYTES = orjson.dumps({"status": "OK", "message": "Test endpoint works!"})
 
 @app.get("/test")
-def test_endpoint():
+async def test_endpoint():
     """Simple test endpoint"""
-    return {"status": "OK", "message": "Test endpoint works!"}
+    return Response(content=_TEST_BYTES, media_type="application/json")
 
 @app.get("/test-data/{stock}")
-def test_data_only(stock: str):
+async def test_data_only(sym: str = Depends(validated_stock)):
     """Test data fetching only"""
+    
     try:
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        start_date, end_date = one_year_window()
         
-        df = lay_du_lieu_co_phieu_vnstock(stock.upper(), start_date, end_date)
+        df = await lay_du_lieu_async(sym, start_date, end_date, use_cache=False)
         
         if df is None or df.empty:
-            return {"error": "No data", "stock": stock}
+            return {"error": "No data", "stock": sym}
         
         return {
             "success": True,
-            "stock": stock.upper(),
+            "stock": sym,
             "rows": len(df),
             "columns": len(df.columns),
             "last_close": float(df['close'].iloc[-1]),
@@ -475,24 +820,24 @@ def test_data_only(stock: str):
         return {"error": str(e), "type": type(e).__name__}
 
 @app.get("/test-gti/{stock}")
-def test_gti_only(stock: str):
+async def test_gti_only(sym: str = Depends(validated_stock)):
     """Test GTI calculation only"""
+    
     try:
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        start_date, end_date = one_year_window()
         
         # Step 1: Get data
-        df = lay_du_lieu_co_phieu_vnstock(stock.upper(), start_date, end_date)
+        df = await lay_du_lieu_async(sym, start_date, end_date)
         if df is None or df.empty:
             return {"error": "No data", "step": 1}
         
         # Step 2: GTI calculation
-        df_gti = tinh_toan_chi_bao_ky_thuat(df)
+        df_gti = await asyncio.to_thread(tinh_toan_chi_bao_ky_thuat, df)
         latest = df_gti.iloc[-1]
         
         return {
             "success": True,
-            "stock": stock.upper(),
+            "stock": sym,
             "gti_score": int(latest['gti_score']),
             "gti_signal": str(latest['gti_signal']),
             "gti_trend_check": bool(latest['gti_trend_check']),
@@ -503,27 +848,27 @@ def test_gti_only(stock: str):
         return {"error": str(e), "type": type(e).__name__}
 
 @app.get("/debug/{ma_co_phieu}")
-def debug_analysis(ma_co_phieu: str):
+async def debug_analysis(sym: str = Depends(validated_symbol)):
     """
     Debug endpoint để test từng bước
     """
+    
     try:
         # Step 1: Get data
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        start_date, end_date = one_year_window()
         
-        df = lay_du_lieu_co_phieu_vnstock(ma_co_phieu.upper(), start_date, end_date)
+        df = await lay_du_lieu_async(sym, start_date, end_date)
         if df is None or df.empty:
             return {"error": "Không có dữ liệu", "step": 1}
         
         # Step 2: GTI calculation
-        df_gti = tinh_toan_chi_bao_ky_thuat(df)
+        df_gti = await asyncio.to_thread(tinh_toan_chi_bao_ky_thuat, df)
         
         # Step 3: Pattern detection
-        df_patterns = detect_free_patterns(df_gti)
+        df_patterns = await asyncio.to_thread(detect_free_patterns, df_gti)
         
         # Step 4: Pattern results
-        pattern_results = phan_tich_pattern_results(df_patterns, ma_co_phieu.upper())
+        pattern_results = await asyncio.to_thread(phan_tich_pattern_results, df_patterns, sym)
         
         # Step 5: Latest data
         latest = df_patterns.iloc[-1]
@@ -535,52 +880,57 @@ def debug_analysis(ma_co_phieu: str):
             "bullish_score": pattern_results.get('bullish_score', 0),
             "bearish_score": pattern_results.get('bearish_score', 0),
             "pattern_results_keys": list(pattern_results.keys()) if pattern_results else [],
-            "latest_columns": list(latest.index)[:10]  # First 10 columns
+            "latest_columns": latest.index[:10].tolist()  # First 10 columns
         }
         
     except Exception as e:
         return {"error": str(e), "type": str(type(e).__name__)}
 
+_GTI_INFO = {
+    "ten_he_thong": "GTI - Growth Trading Intelligence", 
+    "muc_tieu": {
+        "thoi_gian_nam_giu": "Tối đa 1 tháng",
+        "sinh_loi_muc_tieu": "10-25%",
+        "cat_lo": "5-8%"
+    },
+    "tieu_chi_loc": [
+        "✅ Xu hướng kỹ thuật: EMA10 > EMA20 và giá nằm trên cả EMA10 & EMA20",
+        "✅ Volume & breakout: Có ít nhất 1 phiên breakout với volume > 1.5x TB20",
+        "✅ Vị trí giá: Ưu tiên cổ phiếu tiệm cận đỉnh 1 năm (< 15%)",
+        "✅ Pullback đúng chuẩn: Sau breakout, pullback về EMA10 hoặc EMA20"
+    ],
+    "bang_diem_gti": {
+        "4_diem": "🟢 RẤT TÍCH CỰC - BUY signal",
+        "3_diem": "🟡 TÍCH CỰC - Theo dõi",
+        "2_diem": "🟠 TRUNG TÍNH - HOLD",
+        "0-1_diem": "🔴 TIÊU CỰC - AVOID"
+    },
+    "chi_so_tra_ve": {
+        "gti_trend_check": "Kiểm tra xu hướng GTI (True/False)",
+        "gti_recent_breakout": "Có breakout gần đây không (True/False)",
+        "gti_dist_to_high_percent": "Khoảng cách đến đỉnh 1 năm (%)",
+        "gti_is_pullback": "Đang pullback về EMA10/20 không (True/False)",
+        "gti_score": "Điểm tổng GTI (0-4)",
+        "gti_signal": "Tín hiệu GTI (BUY/HOLD/AVOID)"
+    }
+}
+_GTI_BYTES = orjson.dumps(_GTI_INFO)
+_GTI_ETAG = _etag(_GTI_BYTES)
+
 @app.get("/gti-info")
-def gti_info():
+async def gti_info(request: Request):
     """
     Thông tin chi tiết về hệ thống GTI
     """
-    return {
-        "ten_he_thong": "GTI - Growth Trading Intelligence", 
-        "muc_tieu": {
-            "thoi_gian_nam_giu": "Tối đa 1 tháng",
-            "sinh_loi_muc_tieu": "10-25%",
-            "cat_lo": "5-8%"
-        },
-        "tieu_chi_loc": [
-            "✅ Xu hướng kỹ thuật: EMA10 > EMA20 và giá nằm trên cả EMA10 & EMA20",
-            "✅ Volume & breakout: Có ít nhất 1 phiên breakout với volume > 1.5x TB20",
-            "✅ Vị trí giá: Ưu tiên cổ phiếu tiệm cận đỉnh 1 năm (< 15%)",
-            "✅ Pullback đúng chuẩn: Sau breakout, pullback về EMA10 hoặc EMA20"
-        ],
-        "bang_diem_gti": {
-            "4_diem": "🟢 RẤT TÍCH CỰC - BUY signal",
-            "3_diem": "🟡 TÍCH CỰC - Theo dõi",
-            "2_diem": "🟠 TRUNG TÍNH - HOLD",
-            "0-1_diem": "🔴 TIÊU CỰC - AVOID"
-        },
-        "chi_so_tra_ve": {
-            "gti_trend_check": "Kiểm tra xu hướng GTI (True/False)",
-            "gti_recent_breakout": "Có breakout gần đây không (True/False)",
-            "gti_dist_to_high_percent": "Khoảng cách đến đỉnh 1 năm (%)",
-            "gti_is_pullback": "Đang pullback về EMA10/20 không (True/False)",
-            "gti_score": "Điểm tổng GTI (0-4)",
-            "gti_signal": "Tín hiệu GTI (BUY/HOLD/AVOID)"
-        }
-    }
+    return _json_with_etag(request, _GTI_BYTES, _GTI_ETAG, _STATIC_CACHE_CONTROL)
 
 @app.get("/market-scan")
+@_scan_json(GTIConfig.SCAN_RESPONSE_CACHE_SECONDS)
 def market_scan_full(
     category: str = "vn30",
-    min_gti_score: int = 2, 
-    min_combined_score: int = 3,
-    limit: Optional[int] = None
+    min_gti_score: GtiScoreQuery = 2, 
+    min_combined_score: CombinedScoreQuery = 3,
+    limit: Annotated[Optional[int], Query(ge=1)] = None
 ):
     """
     🔍 MARKET SCANNER - Quét thị trường theo danh mục (SECTOR-BASED)
@@ -605,13 +955,6 @@ def market_scan_full(
     try:
         print(f"🔍 Market Scan Request: category={category}, min_gti={min_gti_score}, min_combined={min_combined_score}")
         
-        # Validate parameters
-        if min_gti_score < 0 or min_gti_score > 4:
-            raise HTTPException(status_code=400, detail="min_gti_score phải từ 0-4")
-        
-        if min_combined_score < -5 or min_combined_score > 18:
-            raise HTTPException(status_code=400, detail="min_combined_score phải từ -5 đến 18")
-        
         # Thực hiện market scan với cache
         scan_result = cache_market_scan(
             category=category,
@@ -625,7 +968,7 @@ def market_scan_full(
         
         # Áp dụng limit nếu có
         results = scan_result["scan_results"]
-        if limit and limit > 0:
+        if limit:
             results = results[:limit]
         
         # Chuẩn bị response
@@ -663,7 +1006,8 @@ def market_scan_full(
         raise HTTPException(status_code=500, detail=f"Lỗi market scan: {str(e)}")
 
 @app.get("/market-scan/vn30")
-def market_scan_vn30_quick(min_gti_score: int = 3, min_combined_score: int = 4):
+@_scan_json(GTIConfig.SCAN_RESPONSE_CACHE_SECONDS)
+def market_scan_vn30_quick(min_gti_score: GtiScoreQuery = 3, min_combined_score: CombinedScoreQuery = 4):
     """
     🎯 QUICK VN30 SCAN - Quét nhanh VN30 với tiêu chí cao
     
@@ -702,7 +1046,8 @@ def market_scan_vn30_quick(min_gti_score: int = 3, min_combined_score: int = 4):
         raise HTTPException(status_code=500, detail=f"Lỗi VN30 scan: {str(e)}")
 
 @app.get("/market-scan/top-picks")
-def market_scan_top_picks_endpoint(limit: int = 15):
+@_scan_json(GTIConfig.SCAN_RESPONSE_CACHE_SECONDS)
+def market_scan_top_picks_endpoint(limit: TopPicksLimitQuery = 15):
     """
     🏆 TOP PICKS - Lấy top mã cổ phiếu tốt nhất từ tất cả sectors
     
@@ -718,9 +1063,6 @@ def market_scan_top_picks_endpoint(limit: int = 15):
         - An toàn hơn, tránh rate limiting, coverage đầy đủ các ngành
     """
     try:
-        if limit < 1 or limit > 50:
-            raise HTTPException(status_code=400, detail="Limit phải từ 1-50")
-        
         top_picks_result = market_scan_top_picks(limit=limit)
         
         if "message" in top_picks_result:
@@ -753,10 +1095,11 @@ def market_scan_top_picks_endpoint(limit: int = 15):
         raise HTTPException(status_code=500, detail=f"Lỗi top picks: {str(e)}")
 
 @app.get("/market-scan/sector/{sector}")
+@_scan_json(GTIConfig.SCAN_RESPONSE_CACHE_SECONDS)
 def market_scan_by_sector(
     sector: str,
-    min_gti_score: int = 2,
-    min_combined_score: int = 3
+    min_gti_score: GtiScoreQuery = 2,
+    min_combined_score: CombinedScoreQuery = 3
 ):
     """
     🏢 SECTOR SCAN - Quét theo ngành cụ thể
@@ -771,11 +1114,10 @@ def market_scan_by_sector(
     """
     try:
         # Validate sector
-        available_sectors = list(GTIConfig.SECTOR_STOCKS.keys())
-        if sector.lower() not in available_sectors:
+        if sector.lower() not in AVAILABLE_SECTORS:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Ngành '{sector}' không hợp lệ. Các ngành có sẵn: {available_sectors}"
+                detail=f"Ngành '{sector}' không hợp lệ. Các ngành có sẵn: {list(GTIConfig.SECTOR_STOCKS)}"
             )
         
         scan_result = market_scan_by_category(
@@ -786,6 +1128,7 @@ def market_scan_by_sector(
         
         results = scan_result["scan_results"]
         sector_stocks = GTIConfig.SECTOR_STOCKS[sector.lower()]
+        score_summary = summarize_scan_scores(results)
         
         return {
             "sector_analysis": {
@@ -800,11 +1143,11 @@ def market_scan_by_sector(
             },
             "sector_performance": {
                 "top_performer": results[0] if results else None,
-                "average_score": round(sum([s["combined_score"] for s in results]) / len(results), 2) if results else 0,
+                "average_score": score_summary["average_score"],
                 "score_distribution": {
-                    "excellent": len([s for s in results if s["combined_score"] >= 6]),
-                    "good": len([s for s in results if 4 <= s["combined_score"] < 6]),
-                    "fair": len([s for s in results if 2 <= s["combined_score"] < 4])
+                    "excellent": score_summary["excellent"],
+                    "good": score_summary["good"],
+                    "fair": score_summary["fair"]
                 }
             },
             "execution_info": scan_result["statistics"],
@@ -817,10 +1160,11 @@ def market_scan_by_sector(
         raise HTTPException(status_code=500, detail=f"Lỗi sector scan: {str(e)}")
 
 @app.get("/market-scan/custom")
+@_scan_json(GTIConfig.SCAN_RESPONSE_CACHE_SECONDS)
 def market_scan_custom_list(
     stocks: str,
-    min_gti_score: int = 2,
-    min_combined_score: int = 3
+    min_gti_score: GtiScoreQuery = 2,
+    min_combined_score: CombinedScoreQuery = 3
 ):
     """
     🎯 CUSTOM SCAN - Quét danh sách mã tùy chỉnh
@@ -835,7 +1179,7 @@ def market_scan_custom_list(
     """
     try:
         # Parse stock list
-        stock_list = [stock.strip().upper() for stock in stocks.split(",") if stock.strip()]
+        stock_list = parse_stock_list(stocks)
         
         if not stock_list:
             raise HTTPException(status_code=400, detail="Danh sách mã cổ phiếu không được để trống")
@@ -882,40 +1226,70 @@ def market_scan_custom_list(
         raise HTTPException(status_code=500, detail=f"Lỗi custom scan: {str(e)}")
 
 @app.get("/market-scan/quick-check/{stock}")
-def quick_check_single_stock(stock: str):
+async def quick_check_single_stock(sym: str = Depends(validated_stock)):
     """
     ⚡ QUICK CHECK - Kiểm tra nhanh một mã có đạt tiêu chí GTI không
     
     Args:
-        stock: Mã cổ phiếu cần kiểm tra
+        sym: Mã cổ phiếu cần kiểm tra
     
     Returns:
         Kết quả nhanh với điểm số và đánh giá
     """
+    return await _cached_quick_check(sym)
+
+@app.post("/market-scan/quick-check-batch")
+async def quick_check_batch(symbols: List[str]):
+    """
+    ⚡ Quick check nhiều mã trong một request
+    
+    Body: ["FPT", "VIC", "HPG", ...] (tối đa BATCH_ANALYSIS_MAX_SYMBOLS mã)
+    Mỗi mã trả về giống /market-scan/quick-check/{stock}; các mã chạy song song (giới hạn bởi
+    BATCH_ANALYSIS_CONCURRENCY) và dùng chung cache quick check theo ngày.
+    """
+    async def _check(symbol: str, _):
+        return await _cached_quick_check(symbol)
+    
+    return await _run_batch(symbols, _check, _batch_error("quick check"), _has_no_error, action="kiểm tra")
+
+async def _cached_quick_check(sym: str) -> dict:
+    """⚡ Quick check một mã, memo theo (mã, ngày) để dashboard poll liên tục không gọi lại vnstock"""
+    now = datetime.now()
+    cache_params = {'stock_symbol': sym, 'trading_date': now.date().isoformat()}
+    cached_result = await gti_cache.aget('quick_check', **cache_params)
+    if cached_result is not None:
+        return cached_result
+    
+    result = await _quick_check(sym, now)
+    await gti_cache.aset('quick_check', result, expiry_seconds=GTIConfig.QUICK_CHECK_CACHE_SECONDS, **cache_params)
+    return result
+
+async def _quick_check(sym: str, now: datetime) -> dict:
+    """⚡ Tính kết quả quick check (không cache)"""
     try:
-        result = scan_single_stock(
-            stock_symbol=stock.upper(),
-            min_gti_score=0,  # Không lọc để luôn có kết quả
-            min_combined_score=-10  # Để luôn trả về kết quả
+        result = await run_in_io_executor(
+            scan_single_stock,
+            sym,
+            0,  # min_gti_score: không lọc để luôn có kết quả
+            -10  # min_combined_score: để luôn trả về kết quả
         )
         
         if result is None:
             # Nếu không có kết quả, thử lấy dữ liệu cơ bản
             try:
-                end_date = datetime.now().strftime("%Y-%m-%d")
-                start_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+                start_date, end_date = one_year_window(now)
                 
-                df = lay_du_lieu_co_phieu_vnstock(stock.upper(), start_date, end_date)
+                df = await lay_du_lieu_async(sym, start_date, end_date)
                 if df is None or df.empty:
-                    raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã {stock}")
+                    raise HTTPException(status_code=404, detail=f"Không tìm thấy dữ liệu cho mã {sym}")
                 
-                df_analyzed = tinh_toan_chi_bao_ky_thuat(df)
-                latest = df_analyzed.iloc[-1]
-                gti_score = int(latest['gti_score']) if pd.notna(latest['gti_score']) else 0
+                df_analyzed = await asyncio.to_thread(tinh_toan_chi_bao_ky_thuat, df)
+                row = _latest_row_values(df_analyzed)
+                gti_score = int(row['gti_score']) if row.get('gti_score') is not None else 0
                 
                 return {
-                    "stock_symbol": stock.upper(),
-                    "current_price": round(float(latest['close']), 2),
+                    "stock_symbol": sym,
+                    "current_price": _rounded_tail(df_analyzed)['close'],
                     "gti_score": gti_score,
                     "quick_evaluation": "Không đạt tiêu chí GTI cơ bản" if gti_score < 2 else "Có tiềm năng",
                     "recommendation": "AVOID" if gti_score < 2 else "WATCH",
@@ -923,7 +1297,7 @@ def quick_check_single_stock(stock: str):
                 }
                 
             except Exception:
-                raise HTTPException(status_code=404, detail=f"Không thể lấy dữ liệu cho mã {stock}")
+                raise HTTPException(status_code=404, detail=f"Không thể lấy dữ liệu cho mã {sym}")
         
         return {
             "quick_check_result": {
@@ -944,7 +1318,7 @@ def quick_check_single_stock(stock: str):
             },
             "quick_summary": f"GTI: {result['gti_score']}/4, Pattern: {result['pattern_score']['bullish']}B/{result['pattern_score']['bearish']}Be, Tổng: {result['combined_score']}",
             "current_patterns": result["current_patterns"],
-            "check_timestamp": datetime.now().isoformat()
+            "check_timestamp": now.isoformat()
         }
         
     except HTTPException:
@@ -1023,8 +1397,32 @@ def clear_cache(operation: Optional[str] = None):
     except Exception as e:
         return {"error": f"Lỗi clear cache: {str(e)}"}
 
+# ⚡ Phần tĩnh của /system/performance - dựng một lần khi import
+_PERF_OPTIMIZATION_SETTINGS = {
+    "market_scan_timeout": f"{GTIConfig.MARKET_SCAN_TIMEOUT}s",
+    "batch_size": GTIConfig.MARKET_SCAN_BATCH_SIZE,
+    "single_stock_timeout": f"{GTIConfig.SINGLE_STOCK_TIMEOUT}s",
+    "chunk_size": GTIConfig.CHUNK_SIZE_FOR_LARGE_SCANS,
+    "progressive_timeout": GTIConfig.ENABLE_PROGRESSIVE_TIMEOUT,
+    "quick_mode": GTIConfig.TOP_PICKS_QUICK_MODE
+}
+_PERF_FEATURES = (
+    "✅ Chunked processing for large scans",
+    "✅ Progressive timeout scaling",
+    "✅ In-memory caching system",
+    "✅ Optimized worker pool",
+    "✅ Quick mode for top picks",
+    "✅ Individual stock result caching"
+)
+_PERF_RECOMMENDATIONS = {
+    "use_cache": "Enable caching for repeated requests",
+    "use_quick_mode": "Use quick mode for faster top picks",
+    "batch_requests": "Combine multiple stock checks into custom scans",
+    "limit_results": "Use limit parameter for faster responses"
+}
+
 @app.get("/system/performance")
-def get_system_performance():
+async def get_system_performance():
     """
     ⚡ SYSTEM PERFORMANCE - Tổng quan performance của hệ thống
     
@@ -1042,29 +1440,10 @@ def get_system_performance():
                     "hit_count": cache_stats.get("total_hits", 0),
                     "memory_usage": cache_stats.get("memory_usage_estimate", "N/A")
                 },
-                "optimization_settings": {
-                    "market_scan_timeout": f"{GTIConfig.MARKET_SCAN_TIMEOUT}s",
-                    "batch_size": GTIConfig.MARKET_SCAN_BATCH_SIZE,
-                    "single_stock_timeout": f"{GTIConfig.SINGLE_STOCK_TIMEOUT}s",
-                    "chunk_size": GTIConfig.CHUNK_SIZE_FOR_LARGE_SCANS,
-                    "progressive_timeout": GTIConfig.ENABLE_PROGRESSIVE_TIMEOUT,
-                    "quick_mode": GTIConfig.TOP_PICKS_QUICK_MODE
-                },
-                "performance_features": [
-                    "✅ Chunked processing for large scans",
-                    "✅ Progressive timeout scaling",
-                    "✅ In-memory caching system", 
-                    "✅ Optimized worker pool",
-                    "✅ Quick mode for top picks",
-                    "✅ Individual stock result caching"
-                ]
-            },
-            "recommendations": {
-                "use_cache": "Enable caching for repeated requests",
-                "use_quick_mode": "Use quick mode for faster top picks",
-                "batch_requests": "Combine multiple stock checks into custom scans",
-                "limit_results": "Use limit parameter for faster responses"
+                "optimization_settings": _PERF_OPTIMIZATION_SETTINGS,
+                "performance_features": _PERF_FEATURES
             },
+            "recommendations": _PERF_RECOMMENDATIONS,
             "timestamp": datetime.now().isoformat()
         }
         
@@ -1075,14 +1454,14 @@ def get_system_performance():
 # These endpoints implement the asynchronous processing pattern from upgrade.md
 
 @app.post("/market-scan/start")
-def start_market_scan_task(
+async def start_market_scan_task(
     task_type: str,
     category: Optional[str] = None,
     sector: Optional[str] = None,
     stocks: Optional[str] = None,
-    limit: Optional[int] = None,
-    min_gti_score: int = 2,
-    min_combined_score: int = 3
+    limit: Annotated[Optional[int], Query(ge=1, le=50)] = None,
+    min_gti_score: GtiScoreQuery = 2,
+    min_combined_score: CombinedScoreQuery = 3
 ):
     """
     🚀 START ASYNC TASK - Bắt đầu tác vụ quét thị trường bất đồng bộ
@@ -1107,11 +1486,10 @@ def start_market_scan_task(
     """
     try:
         # Validate task_type
-        valid_task_types = ["top_picks", "sector_scan", "category_scan", "custom_scan"]
-        if task_type not in valid_task_types:
+        if task_type not in TASK_TYPES:
             raise HTTPException(
                 status_code=400, 
-                detail=f"task_type không hợp lệ. Các loại hỗ trợ: {valid_task_types}"
+                detail=f"task_type không hợp lệ. Các loại hỗ trợ: {list(TASK_TYPES)}"
             )
         
         # Prepare parameters based on task type
@@ -1126,11 +1504,10 @@ def start_market_scan_task(
         elif task_type == "sector_scan":
             if not sector:
                 raise HTTPException(status_code=400, detail="sector là bắt buộc cho sector_scan")
-            available_sectors = list(GTIConfig.SECTOR_STOCKS.keys())
-            if sector.lower() not in available_sectors:
+            if sector.lower() not in AVAILABLE_SECTORS:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Ngành '{sector}' không hợp lệ. Các ngành có sẵn: {available_sectors}"
+                    detail=f"Ngành '{sector}' không hợp lệ. Các ngành có sẵn: {list(GTIConfig.SECTOR_STOCKS)}"
                 )
             parameters["sector"] = sector.lower()
             
@@ -1142,13 +1519,14 @@ def start_market_scan_task(
         elif task_type == "custom_scan":
             if not stocks:
                 raise HTTPException(status_code=400, detail="stocks là bắt buộc cho custom_scan")
-            stock_list = [s.strip().upper() for s in stocks.split(",") if s.strip()]
+            stock_list = parse_stock_list(stocks)
             if len(stock_list) > 50:
                 raise HTTPException(status_code=400, detail="Tối đa 50 mã cổ phiếu trong một lần scan")
-            parameters["stocks"] = stocks
+            # Lưu dạng chuẩn "FPT,VIC": task trùng danh sách gộp được, kết quả chỉ cần split
+            parameters["stocks"] = ",".join(stock_list)
         
         # Create and start task
-        task_id = task_manager.create_task(task_type, parameters)
+        task_id = await task_manager.acreate_task(task_type, parameters)
         
         return {
             "status": "processing_started",
@@ -1158,6 +1536,7 @@ def start_market_scan_task(
             "message": "Tác vụ đã được bắt đầu. Sử dụng task_id để kiểm tra tiến trình.",
             "next_steps": {
                 "check_status": f"GET /market-scan/status/{task_id}",
+                "stream_status": f"GET /market-scan/stream/{task_id}",
                 "get_result": f"GET /market-scan/result/{task_id}"
             },
             "estimated_time": {
@@ -1175,7 +1554,7 @@ def start_market_scan_task(
         raise HTTPException(status_code=500, detail=f"Lỗi khởi tạo task: {str(e)}")
 
 @app.get("/market-scan/status/{task_id}")
-def get_market_scan_status(task_id: str):
+async def get_market_scan_status(task_id: str):
     """
     🔍 CHECK STATUS - Kiểm tra trạng thái tác vụ bất đồng bộ
     
@@ -1193,7 +1572,7 @@ def get_market_scan_status(task_id: str):
         - expired: Đã hết hạn (>1 tiếng)
     """
     try:
-        status = task_manager.get_task_status(task_id)
+        status = await task_manager.aget_task_status(task_id)
         
         if not status:
             raise HTTPException(status_code=404, detail=f"Không tìm thấy task với ID: {task_id}")
@@ -1231,8 +1610,67 @@ def get_market_scan_status(task_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi kiểm tra status: {str(e)}")
 
+_TASK_FINAL_STATUSES = frozenset({"completed", "failed", "expired"})
+
+@app.get("/market-scan/stream/{task_id}")
+async def stream_market_scan_status(task_id: str, request: Request):
+    """
+    📡 STREAM STATUS - Server-Sent Events cho trạng thái tác vụ
+    
+    Gửi event "status" mỗi khi trạng thái/tiến trình thay đổi, đóng stream khi task
+    completed/failed/expired. Thay cho việc client poll /market-scan/status/{task_id}.
+    """
+    if not await task_manager.aget_task_status(task_id):
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy task với ID: {task_id}")
+    
+    async def _events():
+        last_state = None
+        while not await request.is_disconnected():
+            status = await task_manager.aget_task_status(task_id)
+            if status is None:
+                yield b"event: expired\ndata: {}\n\n"
+                return
+            state = (status["status"], status["progress_message"])
+            if state != last_state:
+                last_state = state
+                yield b"event: status\ndata: " + orjson.dumps(status) + b"\n\n"
+            if status["status"] in _TASK_FINAL_STATUSES:
+                return
+            await asyncio.sleep(GTIConfig.TASK_STREAM_INTERVAL_SECONDS)
+    
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _completed_task(task_id: str) -> tuple:
+    """📊 (status, result) của task đã hoàn thành; HTTPException theo trạng thái nếu chưa có kết quả"""
+    status = await task_manager.aget_task_status(task_id)
+    
+    if not status:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy task với ID: {task_id}")
+    
+    if status["status"] != "completed":
+        current_status = status["status"]
+        if current_status == "running":
+            raise HTTPException(status_code=202, detail="Tác vụ vẫn đang chạy. Vui lòng đợi.")
+        elif current_status == "failed":
+            raise HTTPException(status_code=400, detail=f"Tác vụ thất bại: {status.get('error', 'Unknown error')}")
+        elif current_status == "expired":
+            raise HTTPException(status_code=410, detail="Tác vụ đã hết hạn. Vui lòng tạo task mới.")
+        else:
+            raise HTTPException(status_code=202, detail=f"Tác vụ chưa hoàn thành. Status: {current_status}")
+    
+    result = await task_manager.aget_task_result(task_id)
+    
+    if not result:
+        raise HTTPException(status_code=404, detail="Không tìm thấy kết quả cho task này.")
+    
+    return status, result
+
 @app.get("/market-scan/result/{task_id}")
-def get_market_scan_result(task_id: str):
+async def get_market_scan_result(task_id: str, request: Request):
     """
     📊 GET RESULT - Lấy kết quả của tác vụ đã hoàn thành
     
@@ -1246,29 +1684,15 @@ def get_market_scan_result(task_id: str):
         - Chỉ có thể lấy kết quả khi status = "completed"
         - Kết quả sẽ bị xóa sau 1 tiếng để tiết kiệm bộ nhớ
     """
+    # Kết quả task đã xong không đổi → body JSON/gzip encode một lần, client poll lại nhận bytes có sẵn
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = await gti_cache.aget('task_result_etag', task_id=task_id)
+    body = await gti_cache.aget('task_result_gzip' if accepts_gzip else 'task_result_json', task_id=task_id)
+    if etag is not None and body is not None:
+        return _task_result_response(request, body, accepts_gzip, etag)
+    
     try:
-        # First check status
-        status = task_manager.get_task_status(task_id)
-        
-        if not status:
-            raise HTTPException(status_code=404, detail=f"Không tìm thấy task với ID: {task_id}")
-        
-        if status["status"] != "completed":
-            current_status = status["status"]
-            if current_status == "running":
-                raise HTTPException(status_code=202, detail="Tác vụ vẫn đang chạy. Vui lòng đợi.")
-            elif current_status == "failed":
-                raise HTTPException(status_code=400, detail=f"Tác vụ thất bại: {status.get('error', 'Unknown error')}")
-            elif current_status == "expired":
-                raise HTTPException(status_code=410, detail="Tác vụ đã hết hạn. Vui lòng tạo task mới.")
-            else:
-                raise HTTPException(status_code=202, detail=f"Tác vụ chưa hoàn thành. Status: {current_status}")
-        
-        # Get result
-        result = task_manager.get_task_result(task_id)
-        
-        if not result:
-            raise HTTPException(status_code=404, detail="Không tìm thấy kết quả cho task này.")
+        status, result = await _completed_task(task_id)
         
         # Format response with metadata
         response = {
@@ -1311,24 +1735,66 @@ def get_market_scan_result(task_id: str):
         elif result["task_type"] == "custom_scan":
             if "scan_results" in result["scan_result"]:
                 qualified_stocks = result["scan_result"]["scan_results"]
+                input_stocks = result["parameters"]["stocks"].split(",")
                 response["formatted_results"] = {
                     "scan_overview": "Custom scan completed successfully",
-                    "input_stocks": result["parameters"]["stocks"].split(","),
+                    "input_stocks": input_stocks,
                     "qualified_stocks": qualified_stocks,
-                    "qualification_rate": f"{len(qualified_stocks)}/{len(result['parameters']['stocks'].split(','))}"
+                    "qualification_rate": f"{len(qualified_stocks)}/{len(input_stocks)}"
                 }
         
-        return response
+        body = orjson.dumps(
+            response,
+            default=jsonable_encoder,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+        gzip_body = gzip.compress(body, compresslevel=GTIConfig.GZIP_COMPRESS_LEVEL)
+        etag = _etag(body)
+        await asyncio.gather(
+            gti_cache.aset('task_result_json', body, expiry_seconds=GTIConfig.TASK_TTL_SECONDS, task_id=task_id),
+            gti_cache.aset('task_result_gzip', gzip_body, expiry_seconds=GTIConfig.TASK_TTL_SECONDS, task_id=task_id),
+            gti_cache.aset('task_result_etag', etag, expiry_seconds=GTIConfig.TASK_TTL_SECONDS, task_id=task_id)
+        )
+        return _task_result_response(request, gzip_body if accepts_gzip else body, accepts_gzip, etag)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy kết quả: {str(e)}")
 
+@app.get("/market-scan/result/{task_id}/rows")
+async def stream_market_scan_rows(task_id: str):
+    """
+    📜 STREAM ROWS - Từng mã trong kết quả task dạng NDJSON (mỗi dòng một JSON object)
+    
+    Dành cho kết quả lớn: encode và gửi từng dòng, không dựng toàn bộ body JSON trong bộ nhớ.
+    Cùng điều kiện trạng thái với /market-scan/result/{task_id}.
+    """
+    _, result = await _completed_task(task_id)
+    scan_result = result["scan_result"]
+    rows = scan_result.get("top_picks") if result["task_type"] == "top_picks" else scan_result.get("scan_results")
+    
+    def _ndjson():
+        for row in rows or ():
+            yield orjson.dumps(
+                row,
+                default=jsonable_encoder,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+            )
+    
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
 # 📊 TASK MANAGEMENT ENDPOINTS
 
+# 📊 Phần tĩnh của /tasks/stats - dựng một lần khi import
+_TASK_RECOMMENDATIONS = {
+    "optimal_usage": "Sử dụng async endpoints cho scan lớn (>20 mã)",
+    "check_interval": "Kiểm tra status mỗi 15-30 giây (hoặc mở /market-scan/stream/{task_id} để nhận cập nhật)",
+    "task_cleanup": "Tasks tự động cleanup sau 1 tiếng"
+}
+
 @app.get("/tasks/stats")
-def get_task_manager_stats():
+async def get_task_manager_stats():
     """
     📊 TASK STATS - Xem thống kê của task manager
     
@@ -1345,13 +1811,23 @@ def get_task_manager_stats():
                 "background_workers": stats["executor_info"]["max_workers"],
                 "total_tasks_handled": stats["total_tasks"]
             },
-            "recommendations": {
-                "optimal_usage": "Sử dụng async endpoints cho scan lớn (>20 mã)",
-                "check_interval": "Kiểm tra status mỗi 15-30 giây",
-                "task_cleanup": "Tasks tự động cleanup sau 1 tiếng"
-            },
+            "recommendations": _TASK_RECOMMENDATIONS,
             "timestamp": datetime.now().isoformat()
         }
         
     except Exception as e:
-        return {"error": f"Lỗi lấy task stats: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Lỗi lấy task stats: {str(e)}"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # ⚡ Chạy trực tiếp: uvloop + httptools (có sẵn trong uvicorn[standard])
+    uvicorn.run(
+        "main_api:app",
+        host=GTIConfig.API_HOST,
+        port=GTIConfig.API_PORT,
+        workers=GTIConfig.UVICORN_WORKERS,
+        loop="uvloop",
+        http="httptools"
+    )
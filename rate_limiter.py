@@ -4,18 +4,25 @@
 🛡️ GTI Rate Limiter - Protect against VCI API rate limiting
 
 Implement rate limiting protection:
-- Delay between requests
+- Token bucket between requests (burst nhỏ, tốc độ trung bình 1/current_delay)
 - Retry logic with exponential backoff
 - Request queue management
 - Adaptive rate limiting
 """
 
+import asyncio
+import concurrent.futures
 import time
 import threading
 import random
+import re
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Callable, Any, Optional
 import functools
+import logging
+
+logger = logging.getLogger(__name__)
 
 class GTIRateLimiter:
     """
@@ -23,62 +30,145 @@ class GTIRateLimiter:
     """
     
     def __init__(self):
-        self.last_request_time = 0
         self.min_delay = 0.5  # Minimum 0.5 seconds between requests
         self.base_delay = 1.0  # Base delay in seconds
         self.max_delay = 10.0  # Maximum delay
-        self.current_delay = self.base_delay
-        self.lock = threading.Lock()
         self.retry_attempts = 3
         self.backoff_multiplier = 2
+        self.retry_backoff_base = 5.0  # Giây - trần chờ retry lần đầu, nhân đôi mỗi lần
+        self.max_backoff = 60.0  # Trần thời gian chờ retry
+        
+        # 🪣 Token bucket: mỗi request lấy 1 token, token nạp lại với tốc độ 1/current_delay mỗi giây.
+        # Thread chờ token qua Condition.wait (nhả lock khi ngủ) → các worker không xếp hàng sau một mutex.
+        self.capacity = 3.0  # Cho phép burst bằng số worker task nền
+        self.refill_rate = 1.0 / self.base_delay  # Tokens/giây
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.condition = threading.Condition()
+        
+        # 📶 Thời gian phản hồi quan sát được: min_rtt ≈ server rảnh, ewma_rtt tăng dần khi server bắt đầu nghẽn
+        self.rtt_samples = deque(maxlen=20)  # min_rtt lấy trên 20 mẫu gần nhất → baseline cũ không giữ mãi
+        self.ewma_rtt: Optional[float] = None
+        self.rtt_alpha = 0.2  # Trọng số mẫu mới trong EWMA
+        self.rtt_tolerance = 1.5  # ewma_rtt dưới min_rtt * hệ số này → coi như chưa nghẽn (chừa chỗ cho jitter)
+        self.rtt_inflation_samples = 5  # Số mẫu liên tiếp bị phình mới giảm tốc
+        self.rtt_inflated_streak = 0
         
         print(f"🛡️ GTI Rate Limiter initialized")
         print(f"   Min delay: {self.min_delay}s")
         print(f"   Base delay: {self.base_delay}s")
         print(f"   Max delay: {self.max_delay}s")
+        print(f"   Burst capacity: {self.capacity:.0f} requests")
         print(f"   Retry attempts: {self.retry_attempts}")
     
-    def wait_if_needed(self):
+    @property
+    def current_delay(self) -> float:
+        """Khoảng cách trung bình giữa các request ở tốc độ nạp hiện tại"""
+        return 1.0 / self.refill_rate
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+    
+    def acquire(self, n: int = 1):
         """
-        Chờ nếu cần thiết để tránh rate limiting
+        Lấy n token trước khi gọi API, chờ (không giữ lock) nếu bucket đang cạn
         """
-        with self.lock:
-            current_time = time.time()
-            time_since_last = current_time - self.last_request_time
-            
-            if time_since_last < self.current_delay:
-                sleep_time = self.current_delay - time_since_last
-                print(f"🛡️ Rate limiting protection: waiting {sleep_time:.2f}s")
-                time.sleep(sleep_time)
-            
-            self.last_request_time = time.time()
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                
+                sleep_time = (n - self.tokens) / self.refill_rate
+                logger.debug("🛡️ Rate limiting protection: waiting %.2fs", sleep_time)
+                # Được notify khi tốc độ nạp thay đổi → tính lại thời gian chờ ngay
+                self.condition.wait(timeout=sleep_time)
+    
+    def reserve(self, n: int = 1) -> float:
+        """
+        Đặt trước n token (có thể nợ token) và trả về số giây cần chờ trước khi gọi API.
+        Không chặn thread - dùng cho caller async chờ bằng asyncio.sleep.
+        """
+        with self.condition:
+            self._refill()
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.refill_rate)
+    
+    async def acquire_async(self, n: int = 1):
+        """Lấy n token từ coroutine: chờ trên event loop thay vì giữ một thread"""
+        sleep_time = self.reserve(n)
+        if sleep_time > 0:
+            logger.debug("🛡️ Rate limiting protection: waiting %.2fs", sleep_time)
+            await asyncio.sleep(sleep_time)
     
     def increase_delay(self):
         """
-        Tăng delay khi gặp rate limit
+        Giảm tốc độ nạp token khi gặp rate limit (và bỏ burst còn lại)
         """
-        with self.lock:
-            self.current_delay = min(self.current_delay * self.backoff_multiplier, self.max_delay)
-            print(f"🛡️ Increased delay to {self.current_delay:.2f}s due to rate limiting")
+        with self.condition:
+            self._refill()
+            self.refill_rate = max(self.refill_rate / self.backoff_multiplier, 1.0 / self.max_delay)
+            self.tokens = min(self.tokens, 0.0)
+            current_delay = self.current_delay
+        print(f"🛡️ Increased delay to {current_delay:.2f}s due to rate limiting")
+    
+    @property
+    def min_rtt(self) -> Optional[float]:
+        """RTT nhỏ nhất trong cửa sổ mẫu gần đây"""
+        return min(self.rtt_samples) if self.rtt_samples else None
     
-    def decrease_delay(self):
+    def record_success(self, rtt: float):
         """
-        Giảm delay khi requests thành công
+        📶 Điều chỉnh tốc độ nạp theo RTT của request thành công:
+        - Dưới mức cơ bản (sau rate limit): hồi dần về 1/base_delay như trước
+        - RTT gần min_rtt: tăng dần (tới 1/min_delay)
+        - RTT phình ra liên tục: giảm, nhưng không xuống dưới 1/base_delay - chỉ 429 mới đẩy xuống thấp hơn
         """
-        with self.lock:
-            self.current_delay = max(self.current_delay * 0.8, self.base_delay)
+        base_rate = 1.0 / self.base_delay
+        with self.condition:
+            self._refill()
+            self.rtt_samples.append(rtt)
+            self.ewma_rtt = rtt if self.ewma_rtt is None else (
+                self.rtt_alpha * rtt + (1 - self.rtt_alpha) * self.ewma_rtt
+            )
+            inflated = self.ewma_rtt >= self.rtt_tolerance * self.min_rtt
+            self.rtt_inflated_streak = self.rtt_inflated_streak + 1 if inflated else 0
+            
+            if self.refill_rate < base_rate:
+                self.refill_rate = min(self.refill_rate / 0.8, base_rate)
+                self.condition.notify_all()
+            elif not inflated:
+                self.refill_rate = min(self.refill_rate * 1.1, 1.0 / self.min_delay)
+                self.condition.notify_all()
+            elif self.rtt_inflated_streak >= self.rtt_inflation_samples:
+                self.refill_rate = max(self.refill_rate * 0.8, base_rate)
+                self.rtt_inflated_streak = 0
     
     def reset_delay(self):
         """
-        Reset delay về mức cơ bản
+        Reset tốc độ về mức cơ bản
         """
-        with self.lock:
-            self.current_delay = self.base_delay
-            print(f"🛡️ Reset delay to {self.base_delay}s")
+        with self.condition:
+            self._refill()
+            self.refill_rate = 1.0 / self.base_delay
+            self.rtt_samples.clear()
+            self.ewma_rtt = None
+            self.rtt_inflated_streak = 0
+            self.condition.notify_all()
+        print(f"🛡️ Reset delay to {self.base_delay}s")
 
 # Global rate limiter instance
 rate_limiter = GTIRateLimiter()
 
+# 🔎 Dấu hiệu lỗi rate limit trong message (một lượt regex, không cần lower() copy chuỗi)
+_RATE_LIMIT_RE = re.compile(r"rate|limit|quota|429|throttl", re.IGNORECASE)
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return _RATE_LIMIT_RE.search(str(e)) is not None
+
 def rate_limited_call(func: Callable, *args, **kwargs) -> Any:
     """
     Wrapper để thực hiện function call với rate limiting protection
@@ -86,30 +176,29 @@ def rate_limited_call(func: Callable, *args, **kwargs) -> Any:
     for attempt in range(rate_limiter.retry_attempts):
         try:
             # Wait before making request
-            rate_limiter.wait_if_needed()
+            rate_limiter.acquire()
             
             # Make the actual call
+            started = time.monotonic()
             result = func(*args, **kwargs)
             
-            # Success - gradually decrease delay
-            if attempt == 0:  # First attempt success
-                rate_limiter.decrease_delay()
+            # Success - chỉnh tốc độ theo RTT quan sát được
+            rate_limiter.record_success(time.monotonic() - started)
             
             return result
             
         except Exception as e:
-            error_str = str(e).lower()
-            
             # Check if it's a rate limit error
-            if "rate" in error_str or "limit" in error_str or "quota" in error_str:
+            if is_rate_limit_error(e):
                 print(f"🛡️ Rate limit detected on attempt {attempt + 1}: {str(e)}")
                 
                 # Increase delay for future requests
                 rate_limiter.increase_delay()
                 
                 if attempt < rate_limiter.retry_attempts - 1:
-                    # Wait longer before retry (with some randomness)
-                    wait_time = (2 ** attempt) * 5 + random.uniform(0, 3)
+                    # Full jitter: chờ ngẫu nhiên trong [0, trần mũ] để các worker cùng bị 429 không retry đồng loạt
+                    cap = min(rate_limiter.max_backoff, rate_limiter.retry_backoff_base * (2 ** attempt))
+                    wait_time = random.uniform(0, cap)
                     print(f"🛡️ Waiting {wait_time:.1f}s before retry...")
                     time.sleep(wait_time)
                     continue
@@ -122,6 +211,46 @@ def rate_limited_call(func: Callable, *args, **kwargs) -> Any:
     
     return None
 
+async def rate_limited_call_async(func: Callable, *args, executor: Optional[concurrent.futures.Executor] = None, **kwargs) -> Any:
+    """
+    Bản async của rate_limited_call: chờ token và backoff trên event loop,
+    chỉ chiếm thread của executor trong lúc func (blocking) thực sự chạy
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    
+    def timed_call():
+        # Đo RTT trong thread của executor để không tính thời gian xếp hàng chờ thread
+        started = time.monotonic()
+        return call(), time.monotonic() - started
+    
+    for attempt in range(rate_limiter.retry_attempts):
+        try:
+            await rate_limiter.acquire_async()
+            result, rtt = await loop.run_in_executor(executor, timed_call)
+            rate_limiter.record_success(rtt)
+            
+            return result
+            
+        except Exception as e:
+            if is_rate_limit_error(e):
+                print(f"🛡️ Rate limit detected on attempt {attempt + 1}: {str(e)}")
+                rate_limiter.increase_delay()
+                
+                if attempt < rate_limiter.retry_attempts - 1:
+                    cap = min(rate_limiter.max_backoff, rate_limiter.retry_backoff_base * (2 ** attempt))
+                    wait_time = random.uniform(0, cap)
+                    print(f"🛡️ Waiting {wait_time:.1f}s before retry...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                else:
+                    print(f"🛡️ Max retries reached, giving up")
+                    raise
+            else:
+                raise
+    
+    return None
+
 def rate_limited_vnstock_call(func: Callable, *args, **kwargs) -> Any:
     """
     Specific wrapper cho vnstock API calls
@@ -130,37 +259,20 @@ def rate_limited_vnstock_call(func: Callable, *args, **kwargs) -> Any:
 
 def batch_rate_limited_calls(func_list: list, max_concurrent: int = 5) -> list:
     """
-    Thực hiện batch calls với rate limiting
+    Thực hiện batch calls song song (tối đa max_concurrent) - token bucket của rate_limiter điều tốc,
+    kết quả giữ đúng thứ tự func_list (None nếu call lỗi)
     """
-    results = []
-    
-    # Process in smaller batches
-    for i in range(0, len(func_list), max_concurrent):
-        batch = func_list[i:i + max_concurrent]
-        batch_results = []
-        
-        print(f"🛡️ Processing batch {i//max_concurrent + 1}: {len(batch)} calls")
-        
-        for func_call in batch:
-            func, args, kwargs = func_call
-            try:
-                result = rate_limited_call(func, *args, **kwargs)
-                batch_results.append(result)
-            except Exception as e:
-                print(f"🛡️ Batch call failed: {str(e)}")
-                batch_results.append(None)
-            
-            # Small delay between calls in the same batch
-            time.sleep(0.2)
-        
-        results.extend(batch_results)
-        
-        # Longer delay between batches
-        if i + max_concurrent < len(func_list):
-            print(f"🛡️ Batch completed, waiting before next batch...")
-            time.sleep(2.0)
+    def _call(func_call):
+        func, args, kwargs = func_call
+        try:
+            return rate_limited_call(func, *args, **kwargs)
+        except Exception as e:
+            print(f"🛡️ Batch call failed: {str(e)}")
+            return None
     
-    return results
+    print(f"🛡️ Processing {len(func_list)} calls (max {max_concurrent} concurrent)")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        return list(executor.map(_call, func_list))
 
 # Decorator for automatic rate limiting
 def rate_limited(func):
@@ -55,23 +55,32 @@ def print_startup_info():
     """
     📊 Print startup information
     """
-    print("\n" + "="*60)
-    print("🚀 GTI STOCK ANALYSIS API")
-    print("="*60)
-    print(f"📊 Version: {config.API_VERSION}")
-    print(f"🌐 Host: {config.API_HOST}")
-    print(f"🔌 Port: {config.API_PORT}")
-    print(f"🔧 Environment: {os.getenv('ENVIRONMENT', 'development')}")
-    print(f"📅 Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("\n📚 API Endpoints:")
-    print(f"   🏠 Root: http://{config.API_HOST}:{config.API_PORT}/")
-    print(f"   📊 Analysis: http://{config.API_HOST}:{config.API_PORT}/full-analysis/FPT")
-    print(f"   📖 Docs: http://{config.API_HOST}:{config.API_PORT}/docs")
-    print(f"   🔍 ReDoc: http://{config.API_HOST}:{config.API_PORT}/redoc")
-    print("\n🎯 Quick Test Commands:")
-    print(f"   curl http://{config.API_HOST}:{config.API_PORT}/full-analysis/FPT")
-    print(f"   curl http://{config.API_HOST}:{config.API_PORT}/gti-info")
-    print("="*60)
+    base_url = f"http://{config.API_HOST}:{config.API_PORT}"
+    # Ghép cả banner rồi ghi một lần - không xen lẫn với log từ thread khác
+    banner = "\n".join([
+        "",
+        "="*60,
+        "🚀 GTI STOCK ANALYSIS API",
+        "="*60,
+        f"📊 Version: {config.API_VERSION}",
+        f"🌐 Host: {config.API_HOST}",
+        f"🔌 Port: {config.API_PORT}",
+        f"🔧 Environment: {os.getenv('ENVIRONMENT', 'development')}",
+        f"📅 Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "",
+        "📚 API Endpoints:",
+        f"   🏠 Root: {base_url}/",
+        f"   📊 Analysis: {base_url}/full-analysis/FPT",
+        f"   📖 Docs: {base_url}/docs",
+        f"   🔍 ReDoc: {base_url}/redoc",
+        "",
+        "🎯 Quick Test Commands:",
+        f"   curl {base_url}/full-analysis/FPT",
+        f"   curl {base_url}/gti-info",
+        "="*60,
+    ])
+    sys.stdout.write(banner + "\n")
+    sys.stdout.flush()
 
 def check_dependencies():
     """
@@ -110,8 +119,9 @@ def main():
     logger = setup_logging()
     logger.info("🚀 Starting GTI Stock Analysis API...")
     
-    # Check dependencies
-    if not check_dependencies():
+    # Check dependencies - production bỏ qua: import main_api ngay sau đó tự báo lỗi nếu thiếu module,
+    # và process cha của multi-worker không phải nạp pandas/vnstock chỉ để kiểm tra
+    if environment != 'production' and not check_dependencies():
         sys.exit(1)
     
     # Print startup info
@@ -134,10 +144,22 @@ def main():
         logger.info(f"🔄 Auto-reload: {enable_reload}")
         
         # Force disable watchfiles in production by setting specific config
-        if environment == 'production':
+        if environment == 'production' and config.UVICORN_WORKERS > 1:
+            # Multi-process: uvicorn cần import string để spawn worker
+            uvicorn.run(
+                "main_api:app",
+                host=host,
+                port=port,
+                log_level="info",
+                access_log=False,
+                use_colors=False,
+                workers=config.UVICORN_WORKERS,
+                loop="uvloop",
+                http="httptools"
+            )
+        elif environment == 'production':
             # Import app directly and run with minimal config for production
             from main_api import app
-            import uvicorn
             
             config_obj = uvicorn.Config(
                 app,
@@ -147,7 +169,9 @@ def main():
                 access_log=False,  # Disable access log in production to reduce noise
                 reload=False,      # Absolutely no reload
                 use_colors=False,  # Disable colors for production logs
-                workers=1          # Single worker to avoid file watching
+                workers=1,         # Single worker to avoid file watching
+                loop="uvloop",     # ⚡ uvloop + httptools (uvicorn[standard])
+                http="httptools"
             )
             server = uvicorn.Server(config_obj)
             server.run()
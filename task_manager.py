@@ -1,20 +1,25 @@
+import asyncio
 import uuid
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, Any, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 import concurrent.futures
+import hashlib
 import traceback
+import orjson
 
 # Import scanning functions
 from lay_data_stock import (
     market_scan_top_picks,
     market_scan_by_category,
-    market_scan_parallel
+    market_scan_parallel,
+    parse_stock_list
 )
 from config import GTIConfig
+from cache_manager import gti_cache, redis
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -35,6 +40,18 @@ class Task:
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
     progress_message: str = "Đang khởi tạo tác vụ..."
+    # Tiến trình dạng số (mã đã quét / tổng số mã) - client vẽ progress bar không cần parse message
+    progress_processed: int = 0
+    progress_total: int = 0
+    # Mốc monotonic lúc tạo - tính hết hạn không bị lệch khi đồng hồ hệ thống bị chỉnh
+    created_monotonic: float = field(default_factory=time.monotonic, repr=False, compare=False)
+    # Khóa riêng từng task: chỉ bảo vệ chuyển trạng thái/kết quả, poll task khác không phải chờ
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    # Dict trạng thái đã dựng + (status, progress_message) lúc dựng → poll lặp lại trả luôn
+    _status_cache: Optional[Dict[str, Any]] = field(default=None, repr=False, compare=False)
+    _status_cache_key: Optional[tuple] = field(default=None, repr=False, compare=False)
+    # Mốc monotonic lần cuối ghi Redis - tiến trình chỉ ghi lại khi quá TASK_PROGRESS_PERSIST_SECONDS
+    _persisted_at: float = field(default=0.0, repr=False, compare=False)
 
 class TaskManager:
     """
@@ -45,13 +62,29 @@ class TaskManager:
     
     def __init__(self):
         self.tasks: Dict[str, Task] = {}
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
-        self.lock = threading.Lock()
+        self.active_tasks: Dict[str, str] = {}  # khóa tham số → task_id đang chạy (gộp yêu cầu trùng)
+        # Pool riêng cho task nền, tách khỏi threadpool của FastAPI (endpoint /task/* là async nên poll không chờ pool này)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=GTIConfig.TASK_MAX_WORKERS, thread_name_prefix="gti-task"
+        )
+        # custom_scan danh sách lớn chạy ở pool riêng → không chiếm slot của top_picks/sector_scan
+        self.bulk_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=GTIConfig.TASK_BULK_WORKERS, thread_name_prefix="gti-task-bulk"
+        )
+        self.lock = threading.Lock()  # Chỉ cho active_tasks; self.tasks đọc/ghi từng key (atomic dưới GIL)
+        # Redis (REDIS_URL) dùng chung với gti_cache: trạng thái/kết quả task tra được từ mọi worker
+        self.redis = gti_cache.redis
+        # task_type → hàm thực thi
+        self._handlers = {
+            "top_picks": self._execute_top_picks,
+            "sector_scan": lambda task: self._execute_named_scan(task, "sector", None, "ngành"),
+            "category_scan": lambda task: self._execute_named_scan(task, "category", "vn30", "danh mục"),
+            "custom_scan": self._execute_custom_scan,
+        }
         
-        # Auto cleanup expired tasks every 30 minutes
-        self.cleanup_timer = threading.Timer(1800, self._cleanup_expired_tasks)
-        self.cleanup_timer.daemon = True
-        self.cleanup_timer.start()
+        # Auto cleanup expired tasks every 30 minutes (một daemon thread sống suốt process)
+        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, name="gti-task-cleanup", daemon=True)
+        self._cleanup_thread.start()
     
     def create_task(self, task_type: str, parameters: Dict[str, Any]) -> str:
         """
@@ -64,7 +97,13 @@ class TaskManager:
         Returns:
             task_id: ID duy nhất của task
         """
-        task_id = str(uuid.uuid4())
+        active_key = self._active_key(task_type, parameters)
+        task_id = uuid.uuid4().hex  # 32 ký tự, không đoán được → client khác không dò ra kết quả task
+        
+        # Cùng loại scan + tham số đang chạy → trả về task sẵn có thay vì quét lại
+        existing_id = self._claim_active(active_key, task_id)
+        if existing_id is not None:
+            return existing_id
         
         task = Task(
             task_id=task_id,
@@ -74,14 +113,29 @@ class TaskManager:
             created_at=datetime.now()
         )
         
-        with self.lock:
-            self.tasks[task_id] = task
+        self.tasks[task_id] = task
+        self._persist(task)
+        # Giữ lease gti_task_active cả lúc task còn xếp hàng trong pool
+        lease = self._keep_lease(active_key)
         
         # Submit task to background executor
-        future = self.executor.submit(self._execute_task, task_id)
+        future = self._executor_for(task).submit(self._execute_task, task_id, active_key, lease)
         
         return task_id
     
+    async def acreate_task(self, task_type: str, parameters: Dict[str, Any]) -> str:
+        """create_task cho endpoint async: SET NX/pipeline Redis chạy ở thread, không chặn event loop"""
+        if self.redis is None:
+            return self.create_task(task_type, parameters)
+        return await asyncio.to_thread(self.create_task, task_type, parameters)
+    
+    def _executor_for(self, task: Task) -> concurrent.futures.Executor:
+        if task.task_type == "custom_scan":
+            stock_list = parse_stock_list(task.parameters.get("stocks", ""))
+            if len(stock_list) >= GTIConfig.TASK_BULK_MIN_STOCKS:
+                return self.bulk_executor
+        return self.executor
+    
     def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """
         Kiểm tra trạng thái của task
@@ -92,27 +146,39 @@ class TaskManager:
         Returns:
             Dict chứa thông tin trạng thái hoặc None nếu không tìm thấy
         """
-        with self.lock:
-            task = self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
             
         if not task:
-            return None
+            return self._load_remote(task_id)
             
         # Check if task is expired (older than 1 hour)
-        if datetime.now() - task.created_at > timedelta(hours=1):
-            task.status = TaskStatus.EXPIRED
+        if time.monotonic() - task.created_monotonic > GTIConfig.TASK_TTL_SECONDS:
+            with task._lock:
+                task.status = TaskStatus.EXPIRED
             
-        return {
-            "task_id": task.task_id,
-            "task_type": task.task_type,
-            "status": task.status.value,
-            "created_at": task.created_at.isoformat(),
-            "started_at": task.started_at.isoformat() if task.started_at else None,
-            "completed_at": task.completed_at.isoformat() if task.completed_at else None,
-            "progress_message": task.progress_message,
-            "error": task.error,
-            "has_result": task.result is not None
-        }
+        return self._status_dict(task)
+    
+    def _status_dict(self, task: Task) -> Dict[str, Any]:
+        with task._lock:
+            # started_at/completed_at/error/result chỉ đổi cùng lúc với status (dưới task._lock)
+            cache_key = (task.status, task.progress_message, task.progress_processed, task.progress_total)
+            if task._status_cache_key == cache_key:
+                return task._status_cache
+            
+            task._status_cache = {
+                "task_id": task.task_id,
+                "task_type": task.task_type,
+                "status": task.status.value,
+                "created_at": task.created_at.isoformat(),
+                "started_at": task.started_at.isoformat() if task.started_at else None,
+                "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+                "progress_message": task.progress_message,
+                "progress": {"processed": task.progress_processed, "total": task.progress_total},
+                "error": task.error,
+                "has_result": task.result is not None
+            }
+            task._status_cache_key = cache_key
+            return task._status_cache
     
     def get_task_result(self, task_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -124,58 +190,158 @@ class TaskManager:
         Returns:
             Dict chứa kết quả hoặc None nếu chưa hoàn thành/không tìm thấy
         """
-        with self.lock:
-            task = self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
             
-        if not task or task.status != TaskStatus.COMPLETED:
+        if not task:
+            return self._load_remote(task_id, suffix=":result")
+        if task.status != TaskStatus.COMPLETED:
             return None
             
         return task.result
     
-    def _execute_task(self, task_id: str):
+    # ⚡ Bản async cho endpoint/SSE: task của process này trả ngay, chỉ lượt đọc Redis mới sang thread
+    async def aget_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        if task_id in self.tasks or self.redis is None:
+            return self.get_task_status(task_id)
+        return await asyncio.to_thread(self._load_remote, task_id)
+    
+    async def aget_task_result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        if task_id in self.tasks or self.redis is None:
+            return self.get_task_result(task_id)
+        return await asyncio.to_thread(self._load_remote, task_id, ":result")
+    
+    # 🗄️ Redis (tùy chọn): bản sao trạng thái/kết quả có TTL + khóa gộp task trùng tham số
+    @staticmethod
+    def _active_key(task_type: str, parameters: Dict[str, Any]) -> str:
+        params = orjson.dumps(parameters, option=orjson.OPT_SORT_KEYS)
+        return f"{task_type}:{hashlib.md5(params).hexdigest()[:12]}"
+    
+    def _claim_active(self, active_key: str, task_id: str) -> Optional[str]:
+        """Đăng ký task_id cho active_key; trả về task_id đang chạy nếu đã có"""
+        with self.lock:
+            existing_id = self.active_tasks.get(active_key)
+            if existing_id is not None:
+                return existing_id
+            self.active_tasks[active_key] = task_id
+        
+        if self.redis is not None:
+            try:
+                redis_key = f"gti_task_active:{active_key}"
+                if not self.redis.set(redis_key, task_id, nx=True, ex=GTIConfig.TASK_ACTIVE_LEASE_SECONDS):
+                    existing_id = self.redis.get(redis_key)
+                    if existing_id is not None:
+                        with self.lock:
+                            self.active_tasks.pop(active_key, None)
+                        return existing_id.decode()
+            except redis.RedisError as e:
+                print(f"⚠️ Redis lock task lỗi: {e}")
+        return None
+    
+    def _keep_lease(self, active_key: str) -> threading.Event:
+        """Gia hạn lease gti_task_active trong lúc task chờ/chạy; set() event trả về để dừng"""
+        stop = threading.Event()
+        if self.redis is not None:
+            threading.Thread(
+                target=self._renew_lease, args=(active_key, stop), name="gti-task-lease", daemon=True
+            ).start()
+        return stop
+    
+    def _renew_lease(self, active_key: str, stop: threading.Event):
+        # Lease ngắn: worker chết giữa chừng thì khóa tự hết hạn sau TASK_ACTIVE_LEASE_SECONDS, không chặn 1 giờ
+        redis_key = f"gti_task_active:{active_key}"
+        while not stop.wait(GTIConfig.TASK_ACTIVE_LEASE_SECONDS / 3):
+            try:
+                self.redis.expire(redis_key, GTIConfig.TASK_ACTIVE_LEASE_SECONDS)
+            except redis.RedisError as e:
+                print(f"⚠️ Redis gia hạn lease task lỗi: {e}")
+    
+    def _release_active(self, active_key: str):
+        with self.lock:
+            self.active_tasks.pop(active_key, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(f"gti_task_active:{active_key}")
+            except redis.RedisError as e:
+                print(f"⚠️ Redis unlock task lỗi: {e}")
+    
+    def _persist(self, task: Task):
+        """Ghi trạng thái (và kết quả nếu có) lên Redis với TTL thay cho vòng cleanup"""
+        if self.redis is None:
+            return
+        task._persisted_at = time.monotonic()
+        try:
+            key = f"gti_task:{task.task_id}"
+            pipe = self.redis.pipeline()
+            pipe.set(key, orjson.dumps(self._status_dict(task)), ex=GTIConfig.TASK_TTL_SECONDS)
+            if task.result is not None:
+                pipe.set(
+                    f"{key}:result",
+                    orjson.dumps(task.result, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY),
+                    ex=GTIConfig.TASK_TTL_SECONDS
+                )
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"⚠️ Redis lưu task {task.task_id} lỗi: {e}")
+    
+    def _load_remote(self, task_id: str, suffix: str = "") -> Optional[Dict[str, Any]]:
+        """Đọc trạng thái/kết quả task do worker khác tạo (None nếu không có Redis hoặc đã hết hạn)"""
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(f"gti_task:{task_id}{suffix}")
+        except redis.RedisError as e:
+            print(f"⚠️ Redis đọc task {task_id} lỗi: {e}")
+            return None
+        return orjson.loads(raw) if raw is not None else None
+    
+    def _execute_task(self, task_id: str, active_key: str = None, lease: threading.Event = None):
         """
         Thực thi task trong background thread
         """
-        with self.lock:
-            task = self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
             
         if not task:
             return
             
         try:
             # Update status to running
-            task.status = TaskStatus.RUNNING
-            task.started_at = datetime.now()
-            task.progress_message = "Đang thực hiện phân tích..."
+            with task._lock:
+                task.status = TaskStatus.RUNNING
+                task.started_at = datetime.now()
+                task.progress_message = "Đang thực hiện phân tích..."
+            self._persist(task)
             
             # Execute based on task type
-            if task.task_type == "top_picks":
-                result = self._execute_top_picks(task)
-            elif task.task_type == "sector_scan":
-                result = self._execute_sector_scan(task)
-            elif task.task_type == "category_scan":
-                result = self._execute_category_scan(task)
-            elif task.task_type == "custom_scan":
-                result = self._execute_custom_scan(task)
-            else:
+            handler = self._handlers.get(task.task_type)
+            if handler is None:
                 raise ValueError(f"Unknown task type: {task.task_type}")
+            result = handler(task)
             
             # Update task with result
-            task.status = TaskStatus.COMPLETED
-            task.completed_at = datetime.now()
-            task.result = result
-            task.progress_message = "Hoàn thành phân tích!"
+            with task._lock:
+                task.status = TaskStatus.COMPLETED
+                task.completed_at = datetime.now()
+                task.result = result
+                task.progress_message = "Hoàn thành phân tích!"
             
         except Exception as e:
             # Handle errors
-            task.status = TaskStatus.FAILED
-            task.completed_at = datetime.now()
-            task.error = str(e)
-            task.progress_message = f"Lỗi: {str(e)}"
+            with task._lock:
+                task.status = TaskStatus.FAILED
+                task.completed_at = datetime.now()
+                task.error = str(e)
+                task.progress_message = f"Lỗi: {str(e)}"
             
             # Log the full traceback for debugging
             print(f"Task {task_id} failed with error: {e}")
             print(traceback.format_exc())
+        
+        finally:
+            self._persist(task)
+            if lease is not None:
+                lease.set()
+            if active_key is not None:
+                self._release_active(active_key)
     
     def _execute_top_picks(self, task: Task) -> Dict[str, Any]:
         """Thực thi top picks scan"""
@@ -191,52 +357,32 @@ class TaskManager:
             "execution_time": (task.completed_at - task.started_at).total_seconds() if task.completed_at and task.started_at else None
         }
     
-    def _execute_sector_scan(self, task: Task) -> Dict[str, Any]:
-        """Thực thi sector scan"""
-        sector = task.parameters.get("sector")
-        task.progress_message = f"Đang quét ngành {sector}..."
+    def _execute_named_scan(self, task: Task, key: str, default: Optional[str], label: str) -> Dict[str, Any]:
+        """Thực thi scan theo tên ngành (sector_scan) hoặc danh mục (category_scan: vn30, popular, etc.)"""
+        name = task.parameters.get(key, default)
+        task.progress_message = f"Đang quét {label} {name}..."
         
         min_gti_score = task.parameters.get("min_gti_score", 2)
         min_combined_score = task.parameters.get("min_combined_score", 3)
         
         result = market_scan_by_category(
-            category=sector,
+            category=name,
             min_gti_score=min_gti_score,
-            min_combined_score=min_combined_score
+            min_combined_score=min_combined_score,
+            on_progress=self._progress_reporter(task, f"{label} {name}")
         )
         
         return {
-            "task_type": "sector_scan", 
+            "task_type": task.task_type,
             "parameters": task.parameters,
             "scan_result": result,
             "execution_time": (task.completed_at - task.started_at).total_seconds() if task.completed_at and task.started_at else None
         }
     
-    def _execute_category_scan(self, task: Task) -> Dict[str, Any]:
-        """Thực thi category scan (vn30, popular, etc.)"""
-        category = task.parameters.get("category", "vn30")
-        task.progress_message = f"Đang quét danh mục {category}..."
-        
-        min_gti_score = task.parameters.get("min_gti_score", 2)
-        min_combined_score = task.parameters.get("min_combined_score", 3)
-        
-        result = market_scan_by_category(
-            category=category,
-            min_gti_score=min_gti_score,
-            min_combined_score=min_combined_score
-        )
-        
-        return {
-            "task_type": "category_scan",
-            "parameters": task.parameters, 
-            "scan_result": result,
-            "execution_time": (task.completed_at - task.started_at).total_seconds() if task.completed_at and task.started_at else None
-        }
-    
     def _execute_custom_scan(self, task: Task) -> Dict[str, Any]:
         """Thực thi custom list scan"""
         stocks_str = task.parameters.get("stocks", "")
-        stock_list = [s.strip().upper() for s in stocks_str.split(",") if s.strip()]
+        stock_list = parse_stock_list(stocks_str)
         
         task.progress_message = f"Đang quét {len(stock_list)} mã cổ phiếu..."
         
@@ -246,7 +392,8 @@ class TaskManager:
         result = market_scan_parallel(
             stock_list=stock_list,
             min_gti_score=min_gti_score,
-            min_combined_score=min_combined_score
+            min_combined_score=min_combined_score,
+            on_progress=self._progress_reporter(task, "danh sách tùy chỉnh")
         )
         
         return {
@@ -256,52 +403,62 @@ class TaskManager:
             "execution_time": (task.completed_at - task.started_at).total_seconds() if task.completed_at and task.started_at else None
         }
     
+    def _progress_reporter(self, task: Task, label: str):
+        """📈 Callback cho market_scan_parallel: ghi tiến trình từng mã vào progress_message (status/SSE thấy ngay)"""
+        def report(processed: int, qualified: int, total: int):
+            task.progress_processed, task.progress_total = processed, total
+            task.progress_message = f"Đang quét {label}: {processed}/{total} mã, {qualified} mã đạt tiêu chí"
+            # Worker khác đọc tiến trình từ Redis → ghi lại, nhưng thưa để không thêm round-trip cho từng mã
+            if self.redis is not None and time.monotonic() - task._persisted_at >= GTIConfig.TASK_PROGRESS_PERSIST_SECONDS:
+                self._persist(task)
+        return report
+    
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(1800)
+            try:
+                self._cleanup_expired_tasks()
+            except Exception as e:
+                print(f"Task cleanup failed: {e}")
+    
     def _cleanup_expired_tasks(self):
         """
         Cleanup expired tasks (older than 1 hour)
         """
-        current_time = datetime.now()
-        expired_threshold = timedelta(hours=1)
+        expired_before = time.monotonic() - GTIConfig.TASK_TTL_SECONDS
         
-        with self.lock:
-            expired_task_ids = [
-                task_id for task_id, task in self.tasks.items()
-                if current_time - task.created_at > expired_threshold
-            ]
-            
-            for task_id in expired_task_ids:
-                del self.tasks[task_id]
+        # Duyệt trên snapshot, không khóa → poll/task đang chạy không bị chặn trong lúc dọn
+        expired_task_ids = [
+            task_id for task_id, task in list(self.tasks.items())
+            if task.created_monotonic < expired_before
+        ]
+        
+        for task_id in expired_task_ids:
+            self.tasks.pop(task_id, None)
         
         if expired_task_ids:
             print(f"Cleaned up {len(expired_task_ids)} expired tasks")
-        
-        # Schedule next cleanup
-        self.cleanup_timer = threading.Timer(1800, self._cleanup_expired_tasks)
-        self.cleanup_timer.daemon = True
-        self.cleanup_timer.start()
     
     def get_stats(self) -> Dict[str, Any]:
         """
         Lấy thống kê về task manager
         """
-        with self.lock:
-            total_tasks = len(self.tasks)
-            status_counts = {}
-            
-            for status in TaskStatus:
-                status_counts[status.value] = sum(
-                    1 for task in self.tasks.values() 
-                    if task.status == status
-                )
+        tasks = list(self.tasks.values())
+        total_tasks = len(tasks)
+        status_counts = {status.value: 0 for status in TaskStatus}
+        for task in tasks:
+            status_counts[task.status.value] += 1
         
         return {
             "total_tasks": total_tasks,
             "status_breakdown": status_counts,
             "executor_info": {
                 "max_workers": self.executor._max_workers,
-                "active_threads": self.executor._threads
+                "active_threads": len(self.executor._threads),
+                "bulk_max_workers": self.bulk_executor._max_workers,
+                "bulk_active_threads": len(self.bulk_executor._threads)
             }
         }
 
 # Global task manager instance
-task_manager = TaskManager() 
\ No newline at end of file
+task_manager = TaskManager() 
@@ -14,16 +14,17 @@ VERSION_FULL = f"{VERSION}.{VERSION_BUILD}"
 
 # 📅 Build Information
 BUILD_DATE = "2024-12-28"
-BUILD_TIME = datetime.now().strftime("%H:%M:%S")
-BUILD_TIMESTAMP = datetime.now().isoformat()
+_BUILD_NOW = datetime.now()  # Một mốc duy nhất → BUILD_TIME và BUILD_TIMESTAMP luôn khớp nhau
+BUILD_TIME = f"{_BUILD_NOW.hour:02d}:{_BUILD_NOW.minute:02d}:{_BUILD_NOW.second:02d}"
+BUILD_TIMESTAMP = _BUILD_NOW.isoformat()
 
 # 🎯 Release Information
 RELEASE_NAME = "GTI Pattern Detection"
 RELEASE_CODENAME = "Golden Eagle"
 RELEASE_TYPE = "stable"  # alpha, beta, rc, stable
 
-# 🌟 Features in this version
-FEATURES = [
+# 🌟 Features in this version (tuple - dùng chung trong _VERSION_INFO, không bị sửa nhầm)
+FEATURES = (
     "GTI Analysis System (Growth Trading Intelligence)",
     "12 Free Pattern Detection algorithms",
     "Combined GTI + Pattern scoring system",
@@ -32,7 +33,7 @@ FEATURES = [
     "VN30 stock market support",
     "Real-time analysis capabilities",
     "Custom GPT integration ready"
-]
+)
 
 # 🔧 System Requirements
 REQUIREMENTS = {
@@ -65,7 +66,7 @@ CHANGELOG = {
     "3.0.0": {
         "date": "2024-12-28",
         "type": "major",
-        "changes": [
+        "changes": (
             "✨ Added 12 free pattern detection algorithms",
             "🚀 Implemented GTI (Growth Trading Intelligence) system",
             "📊 Combined scoring system GTI + Patterns",
@@ -74,51 +75,51 @@ CHANGELOG = {
             "📚 Comprehensive documentation and examples",
             "🎯 Custom GPT integration ready",
             "⚡ Async support for high performance"
-        ]
+        )
     },
     "2.0.0": {
         "date": "2024-12-20",
         "type": "major", 
-        "changes": [
+        "changes": (
             "🔧 GTI system implementation",
             "📈 Basic pattern detection",
             "🌐 FastAPI integration"
-        ]
+        )
     },
     "1.0.0": {
         "date": "2024-12-01",
         "type": "initial",
-        "changes": [
+        "changes": (
             "🎉 Initial release",
             "📊 Basic stock analysis",
             "🔌 vnstock integration"
-        ]
+        )
     }
 }
 
+# 📊 Mọi giá trị đều cố định sau khi import (BUILD_TIME/BUILD_TIMESTAMP chụp một lần) → dựng dict một lần
+_VERSION_INFO = {
+    "version": VERSION,
+    "version_full": VERSION_FULL,
+    "build_date": BUILD_DATE,
+    "build_time": BUILD_TIME,
+    "build_timestamp": BUILD_TIMESTAMP,
+    "release_name": RELEASE_NAME,
+    "release_codename": RELEASE_CODENAME,
+    "release_type": RELEASE_TYPE,
+    "features": FEATURES,
+    "requirements": REQUIREMENTS,
+    "api_info": API_INFO
+}
+
 def get_version_info():
     """
-    📊 Get complete version information
+    📊 Get complete version information (dict dùng chung - không sửa trực tiếp)
     """
-    return {
-        "version": VERSION,
-        "version_full": VERSION_FULL,
-        "build_date": BUILD_DATE,
-        "build_time": BUILD_TIME,
-        "build_timestamp": BUILD_TIMESTAMP,
-        "release_name": RELEASE_NAME,
-        "release_codename": RELEASE_CODENAME,
-        "release_type": RELEASE_TYPE,
-        "features": FEATURES,
-        "requirements": REQUIREMENTS,
-        "api_info": API_INFO
-    }
+    return _VERSION_INFO
 
-def get_build_banner():
-    """
-    🎨 Get formatted build banner for console output
-    """
-    banner = f"""
+# 🎨 Banner chỉ phụ thuộc các hằng số phía trên → dựng một lần lúc import
+_BUILD_BANNER = f"""
 ╔══════════════════════════════════════════════════════════════╗
 ║                  🚀 GTI Stock Analysis API                   ║
 ╠══════════════════════════════════════════════════════════════╣
@@ -132,27 +133,32 @@ def get_build_banner():
 ║  🚀 FastAPI + Docker Ready + Custom GPT Support             ║
 ╚══════════════════════════════════════════════════════════════╝
 """
-    return banner
+
+def _version_details() -> str:
+    latest_version = next(iter(CHANGELOG))
+    latest_changes = CHANGELOG[latest_version]
+    lines = ["\n📚 Features in this version:"]
+    lines += [f"   • {feature}" for feature in FEATURES]
+    lines.append("\n🔧 System Requirements:")
+    lines += [f"   • {req}: {version}" for req, version in REQUIREMENTS.items()]
+    lines.append("\n📅 Latest Changes:")
+    lines.append(f"   Version {latest_version} ({latest_changes['date']}):")
+    lines += [f"     {change}" for change in latest_changes['changes'][:5]]  # Show top 5 changes
+    return "\n".join(lines)
+
+_VERSION_DETAILS = _version_details()
+
+def get_build_banner():
+    """
+    🎨 Get formatted build banner for console output
+    """
+    return _BUILD_BANNER
 
 def print_version_info():
     """
     🖨️  Print version information to console
     """
-    print(get_build_banner())
-    print(f"\n📚 Features in this version:")
-    for feature in FEATURES:
-        print(f"   • {feature}")
-    
-    print(f"\n🔧 System Requirements:")
-    for req, version in REQUIREMENTS.items():
-        print(f"   • {req}: {version}")
-    
-    print(f"\n📅 Latest Changes:")
-    latest_version = list(CHANGELOG.keys())[0]
-    latest_changes = CHANGELOG[latest_version]
-    print(f"   Version {latest_version} ({latest_changes['date']}):")
-    for change in latest_changes['changes'][:5]:  # Show top 5 changes
-        print(f"     {change}")
+    print(f"{_BUILD_BANNER}\n{_VERSION_DETAILS}")
 
 if __name__ == "__main__":
     print_version_info() 
\ No newline at end of file